@@ -1,10 +1,10 @@
 from pathlib import Path
 from typing import List
-import json, argparse, random, time, os
+import json, argparse, random, time, os, functools
 import tiktoken
 from tiktoken.load import load_tiktoken_bpe
 from extra.models.llama import Transformer, convert_from_huggingface, convert_from_gguf, fix_bf16
-from tinygrad.nn.state import safe_load, torch_load, load_state_dict, get_parameters, gguf_load
+from tinygrad.nn.state import safe_load, torch_load, load_state_dict, get_parameters, gguf_load, ggml_dequantize, ggml_quantized_blocks
 from tinygrad import Tensor, dtypes, nn, Context, Device, GlobalCounters
 from tinygrad.helpers import Profiling, Timing, DEBUG, colored, fetch, tqdm
 
@@ -52,14 +52,14 @@ def concat_weights(models, device=None):
     return lazy_tensors[0].cat(*lazy_tensors[1:], dim=axis)
   return {name: convert(name) for name in {name: None for model in models for name in model}}
 
-def load(fn:str):
+def load(fn:str, quantized=False):
   if fn.endswith('.index.json'):
     with open(fn) as fp: weight_map = json.load(fp)['weight_map']
     parts = {n: load(str(Path(fn).parent / Path(n).name)) for n in set(weight_map.values())}
     return {k: parts[n][k] for k, n in weight_map.items()}
   elif fn.endswith(".gguf"):
     gguf_tensor = Tensor.empty(os.stat(fn).st_size, dtype=dtypes.uint8, device=f"disk:{fn}").to(Device.DEFAULT)
-    return gguf_load(gguf_tensor)[1]
+    return gguf_load(gguf_tensor, quantized)[1]
   elif fn.endswith(".safetensors"):
     return safe_load(fn)
   else:
@@ -105,6 +105,27 @@ class Int8Embedding:
     arange, idx, vals = self.arange.expand(big_shp), idx.reshape(idx.shape+(1, 1)).expand(big_shp), (self.weight.cast(self.scale.dtype).T*self.scale).T
     return (arange == idx).mul(vals).sum(-2, dtype=vals.dtype)
 
+class GGMLLinear:
+  # the weight stays in the ggml blocks of the gguf file, they are dequantized inside the matmul kernel that reads them
+  def __init__(self, in_features, out_features, bias=False):
+    assert not bias, "bias not supported"
+    self.weight, self.ggml_type = None, None
+
+  def __call__(self, x:Tensor) -> Tensor:
+    assert self.weight is not None, "load the weights with GGMLLinear.load"
+    return x.linear((self.weight if self.ggml_type is None else ggml_dequantize(self.weight, self.ggml_type).cast(x.dtype)).T)
+
+  @staticmethod
+  def load(model, weights:dict[str, Tensor]) -> dict[str, Tensor]:
+    # the blocks are set on the linears directly, the blocks of everything else are dequantized
+    ggml_types, new_weights = {nbytes: t for t,(_,nbytes) in ggml_quantized_blocks.items()}, {}
+    for k,v in weights.items():
+      obj = functools.reduce(lambda o,a: o[int(a)] if isinstance(o, list) else getattr(o, a, None), k.split(".")[:-1], model)
+      quantized = v.dtype == dtypes.uint8 and v.ndim == 3
+      if isinstance(obj, GGMLLinear): obj.weight, obj.ggml_type = v.realize(), ggml_types[v.shape[-1]] if quantized else None
+      else: new_weights[k] = ggml_dequantize(v, ggml_types[v.shape[-1]]).cast(dtypes.float16) if quantized else v
+    return new_weights
+
 def NF4Linear(block_size):
   _CODE = [
     -1.0, -0.6961928009986877, -0.5250730514526367, -0.39491748809814453, -0.28444138169288635, -0.18477343022823334, -0.09105003625154495, 0.0,
@@ -161,6 +182,7 @@ def build_transformer(model_path: Path, model_size="8B", quantize=None, scale_dt
   # build model
   if quantize == "int8": linear, embedding, quantize_embeds = Int8Linear, Int8Embedding, True
   elif quantize == "nf4": linear, embedding, quantize_embeds = NF4Linear(64), nn.Embedding, False
+  elif quantize == "gguf": linear, embedding, quantize_embeds = GGMLLinear, nn.Embedding, False
   else: linear, embedding, quantize_embeds = nn.Linear, nn.Embedding, False
   model = Transformer(**MODEL_PARAMS[model_size]["args"], linear=linear, embedding=embedding, max_context=max_context, jit=True)
 
@@ -171,7 +193,7 @@ def build_transformer(model_path: Path, model_size="8B", quantize=None, scale_dt
     elif (model_path / "model.safetensors").exists(): weights = load(str(model_path / "model.safetensors"))
     else: weights = concat_weights([load(str(model_path / f"consolidated.{i:02d}.pth")) for i in range(MODEL_PARAMS[model_size]["files"])], device[0] if isinstance(device, tuple) else device)
   else:
-    weights = load(str(model_path))
+    weights = load(str(model_path), quantized=quantize == "gguf")
   if "model.embed_tokens.weight" in weights:
     weights = convert_from_huggingface(weights, model, MODEL_PARAMS[model_size]["args"]["n_heads"], MODEL_PARAMS[model_size]["args"]["n_kv_heads"])
   elif "token_embd.weight" in weights:
@@ -181,6 +203,9 @@ def build_transformer(model_path: Path, model_size="8B", quantize=None, scale_dt
   with Context(BEAM=0):
     # quantize
     if quantize == "float16": weights = {k:v.cast(quantize).contiguous() for k,v in weights.items()}
+    elif quantize == "gguf":
+      assert model_path.suffix == ".gguf", "gguf quantization keeps the quantized weights of a .gguf file"
+      weights = linear.load(model, weights)
     elif quantize is not None:
       weights = linear.quantize(weights, device, scale_dtype, quantize_embeds)
       for _,v in weights.items(): v.realize()
@@ -189,10 +214,10 @@ def build_transformer(model_path: Path, model_size="8B", quantize=None, scale_dt
     if isinstance(device, tuple):
       for k,v in nn.state.get_state_dict(model).items():
         if 'scale' in k: v.shard_(device, axis=None)  # from quantized
-        elif '.attention.' in k: v.shard_(device, axis=-1)
+        elif '.attention.' in k: v.shard_(device, axis=-2 if v.ndim == 3 else -1)  # the ggml blocks shard on the blocks
         elif '.feed_forward.w1.' in k: v.shard_(device, axis=0)
         elif '.feed_forward.w3.' in k: v.shard_(device, axis=0)
-        elif '.feed_forward.' in k: v.shard_(device, axis=-1)
+        elif '.feed_forward.' in k: v.shard_(device, axis=-2 if v.ndim == 3 else -1)
         elif 'tok_embeddings.weight' in k: v.shard_(device, axis=0)
         elif 'output.weight' in k: v.shard_(device, axis=0)
         else: v.shard_(device, axis=None)
@@ -236,7 +261,7 @@ if __name__ == "__main__":
   parser.add_argument("--model", type=Path, help="Model path")
   parser.add_argument("--size", choices=["1B", "8B", "70B"], default="1B", help="Model size")
   parser.add_argument("--shard", type=int, default=1, help="Shard the model across multiple devices")
-  parser.add_argument("--quantize", choices=["int8", "nf4", "float16"], help="Quantization method")
+  parser.add_argument("--quantize", choices=["int8", "nf4", "float16", "gguf"], help="Quantization method, gguf keeps the gguf blocks")
   parser.add_argument("--no_api", action="store_true", help="Disable the api and run a cli test interface")
   parser.add_argument("--host", type=str, default="0.0.0.0", help="Web server bind address")
   parser.add_argument("--port", type=int, default=7776, help="Web server port")
@@ -1,7 +1,8 @@
 from typing import Union, Optional, Any
 import collections
+from dataclasses import dataclass, field
 from tinygrad import Tensor, Variable, TinyJit, dtypes, nn, Device
-from tinygrad.helpers import getenv, DEBUG
+from tinygrad.helpers import getenv, DEBUG, ceildiv
 
 # https://github.com/facebookresearch/llama/blob/1076b9c51c77ad06e9d7ba8a4c6df775741732bd/llama/model.py#L47
 def precompute_freqs_cis(dim: int, end: int, theta: float = 10000.0) -> Tensor:
@@ -33,6 +34,21 @@ def repeat_kv(x:Tensor, n_rep:int) -> Tensor:
   # NOTE: this is different from x.repeat((1, 1, n_rep, 1))
   return x.repeat((1, 1, 1, n_rep)).reshape(bs, seqlen, n_kv_heads * n_rep, head_dim)
 
+class PagedKVCache:
+  # the kv cache of all sequences is one pool of fixed size blocks, a sequence owns the blocks listed in its row of the block table
+  # block 0 is never handed out, the unused entries of a row and the idle batch slots point at it
+  def __init__(self, n_blocks:int, block_size:int, max_context:int):
+    self.n_blocks, self.block_size, self.max_blocks = n_blocks, block_size, ceildiv(max_context, block_size)
+    self.free_blocks = list(range(n_blocks-1, 0, -1))
+
+  def alloc(self, length:int) -> list[int]|None:
+    if (n:=ceildiv(length, self.block_size)) > len(self.free_blocks): return None
+    return [self.free_blocks.pop() for _ in range(n)]
+
+  def free(self, blocks:list[int]): self.free_blocks.extend(reversed(blocks))
+
+  def table(self, blocks:list[list[int]]) -> Tensor: return Tensor([b + [0]*(self.max_blocks-len(b)) for b in blocks], dtype=dtypes.int32)
+
 class Attention:
   def __init__(self, dim, n_heads, n_kv_heads, max_context, linear=nn.Linear, qk_norm:float|None=None):
     self.n_heads = n_heads
@@ -49,7 +65,8 @@ class Attention:
     self.q_norm = nn.RMSNorm(dim, qk_norm) if qk_norm is not None else None
     self.k_norm = nn.RMSNorm(dim, qk_norm) if qk_norm is not None else None
 
-  def __call__(self, x:Tensor, start_pos:Union[Variable,int], freqs_cis:Tensor, mask:Optional[Tensor]) -> Tensor:
+  def __call__(self, x:Tensor, start_pos:Union[Variable,int,Tensor], freqs_cis:Tensor, mask:Optional[Tensor],
+               kv:Optional[PagedKVCache]=None, block_table:Optional[Tensor]=None) -> Tensor:
     if getenv("WQKV"):
       if not hasattr(self, 'wqkv'): self.wqkv = Tensor.cat(self.wq.weight, self.wk.weight, self.wv.weight)
       xqkv = x @ self.wqkv.T
@@ -68,19 +85,23 @@ class Attention:
     xq, xk = apply_rotary_emb(xq, xk, freqs_cis)
     bsz, seqlen, _, _ = xq.shape
 
-    # create kv cache
-    if not hasattr(self, "cache_kv"):
-      self.cache_kv = Tensor.zeros(2, bsz, self.max_context, self.n_kv_heads, self.head_dim, dtype=x.dtype).contiguous().realize()
-      if isinstance(x.device, tuple):
-        # TODO: instead of specifying how to shard, it can follow how xk and xv are being sharded
-        self.cache_kv.shard_((x.device), axis=3 if getenv("SHARD_KVCACHE") else None).realize()
+    if kv is not None:
+      assert isinstance(start_pos, Tensor) and block_table is not None and seqlen == 1, "paged attention decodes one token of each sequence"
+      keys, values, mask = self.paged_cache(xk, xv, start_pos, kv, block_table)
+    else:
+      # create kv cache
+      if not hasattr(self, "cache_kv"):
+        self.cache_kv = Tensor.zeros(2, bsz, self.max_context, self.n_kv_heads, self.head_dim, dtype=x.dtype).contiguous().realize()
+        if isinstance(x.device, tuple):
+          # TODO: instead of specifying how to shard, it can follow how xk and xv are being sharded
+          self.cache_kv.shard_((x.device), axis=3 if getenv("SHARD_KVCACHE") else None).realize()
 
-    # update the cache
-    assert xk.dtype == xv.dtype == self.cache_kv.dtype, f"{xk.dtype=}, {xv.dtype=}, {self.cache_kv.dtype=}"
-    self.cache_kv.shrink((None, None, (start_pos, start_pos+seqlen), None, None)).assign(Tensor.stack(xk, xv)).realize()
+      # update the cache
+      assert xk.dtype == xv.dtype == self.cache_kv.dtype, f"{xk.dtype=}, {xv.dtype=}, {self.cache_kv.dtype=}"
+      self.cache_kv.shrink((None, None, (start_pos, start_pos+seqlen), None, None)).assign(Tensor.stack(xk, xv)).realize()
 
-    keys = self.cache_kv[0].shrink((None, (0, start_pos+seqlen), None, None))
-    values = self.cache_kv[1].shrink((None, (0, start_pos+seqlen), None, None))
+      keys = self.cache_kv[0].shrink((None, (0, start_pos+seqlen), None, None))
+      values = self.cache_kv[1].shrink((None, (0, start_pos+seqlen), None, None))
 
     keys, values = repeat_kv(keys, self.n_rep), repeat_kv(values, self.n_rep)
     xq, keys, values = xq.transpose(1, 2), keys.transpose(1, 2), values.transpose(1, 2)
@@ -88,6 +109,21 @@ class Attention:
     attn = attn.reshape(bsz, seqlen, -1)
     return self.wo(attn)
 
+  def paged_cache(self, xk:Tensor, xv:Tensor, pos:Tensor, kv:PagedKVCache, block_table:Tensor) -> tuple[Tensor, Tensor, Tensor]:
+    bsz = xk.shape[0]
+    if not hasattr(self, "cache_pool"):
+      self.cache_pool = Tensor.zeros(2, kv.n_blocks*kv.block_size, self.n_kv_heads, self.head_dim, dtype=xk.dtype).contiguous().realize()
+
+    # write the new token of each sequence to its slot, found through its block table
+    slot = (block_table * (Tensor.arange(kv.max_blocks) == (pos // kv.block_size).unsqueeze(1))).sum(1) * kv.block_size + pos % kv.block_size
+    new_kv = Tensor.stack(xk, xv).reshape(2, bsz, self.n_kv_heads, self.head_dim)
+    self.cache_pool.assign(self.cache_pool.scatter(1, slot.reshape(1, bsz, 1, 1).expand(new_kv.shape), new_kv)).realize()
+
+    # read all the blocks of each sequence, the positions past its own are masked
+    slots = (block_table.unsqueeze(-1) * kv.block_size + Tensor.arange(kv.block_size)).flatten(1)
+    mask = (Tensor.arange(slots.shape[1]) <= pos.unsqueeze(1)).reshape(bsz, 1, 1, slots.shape[1])
+    return self.cache_pool[0][slots], self.cache_pool[1][slots], mask
+
 class FeedForward:
   def __init__(self, dim:int, hidden_dim:int, linear=nn.Linear):
     self.w1 = linear(dim, hidden_dim, bias=False)
@@ -105,8 +141,9 @@ class TransformerBlock:
     self.attention_norm = nn.RMSNorm(dim, norm_eps)
     self.ffn_norm = nn.RMSNorm(dim, norm_eps)
 
-  def __call__(self, x:Tensor, start_pos:Union[Variable,int], freqs_cis:Tensor, mask:Optional[Tensor]):
-    h = x + self.attention(self.attention_norm(x), start_pos, freqs_cis, mask)
+  def __call__(self, x:Tensor, start_pos:Union[Variable,int,Tensor], freqs_cis:Tensor, mask:Optional[Tensor],
+               kv:Optional[PagedKVCache]=None, block_table:Optional[Tensor]=None):
+    h = x + self.attention(self.attention_norm(x), start_pos, freqs_cis, mask, kv, block_table)
     return (h + self.feed_forward(self.ffn_norm(h))).contiguous()
 
 # standard openai sampling
@@ -184,12 +221,78 @@ class Transformer:
 
     return sample(logits.flatten(), temperature, top_k, top_p, alpha_f, alpha_p).realize()
 
+  def forward_paged(self, tokens:Tensor, pos:Tensor, block_table:Tensor, kv:PagedKVCache, temperature:float) -> Tensor:
+    # one token of each sequence in the batch, each at its own position
+    h = self.tok_embeddings(tokens)
+    self.freqs_cis = self.freqs_cis.cast(h.dtype).realize()
+    freqs_cis = self.freqs_cis[0][pos].unsqueeze(1)
+    for layer in self.layers: h = layer(h, pos, freqs_cis, None, kv, block_table)
+    logits = self.output(self.norm(h)).float()[:, -1, :]
+    if temperature < 1e-6: return logits.argmax(-1).realize()
+    return (logits / temperature).softmax(-1).multinomial().flatten().realize()
+
   def __call__(self, tokens:Tensor, start_pos:int, temperature:float=0.0, top_k:int=0, top_p:float=0.8, alpha_f:float=0.0, alpha_p:float=0.0):
     # TODO: better way to handle the first call v.s. the rest?
     if tokens.shape[0:2] == (1,1) and self.forward_jit is not None and start_pos != 0:
       return self.forward_jit(tokens, Variable("start_pos", 1, self.max_context).bind(start_pos), temperature, top_k, top_p, alpha_f, alpha_p)
     return self.forward(tokens, start_pos, temperature, top_k, top_p, alpha_f, alpha_p)
 
+@dataclass
+class Request:
+  rid: int
+  prompt: list[int]
+  max_new_tokens: int
+  eos: Optional[int] = None
+  pos: int = 0
+  blocks: list[int] = field(default_factory=list)
+  out: list[int] = field(default_factory=list)
+
+class ContinuousBatcher:
+  # every step, each busy batch slot feeds one token: the next prompt token while prefilling, the last sampled token after that
+  # requests take a free slot once the blocks for prompt+max_new_tokens are free and give it back when done, so the step never changes shape
+  def __init__(self, model:Transformer, max_batch:int, n_blocks:int, block_size:int=16, temperature:float=0.0):
+    self.model, self.temperature = model, temperature
+    self.kv = PagedKVCache(n_blocks, block_size, model.max_context)
+    self.slots: list[Optional[Request]] = [None] * max_batch
+    self.waiting: collections.deque[Request] = collections.deque()
+    self.finished: dict[int, list[int]] = {}
+    self.step_jit = TinyJit(model.forward_paged)
+
+  def add(self, prompt:list[int], max_new_tokens:int, eos:Optional[int]=None) -> int:
+    if not prompt or len(prompt) + max_new_tokens > self.model.max_context: raise ValueError(f"{len(prompt)=} + {max_new_tokens=} must fit in max_context")
+    self.waiting.append(req:=Request(len(self.finished) + sum(s is not None for s in self.slots) + len(self.waiting), prompt, max_new_tokens, eos))
+    return req.rid
+
+  def step(self) -> dict[int, int]:
+    for i in range(len(self.slots)):
+      if self.slots[i] is None and self.waiting and (blocks:=self.kv.alloc(len(self.waiting[0].prompt)+self.waiting[0].max_new_tokens)) is not None:
+        (req:=self.waiting.popleft()).blocks = blocks
+        self.slots[i] = req
+    if all(s is None for s in self.slots): return {}
+
+    tokens = [[(s.prompt[s.pos] if s.pos < len(s.prompt) else s.out[-1]) if s is not None else 0] for s in self.slots]
+    pos = Tensor([s.pos if s is not None else 0 for s in self.slots], dtype=dtypes.int32)
+    block_table = self.kv.table([s.blocks if s is not None else [] for s in self.slots])
+    sampled = self.step_jit(Tensor(tokens, dtype=dtypes.int32), pos, block_table, self.kv, self.temperature).tolist()
+
+    ret: dict[int, int] = {}
+    for i,s in enumerate(self.slots):
+      if s is None: continue
+      # the output of the last prompt token is the first new token
+      s.pos += 1
+      if s.pos >= len(s.prompt):
+        ret[s.rid] = sampled[i]
+        s.out.append(sampled[i])
+        if len(s.out) == s.max_new_tokens or sampled[i] == s.eos:
+          self.finished[s.rid] = s.out
+          self.kv.free(s.blocks)
+          self.slots[i] = None
+    return ret
+
+  def run(self) -> dict[int, list[int]]:
+    while self.waiting or any(s is not None for s in self.slots): self.step()
+    return self.finished
+
 # *** helpers ***
 
 # TODO: model shouldn't be an input here, and n_kv_heads should support None
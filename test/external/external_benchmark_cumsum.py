@@ -0,0 +1,31 @@
+import time
+from tinygrad import Tensor, Device, GlobalCounters
+from tinygrad.ops import Ops, identity_element
+from tinygrad.helpers import getenv, round_up
+
+# the two stage scan cumsum used before the blocked scan, kept here to compare against
+def two_stage_cumsum(x:Tensor, SPLIT=256) -> Tensor:
+  if (s:=x.shape[-1]) <= SPLIT*2: return x._cumalu(-1, Ops.ADD)
+  ret = x.pad((round_up(s, SPLIT)-s, 0), value=identity_element(Ops.ADD, x.dtype)).unflatten(-1, (-1, SPLIT))._cumalu(-1, Ops.ADD)
+  base = ret[..., -1]._cumalu(-1, Ops.ADD, _include_initial=True)
+  return (ret + base.unsqueeze(-1).expand(*base.shape, ret.shape[-1])).flatten(start_dim=-2)[..., -s:]
+
+def bench(name, fxn, x:Tensor):
+  fxn(x).realize()
+  tms = []
+  for _ in range(getenv("CNT", 5)):
+    GlobalCounters.reset()
+    st = time.perf_counter()
+    fxn(x).realize()
+    Device[x.device].synchronize()
+    tms.append(time.perf_counter()-st)
+  print(f"{name:10s} {GlobalCounters.kernel_count:3d} kernels {GlobalCounters.global_ops*1e-6:10.2f} MOPs {min(tms)*1e3:9.2f} ms")
+
+if __name__ == "__main__":
+  # cumsum over a 128k vocab is what sampling with top-p does
+  for n in [getenv("N")] if getenv("N") else [4096, 32768, 128256, 1048576]:
+    print(f"*** cumsum of {n}")
+    x = Tensor.rand(getenv("BS", 1), n).realize()
+    if n <= 32768: bench("direct", lambda x: x._cumalu(-1, Ops.ADD), x)
+    bench("two stage", two_stage_cumsum, x)
+    bench("blocked", lambda x: x.cumsum(-1), x)
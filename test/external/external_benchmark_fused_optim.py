@@ -0,0 +1,27 @@
+import time
+from tinygrad import Tensor, TinyJit, Device, GlobalCounters
+from tinygrad.nn.optim import Adam
+from tinygrad.helpers import getenv
+
+# optimizer step time on a model of many small params, one update per param against the params packed into flat buffers
+if __name__ == "__main__":
+  N, SZ, STEPS = getenv("N", 256), getenv("SZ", 64), getenv("STEPS", 10)
+  Tensor.training = True
+  for fused in [False, True]:
+    Tensor.manual_seed(0)
+    ps = [Tensor.rand(SZ, requires_grad=True) for _ in range(N)]
+    opt = Adam(ps, fused=fused)
+    @TinyJit
+    def step():
+      opt.zero_grad()
+      loss = Tensor.stack(*ps).relu().sum()
+      loss.backward()
+      opt.step()
+      return loss.realize()
+    for _ in range(3): step()
+    Device[Device.DEFAULT].synchronize()
+    GlobalCounters.reset()
+    st = time.perf_counter()
+    for _ in range(STEPS): step()
+    Device[Device.DEFAULT].synchronize()
+    print(f"fused={fused:d} {(time.perf_counter()-st)/STEPS*1e3:8.2f} ms/step {GlobalCounters.kernel_count//STEPS:5d} kernels/step")
@@ -0,0 +1,25 @@
+import time
+from tinygrad import Tensor, Device, dtypes
+from tinygrad.nn.state import safe_save, safe_load, load_state_dict
+from tinygrad.helpers import getenv, temp
+
+# load a safetensors checkpoint of N tensors of MB megabytes, one realize at a time and through the io_uring loader
+if __name__ == "__main__":
+  N, MB = getenv("N", 64), getenv("MB", 8)
+  fn = temp("benchmark_load_state_dict.safetensors")
+  if getenv("SAVE", 1): safe_save({f"w{i}": Tensor.rand(MB<<18).realize() for i in range(N)}, fn)
+
+  class Model:
+    def __init__(self):
+      for i in range(N): setattr(self, f"w{i}", Tensor.empty(MB<<18, dtype=dtypes.half if getenv("HALF") else dtypes.float32))
+
+  def cast(sd): return {k:v.to(Device.DEFAULT).half() for k,v in sd.items()} if getenv("HALF") else sd
+  for name in ["serial", "loader"]:
+    model = Model()
+    st = time.perf_counter()
+    if name == "serial":
+      for k,v in cast(safe_load(fn)).items(): getattr(model, k).replace(v.to(Device.DEFAULT)).realize()
+    else:
+      load_state_dict(model, cast(safe_load(fn)), verbose=False)
+    Device[Device.DEFAULT].synchronize()
+    print(f"{name:8s} {N*MB/1e3/(time.perf_counter()-st):6.2f} GB/s")
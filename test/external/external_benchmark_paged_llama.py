@@ -0,0 +1,27 @@
+import time
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv
+from extra.models.llama import Transformer, ContinuousBatcher
+
+# decode throughput of one sequence at a time against continuous batching over a paged kv cache
+if __name__ == "__main__":
+  Tensor.manual_seed(0)
+  BS, N, PROMPT, NEW = getenv("BS", 8), getenv("N", 16), getenv("PROMPT", 16), getenv("NEW", 32)
+  model = Transformer(dim=getenv("DIM", 256), hidden_dim=getenv("HIDDEN", 512), n_heads=8, n_kv_heads=4, n_layers=getenv("LAYERS", 4), norm_eps=1e-5,
+                      vocab_size=1024, max_context=getenv("CONTEXT", 256))
+  prompts = [Tensor.randint(PROMPT, high=1024).tolist() for _ in range(N)]
+
+  st = time.perf_counter()
+  for p in prompts[:getenv("SEQ", 2)]:
+    tok = model(Tensor([p]), 0).item()
+    for i in range(NEW-1): tok = model(Tensor([[tok]]), PROMPT+i).item()
+  Device[Device.DEFAULT].synchronize()
+  tm = (time.perf_counter()-st) / getenv("SEQ", 2)
+  print(f"sequential  {NEW/tm:8.2f} tok/s")
+
+  batcher = ContinuousBatcher(model, max_batch=BS, n_blocks=BS*(PROMPT+NEW)//16+1)
+  for p in prompts: batcher.add(p, NEW)
+  st = time.perf_counter()
+  out = batcher.run()
+  tm = time.perf_counter()-st
+  print(f"batched     {sum(len(o) for o in out.values())/tm:8.2f} tok/s with {BS} slots")
@@ -0,0 +1,45 @@
+import time
+from tinygrad import Tensor, nn
+from tinygrad.helpers import getenv
+from tinygrad.ops import Ops, UOp, PatternMatcher
+from tinygrad.codegen.kernel import Kernel
+from tinygrad.codegen.heuristic import hand_coded_optimizations
+from tinygrad.codegen.lowerer import rewrite_shapetracker_with_index
+from tinygrad.codegen.devectorizer import full_graph_rewrite
+from tinygrad.codegen.symbolic import symbolic_simple, symbolic, sym
+from extra.models.resnet import ResNet18
+
+# how PatternMatcher.rewrite tried the patterns before the dispatch table, kept here to compare against
+def linear_rewrite(pm:PatternMatcher, uop:UOp, ctx=None) -> UOp|None:
+  ler = {u.op for u in uop.src}
+  for _,match,early_reject in pm.pdict.get(uop.op, []):
+    if not early_reject.issubset(ler): continue
+    if (ret:=match(uop, ctx)) is not None: return ret
+  return None
+
+def bench(name:str, pm:PatternMatcher, uops:list[UOp]):
+  tms: dict[str, float] = {}
+  for fxn_name, fxn in [("linear", linear_rewrite), ("dispatch", PatternMatcher.rewrite)]:
+    fxn(pm, uops[0])
+    tms[fxn_name] = float("inf")
+    for _ in range(getenv("CNT", 5)):
+      st = time.perf_counter()
+      for u in uops: fxn(pm, u)
+      tms[fxn_name] = min(tms[fxn_name], time.perf_counter()-st)
+  print(f"{name:16s} {len(pm.patterns):4d} patterns {len(uops)/tms['linear']/1e3:9.1f} -> {len(uops)/tms['dispatch']/1e3:9.1f} k rewrites/s "
+        f"({tms['linear']/tms['dispatch']:.2f}x)")
+
+if __name__ == "__main__":
+  # the uops of the resnet18 kernels, before and after the codegen rewrites
+  model = ResNet18()
+  for p in nn.state.get_parameters(model): p.replace(Tensor.empty(p.shape, dtype=p.dtype))
+  sched = model(Tensor.empty(getenv("BS", 8), 3, 224, 224)).schedule()
+  asts = list({x.ast.key:x.ast for x in sched if x.ast.op is Ops.SINK}.values())
+  uops: list[UOp] = []
+  for ast in asts:
+    k = Kernel(ast)
+    k.apply_opts(hand_coded_optimizations(k))
+    lowered = rewrite_shapetracker_with_index(k.get_optimized_ast(), k.opts)
+    uops += list(lowered.toposort()) + list(full_graph_rewrite(lowered, k.opts).toposort())
+  print(f"{len(asts)} kernels, {len(uops)} uops")
+  for name, pm in [("symbolic_simple", symbolic_simple), ("symbolic", symbolic), ("sym", sym)]: bench(name, pm, uops)
@@ -0,0 +1,62 @@
+import time, math
+from tinygrad import Tensor, Device, GlobalCounters, dtypes
+from tinygrad.engine.realize import run_schedule
+from tinygrad.helpers import getenv
+
+# the bitonic sort used before indices were carried through the network, it recovers the indices with an O(n^2) compare
+def quadratic_index_sort(self:Tensor, dim:int=-1, descending:bool=False) -> tuple[Tensor, Tensor]:
+  x, dim = self, self._resolve_dim(dim)
+  orig_len = x.shape[dim]
+  n_stages = math.ceil(math.log2(orig_len))
+  fill_value = dtypes.min(x.dtype) if descending else dtypes.max(x.dtype)
+  pads = tuple((0, 2**n_stages - orig_len) if i == dim else None for i in range(x.ndim))
+  x = x.pad(pads, value=fill_value).unflatten(dim, (2,)*n_stages)
+  for stage in range(1, n_stages+1):
+    if stage != n_stages:
+      crossover_dim = dim + n_stages - stage - 1
+      blue_box, green_box = x.split(1, crossover_dim)
+      flip_dims = tuple(-i for i in range(1, stage+1+(self.ndim-dim)))
+      x = (blue_box.cat(green_box.flip(flip_dims), dim=crossover_dim)).contiguous()
+    for substage in range(stage-1, -1, -1):
+      partner_dim = dim + n_stages - substage - 1
+      x_top, x_bottom = x.split(1, partner_dim)
+      x_larger, x_smaller = x_top.maximum(x_bottom), x_top.minimum(x_bottom)
+      x = (x_larger.cat(x_smaller, dim=partner_dim) if descending else x_smaller.cat(x_larger, dim=partner_dim)).contiguous()
+    if stage != n_stages:
+      blue_box, flipped_green_box = x.split(1, crossover_dim)
+      x = blue_box.cat(flipped_green_box.flip(flip_dims), dim=crossover_dim)
+  x = x.flatten(dim, dim+n_stages-1).shrink(tuple((0, orig_len) if i == dim else None for i in range(x.ndim)))
+  idx = Tensor.arange(orig_len, requires_grad=False, device=self.device).reshape(tuple(orig_len if i == dim else 1 for i in range(x.ndim)))
+  idx = idx.expand(x.shape)
+  def compute_counts(t:Tensor): return ((idx.unsqueeze(dim) <= idx.unsqueeze(dim+1)) & (t.unsqueeze(dim) == t.unsqueeze(dim+1))).sum(dim+1)
+  count_orig, count_sorted = compute_counts(self), compute_counts(x)
+  cond = (self.unsqueeze(dim+1) == x.unsqueeze(dim)) & (count_orig.unsqueeze(dim+1) == count_sorted.unsqueeze(dim))
+  idx = (cond * idx.unsqueeze(dim+1)).sum(dim)
+  return x, idx
+
+def bench(name, fxn, x:Tensor):
+  Tensor.realize(*fxn(x))
+  tms, peak = [], 0
+  for _ in range(getenv("CNT", 5)):
+    GlobalCounters.reset()
+    base = GlobalCounters.mem_used
+    st = time.perf_counter()
+    sched = Tensor.schedule(*fxn(x))
+    # one item at a time to see the peak of the intermediate buffers
+    while sched:
+      run_schedule(sched[:1])
+      peak = max(peak, GlobalCounters.mem_used-base)
+      sched.pop(0)
+    Device[x.device].synchronize()
+    tms.append(time.perf_counter()-st)
+  print(f"{name:10s} {GlobalCounters.kernel_count:4d} kernels {GlobalCounters.global_ops*1e-6:10.2f} MOPs {peak*1e-6:8.2f} MB peak {min(tms)*1e3:9.2f} ms")
+
+if __name__ == "__main__":
+  # sampling from a 128k vocab wants the top few logits
+  K = getenv("K", 50)
+  for n in [getenv("N")] if getenv("N") else [1024, 4096, 32768, 128256]:
+    print(f"*** sort and top {K} of {n}")
+    x = Tensor.rand(getenv("BS", 1), n).realize()
+    if n <= 4096: bench("old sort", lambda x: quadratic_index_sort(x, descending=True), x)
+    bench("sort", lambda x: x.sort(descending=True), x)
+    bench("topk", lambda x: x.topk(K), x)
@@ -0,0 +1,34 @@
+import time
+from tinygrad import Tensor, nn
+from tinygrad.helpers import getenv
+from tinygrad.ops import UOp, UOpMetaClass, uop_intern_stats
+from extra.models.resnet import ResNet18
+
+def bench(name:str, fxn):
+  UOpMetaClass.hits = UOpMetaClass.created = 0
+  st = time.perf_counter()
+  fxn()
+  et = time.perf_counter()-st
+  stats = uop_intern_stats()
+  print(f"{name:20s} {(stats['hits']+stats['created'])/et/1e3:8.1f} k UOps/s  {stats['created']:8d} created {stats['hits']:8d} hits "
+        f"({stats['hit_rate']*100:5.1f}%) {stats['live']:8d} live  {et*1e3:8.2f} ms")
+
+def symbolic_chain():
+  for k in range(getenv("CNT", 100)):
+    a, r = UOp.variable(f"a{k}", 0, 10), UOp.variable(f"b{k}", 0, 10)
+    for i in range(500): r = (r + i) * a
+
+def resnet_forward():
+  model = ResNet18()
+  for p in nn.state.get_parameters(model): p.replace(Tensor.empty(p.shape, dtype=p.dtype))
+  model(Tensor.empty(getenv("BS", 8), 3, 224, 224)).sum().backward()
+
+def sink_key():
+  a, r = UOp.variable("k", 0, 10), UOp.variable("kk", 0, 10)
+  for i in range(getenv("N", 20000)): r = (r + i) * a
+  r.key
+
+if __name__ == "__main__":
+  bench("symbolic chain", symbolic_chain)
+  bench("resnet18 fwd+bwd", resnet_forward)
+  bench("deep graph + key", sink_key)
@@ -0,0 +1,36 @@
+import unittest
+from tinygrad import Tensor
+from extra.models.llama import Transformer, ContinuousBatcher
+
+def greedy(model:Transformer, prompt:list[int], max_new_tokens:int) -> list[int]:
+  out = [model(Tensor([prompt]), 0).item()]
+  while len(out) < max_new_tokens: out.append(model(Tensor([[out[-1]]]), len(prompt)+len(out)-1).item())
+  return out
+
+class TestContinuousBatching(unittest.TestCase):
+  def setUp(self):
+    Tensor.manual_seed(0)
+    self.model = Transformer(dim=32, hidden_dim=64, n_heads=4, n_kv_heads=2, n_layers=2, norm_eps=1e-5, vocab_size=64, max_context=32, jit=False)
+    self.prompts = [[1, 2, 3], [4, 5, 6, 7, 8, 9, 10], [11], [12, 13, 14, 15], [16, 17]]
+
+  def test_matches_sequential(self):
+    expected = [greedy(self.model, p, 6) for p in self.prompts]
+    # 3 slots for 5 requests and only room for 4 of them in the pool, requests have to wait for blocks and slots to be freed
+    batcher = ContinuousBatcher(self.model, max_batch=3, n_blocks=9, block_size=4)
+    rids = [batcher.add(p, 6) for p in self.prompts]
+    finished = batcher.run()
+    self.assertEqual([finished[rid] for rid in rids], expected)
+    self.assertEqual(len(batcher.kv.free_blocks), 8)
+
+  def test_eos(self):
+    first = greedy(self.model, self.prompts[0], 1)[0]
+    batcher = ContinuousBatcher(self.model, max_batch=2, n_blocks=8, block_size=4)
+    rid = batcher.add(self.prompts[0], 6, eos=first)
+    self.assertEqual(batcher.run()[rid], [first])
+
+  def test_too_long(self):
+    batcher = ContinuousBatcher(self.model, max_batch=2, n_blocks=8, block_size=4)
+    with self.assertRaises(ValueError): batcher.add(list(range(30)), 6)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,4 +1,4 @@
-import unittest, contextlib
+import unittest, contextlib, itertools
 import numpy as np
 from tinygrad import Tensor, GlobalCounters, dtypes, nn, Device
 from tinygrad.helpers import CI, Context, getenv
@@ -117,10 +117,9 @@ class TestIndexing(unittest.TestCase):
       X = dataset[idxs]
       assert X.shape == (4,DDIM)
       sched = X.schedule()
-      # TODO: enable these asserts when the scheduler can handle this
-      #self.assertEqual(len(sched), 1)
+      self.assertEqual(len(sched), 2)
       run_schedule(sched)
-      #assert GlobalCounters.global_ops < 4*DSET, f"too many ops {GlobalCounters.global_ops}"
+      assert GlobalCounters.global_ops < 4*DSET, f"too many ops {GlobalCounters.global_ops}"
     np.testing.assert_allclose(real_index, X.numpy())
 
   def test_index_fused(self, noopt=1):
@@ -186,5 +185,33 @@ class TestIndexing(unittest.TestCase):
   # at least the arange is being fused
   def test_llama_embedding_opt(self): self.test_llama_embedding(0, 1_736_704_000 if CI else 5_898_240_000)
 
+  def test_embedding_indexed_load(self):
+    # without FUSE_ARANGE the one-hot still folds into a direct load, with or without opts
+    for noopt, (vocab_size, embed_size) in itertools.product([0, 1], [(10, 3), (32, 8), (4096, 64)]):
+      emb = nn.Embedding(vocab_size, embed_size)
+      emb.weight.realize()
+      x = Tensor([1,2,3,vocab_size-1]).realize()
+      with Context(NOOPT=noopt):
+        GlobalCounters.reset()
+        z = emb(x).realize()
+        self.assertEqual(GlobalCounters.kernel_count, 1)
+        self.assertLessEqual(GlobalCounters.global_ops, 4*embed_size)
+      np.testing.assert_equal(z.numpy(), emb.weight.numpy()[x.numpy()])
+
+  def test_gather_indexed_load(self):
+    for noopt in [0, 1]:
+      dataset = Tensor.rand(64, 500).realize()
+      idxs = Tensor.randint(64, 7, high=500).realize()
+      with Context(NOOPT=noopt):
+        GlobalCounters.reset()
+        X = dataset.gather(1, idxs).realize()
+        self.assertEqual(GlobalCounters.kernel_count, 1)
+        self.assertLessEqual(GlobalCounters.global_ops, 64*7)
+      np.testing.assert_equal(X.numpy(), np.take_along_axis(dataset.numpy(), idxs.numpy(), 1))
+
+  def test_gather_indexed_load_out_of_bounds(self):
+    X = Tensor.ones(4, 8).contiguous().realize().gather(1, Tensor([[-1], [8], [0], [7]]))
+    np.testing.assert_equal(X.numpy(), [[0], [0], [1], [1]])
+
 if __name__ == "__main__":
   unittest.main()
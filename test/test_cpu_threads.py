@@ -0,0 +1,69 @@
+import unittest, threading
+import numpy as np
+from tinygrad import Tensor, Device, TinyJit
+from tinygrad.helpers import Context
+from tinygrad.engine.realize import method_cache, get_runner
+
+@unittest.skipUnless(Device.DEFAULT in {"CPU", "LLVM"}, "threads are only for cpu devices")
+class TestCPUThreads(unittest.TestCase):
+  def setUp(self):
+    self.backup_cache, self.ctx = method_cache.copy(), Context(THREADS=4)
+    method_cache.clear()
+    self.ctx.__enter__()
+  def tearDown(self):
+    self.ctx.__exit__()
+    method_cache.clear()
+    method_cache.update(self.backup_cache)
+
+  def test_threads_read_at_render(self):
+    self.assertTrue(Device[Device.DEFAULT].renderer.has_threads)
+    with Context(THREADS=1):
+      self.assertFalse(Device[Device.DEFAULT].renderer.has_threads)
+      self.assertIsNone(Device[Device.DEFAULT].renderer.global_max)
+
+  def _global_size(self, t:Tensor): return get_runner(Device.DEFAULT, t.schedule()[-1].ast).p.global_size
+
+  def test_elementwise(self):
+    a = Tensor.rand(64, 33).realize()
+    self.assertEqual(self._global_size(a+1), [4, 1, 1])
+    np.testing.assert_allclose((a+1).numpy(), a.numpy()+1)
+
+  def test_reduce(self):
+    a = Tensor.rand(130, 64).realize()
+    self.assertEqual(self._global_size(a.sum(1)), [2, 1, 1])
+    np.testing.assert_allclose(a.sum(1).numpy(), a.numpy().sum(1), rtol=1e-5)
+
+  def test_indivisible_is_single_thread(self):
+    a = Tensor.rand(7, 3).realize()
+    self.assertEqual(self._global_size(a.sum(1)), [1, 1, 1])
+    np.testing.assert_allclose(a.sum(1).numpy(), a.numpy().sum(1), rtol=1e-5)
+
+  def test_full_reduce(self):
+    a = Tensor.rand(1000).realize()
+    np.testing.assert_allclose(a.sum().numpy(), a.numpy().sum(), rtol=1e-5)
+
+  def test_matmul_jit(self):
+    b = Tensor.rand(64, 48).realize()
+    @TinyJit
+    def f(x): return ((x@b).relu().sum(1)+1).realize()
+    for _ in range(4):
+      x = Tensor.rand(128, 64).realize()
+      np.testing.assert_allclose(f(x).numpy(), np.maximum(x.numpy()@b.numpy(), 0).sum(1)+1, rtol=1e-4, atol=1e-4)
+
+  def test_concurrent_graphs(self):
+    # each graph spins on a barrier between its kernels, launches from two threads must not split the pool between them
+    b = Tensor.rand(64, 48).realize()
+    fs = [TinyJit(lambda x: ((x@b).relu().sum(1)+1).realize()) for _ in range(2)]
+    xs = [Tensor.rand(128, 64).realize() for _ in range(2)]
+    for f,x in zip(fs, xs):
+      for _ in range(3): f(x)
+    def run(f, x):
+      for _ in range(50): f(x)
+    ts = [threading.Thread(target=run, args=(f, x)) for f,x in zip(fs, xs)]
+    for t in ts: t.start()
+    for t in ts: t.join(timeout=60)
+    self.assertFalse(any(t.is_alive() for t in ts))
+    for f,x in zip(fs, xs): np.testing.assert_allclose(f(x).numpy(), np.maximum(x.numpy()@b.numpy(), 0).sum(1)+1, rtol=1e-4, atol=1e-4)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -127,6 +127,30 @@ class TestJit(unittest.TestCase):
     with self.assertRaises(AssertionError):
       add(a, bad)
 
+  def test_jit_multiple_signatures(self):
+    def add(a, b): return (a+b).realize()
+    jf = TinyJit(add, max_captures=2)
+    for _ in range(3):
+      for n in [10, 20]:
+        a, b = Tensor.randn(n, n), Tensor.randn(n, n)
+        np.testing.assert_allclose(jf(a, b).numpy(), a.numpy()+b.numpy(), atol=1e-4, rtol=1e-5)
+    assert_jit_cache_len(jf, 1)
+    assert len(jf.captures) == 1 and jf.captures[next(iter(jf.captures))][0] is not None
+    # a third signature drops the least recently used capture
+    jf(Tensor.randn(5, 5), Tensor.randn(5, 5))
+    assert len(jf.captures) == 1 and jf.captured is None
+    assert list(jf.captures.keys())[0][1][0][0].shape == (20, 20)
+
+  def test_jit_buckets(self):
+    def add(a): return (a+1).realize()
+    jf = TinyJit(add, max_captures=2, buckets={0: (4, 8)})
+    for n in [1, 3, 2, 4, 7, 5, 8, 6]:
+      a = Tensor.randn(n, 3)
+      out = jf(a)
+      assert out.shape[0] == (4 if n <= 4 else 8)
+      np.testing.assert_allclose(out[:n].numpy(), a.numpy()+1, atol=1e-4, rtol=1e-5)
+    assert len(jf.captures) == 1 and jf.cnt >= 2
+
   def test_jit_shape_views_mismatch(self):
     @TinyJit
     def add(a): return (a+1).realize()
@@ -1,5 +1,8 @@
 import unittest
+from unittest.mock import patch
 from tinygrad import Tensor, Device, Variable
+from tinygrad.helpers import Context
+from tinygrad.engine.realize import method_cache
 from examples.gpt2 import Transformer
 from tinygrad.nn.state import get_state_dict
 
@@ -30,6 +33,16 @@ class TestMethodCache(unittest.TestCase):
     Device[Device.DEFAULT].compiler = None
     ((c+d)+(a+b)).realize()
 
+  def test_disk_methodcache(self):
+    with Context(CACHELEVEL=3):
+      a = Tensor.arange(17).contiguous()
+      (a*3+7).realize()
+      # a fresh process only has the disk cache, it shouldn't need to get_kernel or compile
+      method_cache.clear()
+      Device[Device.DEFAULT].compiler = None
+      with patch("tinygrad.engine.realize.get_kernel", side_effect=AssertionError("should be cached on disk")):
+        self.assertEqual((a*3+7).tolist(), [x*3+7 for x in range(17)])
+
   @unittest.skip("incorrect use of transformer")
   def test_small_transformer(self):
     args_tiny = {"dim": 16, "n_heads": 8, "n_layers": 8, "norm_eps": 1e-05, "vocab_size": 10}
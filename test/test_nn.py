@@ -520,7 +520,7 @@ class TestNN(unittest.TestCase):
                 [12, 19, 8, 1]])
     result = layer(a)
     schedule = result.schedule()
-    self.assertEqual(3, len([item for item in schedule if item.ast.op is Ops.SINK]), "first run realizes arange, weight, and embedding")
+    self.assertEqual(2, len([item for item in schedule if item.ast.op is Ops.SINK]), "first run realizes weight and embedding, arange is fused")
     run_schedule(schedule)
 
     b = Tensor([[1, 2, 3],
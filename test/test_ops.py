@@ -976,6 +976,11 @@ class TestOps(unittest.TestCase):
   def test_simple_cumsum(self):
     helper_test_op([(512)], lambda x: torch.cumsum(x, dim=0), lambda x: Tensor.cumsum(x, axis=0))
     helper_test_op([(1022)], lambda x: torch.cumsum(x, dim=0), lambda x: Tensor.cumsum(x, axis=0))
+  def test_large_cumsum(self):
+    # more than one level of the blocked scan
+    helper_test_op([(20000)], lambda x: torch.cumsum(x, dim=0), lambda x: Tensor.cumsum(x, axis=0), atol=1e-3, grad_atol=1e-3)
+    helper_test_op([(3,2000)], lambda x: torch.cumsum(x, dim=1), lambda x: Tensor.cumsum(x, axis=1), atol=1e-4)
+    helper_test_op([(2000,3)], lambda x: torch.cumsum(x, dim=0), lambda x: Tensor.cumsum(x, axis=0), atol=1e-4)
   def test_cumsum(self):
     helper_test_op([()], lambda x: torch.cumsum(x, dim=0), lambda x: Tensor.cumsum(x, axis=0))
     self.helper_test_exception([()], lambda x: torch.cumsum(x, dim=1), lambda x: Tensor.cumsum(x, axis=1), expected=IndexError)
@@ -996,6 +1001,8 @@ class TestOps(unittest.TestCase):
   def test_simple_cumprod(self):
     helper_test_op([(512)],lambda x: torch.cumprod(x, dim=0),lambda x: Tensor.cumprod(x, axis=0))
     helper_test_op([(1022)],lambda x: torch.cumprod(x, dim=0),lambda x: Tensor.cumprod(x, axis=0))
+  def test_large_cumprod(self):
+    helper_test_op([(20000)],lambda x: torch.cumprod(x, dim=0),lambda x: Tensor.cumprod(x, axis=0), low=0.999, high=1.001, atol=1e-4)
   def test_cumprod(self):
     helper_test_op([()],lambda x: torch.cumprod(x, dim=0),lambda x: Tensor.cumprod(x, axis=0))
     self.helper_test_exception([()],lambda x: torch.cumprod(x, dim=1),lambda x: Tensor.cumprod(x, axis=1),expected=IndexError)
@@ -1016,6 +1023,9 @@ class TestOps(unittest.TestCase):
   def test_simple_cummax(self):
     helper_test_op([(512)], lambda x: torch.cummax(x, dim=0).values, lambda x: Tensor.cummax(x, axis=0))
     helper_test_op([(1022)], lambda x: torch.cummax(x, dim=0).values, lambda x: Tensor.cummax(x, axis=0))
+  def test_large_cummax(self):
+    helper_test_op([(20000)], lambda x: torch.cummax(x, dim=0).values, lambda x: Tensor.cummax(x, axis=0))
+    helper_test_op([(2000,3)], lambda x: torch.cummax(x, dim=0).values, lambda x: Tensor.cummax(x, axis=0))
   def test_cummax(self):
     helper_test_op([()], lambda x: torch.cummax(x, dim=0).values, lambda x: Tensor.cummax(x, axis=0))
     # TODO: torch allows this?
@@ -1102,6 +1112,16 @@ class TestOps(unittest.TestCase):
     np.testing.assert_equal(value.numpy(), [0, 0, 0])
     np.testing.assert_equal(indices.numpy(), [2, 4, 6])
     self.helper_test_exception([(4)], lambda x: x.topk(5), lambda x: x.topk(5), expected=(RuntimeError, ValueError))
+  def test_topk_selection(self):
+    # k much smaller than the axis merges sorted blocks instead of sorting everything, 1000 is an odd number of blocks
+    for k in [1, 5, 50]:
+      for largest in [True, False]:
+        helper_test_op([(3,1000)], lambda x: x.topk(k, largest=largest).values, lambda x: x.topk(k, largest=largest)[0], forward_only=True)
+        helper_test_op([(3,1000)], lambda x: x.topk(k, largest=largest).indices.type(torch.int32),
+                       lambda x: x.topk(k, largest=largest)[1], forward_only=True)
+    value, indices = Tensor([0, 1, 0, 1] * 100).topk(3)
+    np.testing.assert_equal(value.numpy(), [1, 1, 1])
+    np.testing.assert_equal(indices.numpy(), [1, 3, 5])
 
   def test_einsum(self):
     # matrix transpose
@@ -2740,10 +2760,8 @@ class TestOps(unittest.TestCase):
                          lambda x: x.gather(dim=0, index=Tensor([2, 1, 0, 1, 2])),
                          vals=[[1., 2., 3.]])
 
-  @unittest.expectedFailure
-  @unittest.skipIf(torch._C._get_privateuse1_backend_name() == "tiny", 'results in a success instead of a failure')
-  def test_gather_failure(self):
-    # gather with inf values do not work, other values results in nan
+  def test_gather_inf(self):
+    # gather is an indexed load, inf values don't turn into nan
     helper_test_op(None, lambda x: x.gather(dim=0, index=torch.tensor([2, 1, 0, 1, 2], requires_grad=False)),
                          lambda x: x.gather(dim=0, index=Tensor([2, 1, 0, 1, 2])),
                          vals=[[-float("inf"), 2., 3.]])
@@ -2863,6 +2881,22 @@ class TestOps(unittest.TestCase):
       lambda x,y,z,m: Tensor.scaled_dot_product_attention(x,y,z,is_causal=True,attn_mask=m),
       expected=RuntimeError)
 
+  def test_scaled_dot_product_attention_flash(self):
+    # more keys than FLASH_ATTENTION runs the online softmax, 18 keys is a partial last block
+    with Context(FLASH_ATTENTION=4):
+      helper_test_op([(4,2,16,8), (4,2,18,8), (4,2,18,8)], torch.nn.functional.scaled_dot_product_attention, Tensor.scaled_dot_product_attention)
+      helper_test_op([(4,2,16,8), (4,2,18,8), (4,2,18,8), (16,18)],
+                     lambda x,y,z,m: torch.nn.functional.scaled_dot_product_attention(x,y,z,attn_mask=m),
+                     lambda x,y,z,m: Tensor.scaled_dot_product_attention(x,y,z,attn_mask=m))
+      helper_test_op([(4,2,16,8), (4,2,18,8), (4,2,18,8)],
+                     lambda x,y,z: torch.nn.functional.scaled_dot_product_attention(x,y,z,is_causal=True),
+                     lambda x,y,z: Tensor.scaled_dot_product_attention(x,y,z,is_causal=True))
+      # the first rows only see keys from the last block
+      mask = Tensor.arange(18) >= 14 - Tensor.arange(16).reshape(16, 1)
+      helper_test_op([(4,2,16,8), (4,2,18,8), (4,2,18,8)],
+                     lambda x,y,z: torch.nn.functional.scaled_dot_product_attention(x,y,z,attn_mask=torch.tensor(mask.numpy())),
+                     lambda x,y,z: Tensor.scaled_dot_product_attention(x,y,z,attn_mask=mask))
+
   def test_binary_crossentropy(self):
     helper_test_op([(32,10), (32,10)], lambda x,y: torch.nn.functional.binary_cross_entropy(x.sigmoid(),torch.clip(y,0,1)),
                                        lambda x,y: x.sigmoid().binary_crossentropy(y.clip(0,1)))
@@ -1,8 +1,9 @@
 import numpy as np
 import torch
 import unittest
-from tinygrad import Tensor, Device, dtypes
-from tinygrad.nn.optim import Adam, SGD, AdamW
+from tinygrad import Tensor, Device, dtypes, GlobalCounters
+from tinygrad.nn.optim import Adam, SGD, AdamW, LAMB, LARS
+from tinygrad.nn.state import get_state_dict, load_state_dict
 from tinygrad.helpers import CI
 from tinygrad.device import is_dtype_supported
 
@@ -132,5 +133,75 @@ class TestOptim(unittest.TestCase):
     optimizer.step()
     Tensor.training = old_state
 
+class TestFusedOptim(unittest.TestCase):
+  def setUp(self):
+    self.old_training = Tensor.training
+    Tensor.training = True
+  def tearDown(self):
+    Tensor.training = self.old_training
+
+  def _run(self, opt, fused, steps=3):
+    Tensor.manual_seed(0)
+    # a model of many small params in two dtypes
+    ps = [Tensor.rand(3, 4, requires_grad=True), Tensor.rand(5, requires_grad=True), Tensor.rand(2, 2, requires_grad=True),
+          Tensor.rand(4, 3, dtype=dtypes.half if is_dtype_supported(dtypes.half) else None, requires_grad=True)]
+    optim = opt(ps, fused=fused)
+    for _ in range(steps):
+      optim.zero_grad()
+      (ps[0].sum(1)[:3, None] * ps[2].sum(0)[None, :1] + ps[1].square().sum() + ps[3].float().exp().sum()).sum().backward()
+      GlobalCounters.reset()
+      optim.step()
+    return [p.numpy() for p in ps], GlobalCounters.kernel_count
+
+  def test_fused_matches(self):
+    for opt in [lambda ps, fused: SGD(ps, lr=0.01, fused=fused), lambda ps, fused: SGD(ps, 0.01, momentum=0.9, nesterov=True, fused=fused),
+                lambda ps, fused: Adam(ps, fused=fused), lambda ps, fused: AdamW(ps, lr=0.1, fused=fused),
+                lambda ps, fused: LAMB(ps, lr=0.1, fused=fused), lambda ps, fused: LARS(ps, lr=0.1, fused=fused)]:
+      (expected, _), (out, _) = self._run(opt, False), self._run(opt, True)
+      for x,y in zip(out, expected): np.testing.assert_allclose(x, y, atol=1e-3, rtol=1e-3)
+
+  def test_fused_params_are_views(self):
+    a, b, c = Tensor.ones(2, 3, requires_grad=True), Tensor.zeros(4, requires_grad=True), Tensor.ones(3).contiguous().requires_grad_(True)
+    d = Tensor.ones(2, dtype=dtypes.float64, requires_grad=True)
+    opt = SGD([a, b, d, c], lr=1.0, fused=True)
+    # one buffer per dtype
+    self.assertEqual(len(opt.flat), 2)
+    self.assertIs(a.lazydata.base, opt.flat[0].lazydata.base)
+    self.assertIs(d.lazydata.base, opt.flat[1].lazydata.base)
+    (a.sum() + (b*2).sum() + c.sum() + d.sum()).backward()
+    opt.step()
+    np.testing.assert_equal(opt.flat[0].numpy(), [0]*6 + [-2]*4 + [0]*3)
+    np.testing.assert_equal(a.numpy(), np.zeros((2, 3)))
+    np.testing.assert_equal(b.numpy(), [-2]*4)
+    np.testing.assert_equal(d.numpy(), [0]*2)
+
+  def test_fused_relinks_replaced_params(self):
+    w, b = Tensor.ones(3, requires_grad=True).contiguous(), Tensor.zeros(2, requires_grad=True).contiguous()
+    opt = SGD([w, b], lr=1.0, fused=True)
+    self.assertEqual(sorted(get_state_dict(opt).keys()), ["flat.0", "lr", "params.0", "params.1"])
+    # load_state_dict replaces w, it has to be copied back into the flat buffer before the step
+    load_state_dict({"w": w}, {"w": Tensor.full((3,), 5.0)})
+    (w.sum() + b.sum()).backward()
+    opt.step()
+    np.testing.assert_equal(w.numpy(), [4]*3)
+    np.testing.assert_equal(opt.flat[0].numpy(), [4]*3 + [-1]*2)
+    self.assertIs(w.lazydata.base, opt.flat[0].lazydata.base)
+
+  def test_fused_fewer_kernels(self):
+    def step(fused):
+      Tensor.manual_seed(0)
+      ps = [Tensor.rand(8, requires_grad=True) for _ in range(16)]
+      opt = Adam(ps, fused=fused)
+      for _ in range(2):
+        opt.zero_grad()
+        Tensor.stack(*ps).relu().sum().backward()
+        GlobalCounters.reset()
+        opt.step()
+      return GlobalCounters.kernel_count
+    unfused, fused = step(False), step(True)
+    # b1_t, b2_t and their bias corrections, then the grads, m, v and the params each in one kernel no matter how many params
+    self.assertEqual(fused, 8)
+    self.assertGreaterEqual(unfused, 4+3*16)
+
 if __name__ == '__main__':
   unittest.main()
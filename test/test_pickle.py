@@ -1,4 +1,4 @@
-import unittest, pickle, types
+import unittest, pickle, types, tempfile, os
 import numpy as np
 from tinygrad import Tensor, TinyJit, Variable, dtypes
 from tinygrad.helpers import GlobalCounters, ContextVar, Context
@@ -170,5 +170,29 @@ class TestPickleJIT(unittest.TestCase):
     # confirm no intermediate buffers are saved
     self.assertLess(len(self.st), 1_000_000)
 
+class TestSaveJIT(unittest.TestCase):
+  def test_save_load(self):
+    w = Tensor.rand(256, 256).realize()
+    @TinyJit
+    def f(x): return ((x@w).relu()@w).sum(1).realize()
+    for _ in range(3): f(Tensor.rand(256, 256).realize())
+    x, wn = Tensor.rand(256, 256).realize(), w.numpy()
+    ref = f(x).numpy()
+    with tempfile.NamedTemporaryFile() as fn:
+      f.save(fn.name)
+      # only the weight is saved, not the input, the output or the intermediate matmul
+      self.assertLess(os.path.getsize(fn.name), w.nbytes()+0x10000)
+      del f
+      f2 = TinyJit.load(fn.name)
+    np.testing.assert_allclose(f2(x).numpy(), ref, rtol=1e-4)
+    x2 = (x+1).realize()
+    np.testing.assert_allclose(f2(x2).numpy(), (np.maximum(x2.numpy()@wn, 0)@wn).sum(1), rtol=1e-4)
+
+  def test_load_bad_file(self):
+    with tempfile.NamedTemporaryFile() as fn:
+      fn.write(b"not a jit"+b"\0"*16)
+      fn.flush()
+      with self.assertRaises(RuntimeError): TinyJit.load(fn.name)
+
 if __name__ == '__main__':
   unittest.main()
@@ -2,9 +2,10 @@
 # schedule confirms the right things are capable of fusing
 # NOTE: this has overlap with external_test_opt.py
 
-import unittest
+import unittest, contextlib
 import numpy as np
 import functools
+from unittest.mock import patch
 from typing import List, Optional, Union, cast
 
 from tinygrad import nn, dtypes, Device, Tensor
@@ -16,7 +17,7 @@ from tinygrad.codegen.symbolic import symbolic_simple
 from tinygrad.spec import type_verify, shape_spec
 from tinygrad.helpers import CI, DEBUG, FUSE_ARANGE, SPLIT_REDUCEOP, GlobalCounters, Context, getenv, all_same, temp
 from tinygrad.engine.grouper import view_left, view_right, sym, get_becomes_map, Kernel, create_ast
-from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars
+from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars, schedule_cache
 from tinygrad.engine.realize import CompiledRunner, run_schedule, lower_schedule
 from extra.models.llama import precompute_freqs_cis
 
@@ -103,7 +104,7 @@ class TestSchedule(unittest.TestCase):
 
   def test_simplify_padded_const(self):
     a = Tensor.empty(1022).cummax(axis=0)
-    sched = check_schedule(a, 5)
+    sched = check_schedule(a, 6)
     ast = sched[0].ast
     self.assertLessEqual(len([u for u in ast.toposort() if u.op is Ops.WHERE]), 6)
 
@@ -1119,6 +1120,17 @@ class TestSchedule(unittest.TestCase):
     out = Tensor.scaled_dot_product_attention(x, y, z, is_causal=True)
     check_schedule(out, 5)
 
+  def test_flash_attention_memory(self):
+    q, k, v = (Tensor.empty(1, 2, 256, 8) for _ in range(3))
+    for causal in [False, True]:
+      with Context(FLASH_ATTENTION=32): sched = Tensor.scaled_dot_product_attention(q, k, v, is_causal=causal).schedule()
+      # buffers live from the first to the last kernel that uses them, only about one block of scores is alive at once
+      first, last = {}, {}
+      for i,si in enumerate(sched):
+        for b in si.bufs: last[b.base] = i; first.setdefault(b.base, i)
+      peak = max(sum(b.nbytes for b in first if first[b] <= i <= last[b]) for i in range(len(sched)))
+      self.assertLess(peak, 2*256*256*4 // 2)
+
   def test_adam_step_fusion(self):
     with Tensor.train():
       x = Tensor.empty(4, 64, 768)
@@ -2582,5 +2594,76 @@ class TestUOpBecome(unittest.TestCase):
     b.shrink(((0,4),)).assign(a_view).realize()
     self.assertListEqual(b.tolist(), [0.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0])
 
+class TestScheduleCache(unittest.TestCase):
+  def setUp(self): schedule_cache.clear()
+
+  def test_hit_rebinds_buffers(self):
+    def f(x, w): return ((x@w).relu().sum(1, keepdim=True) + x.max(1, keepdim=True)).exp()
+    for i in range(3):
+      x, w = Tensor.rand(8, 16).realize(), Tensor.rand(16, 16).realize()
+      # after the first time, the graph is not kernelized again
+      with patch("tinygrad.tensor.get_becomes_map", side_effect=AssertionError("kernelized")) if i else contextlib.nullcontext():
+        out = f(x, w).realize()
+      self.assertIs(out.lazydata.base.op, Ops.BUFFER)
+      np.testing.assert_allclose(out.numpy(), np.exp(np.maximum(x.numpy()@w.numpy(), 0).sum(1, keepdims=True)+x.numpy().max(1, keepdims=True)),
+                                 rtol=1e-4)
+
+  def test_aliased_inputs_miss(self):
+    a, b = Tensor.rand(4).realize(), Tensor.rand(4).realize()
+    (a+b).realize()
+    self.assertListEqual((a+a).tolist(), (a.numpy()*2).tolist())
+
+  def test_intermediate_tensor(self):
+    for _ in range(2):
+      x = Tensor.rand(8, 8).realize()
+      y = x.sum(1, keepdim=True)
+      z = (x+y).sum()
+      z.realize()
+      np.testing.assert_allclose(y.numpy().flatten(), x.numpy().sum(1), rtol=1e-5)
+      np.testing.assert_allclose(z.item(), (x.numpy()+x.numpy().sum(1, keepdims=True)).sum(), rtol=1e-5)
+
+  def test_assign(self):
+    a = Tensor.zeros(4).contiguous().realize()
+    for _ in range(3): a.assign(a+1).realize()
+    self.assertListEqual(a.tolist(), [3.0]*4)
+
+  def test_context_in_key(self):
+    a = Tensor.ones(4).contiguous().realize()
+    cnt = len(schedule_cache)
+    with Context(SPLIT_REDUCEOP=0): (a*2).realize()
+    (a*2).realize()
+    self.assertEqual(len(schedule_cache), cnt+2)
+
+  def test_metadata_in_key(self):
+    a = Tensor.ones(4).contiguous().realize()
+    self.assertEqual(a.add(1).schedule()[-1].metadata[0].name, "add")
+    self.assertEqual((a+1).schedule()[-1].metadata[0].name, "__add__")
+
+class TestLowerAhead(unittest.TestCase):
+  def test_lower_ahead(self):
+    import threading
+    from tinygrad.engine import realize
+    threads, order = [], []
+    def lower_schedule_item(si):
+      threads.append(threading.current_thread().name)
+      return orig_lower(si)
+    orig_lower, x = realize.lower_schedule_item, Tensor.rand(16, 16).realize()
+    outs = [(x*i+1).sum(1) for i in range(6)]
+    sched = Tensor.schedule(*outs)
+    with Context(LOWER_AHEAD=3), patch.object(realize, "lower_schedule_item", lower_schedule_item):
+      for si,ei in lower_schedule(sched.copy()):
+        order.append(si)
+        ei.run()
+    self.assertEqual(order, sched)
+    self.assertTrue(all(name.startswith("tinygrad_lower") for name in threads))
+    for i,out in enumerate(outs): np.testing.assert_allclose(out.numpy(), (x.numpy()*i+1).sum(1), rtol=1e-5)
+
+  def test_lower_ahead_error(self):
+    from tinygrad.engine import realize
+    a = Tensor.rand(4).realize()
+    sched = Tensor.schedule((a+1), (a*2), (a-3))
+    with Context(LOWER_AHEAD=2), patch.object(realize, "lower_schedule_item", side_effect=RuntimeError("lower failed")):
+      with self.assertRaises(RuntimeError): run_schedule(sched)
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
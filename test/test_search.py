@@ -1,19 +1,29 @@
-import unittest
+import unittest, hashlib, pickle, os
 
 from test.helpers import ast_const
 from tinygrad.codegen.kernel import Opt, OptOps
 from tinygrad.codegen.kernel import Kernel
 from tinygrad.ops import UOp, Ops
-from tinygrad.engine.search import bufs_from_lin, actions, beam_search
+import multiprocessing, time
+from unittest.mock import patch
+from tinygrad.engine.search import bufs_from_lin, actions, beam_search, beam_search_many, CostModel
 from tinygrad.device import Device, Buffer
 from tinygrad.tensor import Tensor
 from tinygrad.dtype import dtypes
-from tinygrad.helpers import Context, GlobalCounters
+from tinygrad import helpers
+from tinygrad.helpers import Context, GlobalCounters, getenv, diskcache_put, diskcache_claim, diskcache_release
 from tinygrad.engine.realize import capturing
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.shape.view import View
 from extra.optimization.helpers import time_linearizer
 
+def _finish_claim(key, claim_key, opts):
+  # a forked process needs its own db connection
+  helpers._db_connection = None
+  time.sleep(0.5)
+  diskcache_put("beam_search", key, opts)
+  diskcache_release("beam_search", claim_key)
+
 class TestTimeLinearizer(unittest.TestCase):
   @unittest.skipIf(Device.DEFAULT == "WEBGPU", "WebGPU timestamps are low precision, tm is 0")
   def test_reasonable_time(self):
@@ -185,5 +195,53 @@ class TestBEAM(unittest.TestCase):
     beam_search(lin, bufs, 3, disable_cache=True)
     self.assertEqual(kcount, len(Kernel.kernel_cnt))
 
+  def test_beam_search_many(self):
+    a, b = Tensor.rand(64, 64).realize(), Tensor.rand(64, 64).realize()
+    asts = [x.schedule()[-1].ast for x in [a@b, (a+b).sum(1)]]
+    lins = [Kernel(ast) for ast in asts+asts[:1]]
+    ks = beam_search_many([(lin, bufs_from_lin(lin)) for lin in lins], 2, disable_cache=True)
+    self.assertEqual(len(ks), 3)
+    self.assertEqual(ks[0].applied_opts, ks[2].applied_opts)
+    # the results are in the beam cache
+    with patch("tinygrad.engine.search._search_lockstep", side_effect=AssertionError("searched")):
+      for lin,k in zip(lins, ks): self.assertEqual(beam_search(lin, bufs_from_lin(lin), 2).applied_opts, k.applied_opts)
+
+  def test_beam_search_waits_for_claim(self):
+    a = Tensor.rand(32, 48).realize()
+    lin = Kernel((a+2).sum(0).schedule()[-1].ast)
+    key = {"ast": lin.ast.key, "amt": 2, "allow_test_size": True, "device": lin.opts.device, "suffix": lin.opts.suffix}
+    claim_key = hashlib.sha256(pickle.dumps(key)).hexdigest()
+    opts = [Opt(OptOps.UPCAST, 0, 4)]
+    diskcache_release("beam_search", claim_key)
+    self.assertTrue(diskcache_claim("beam_search", claim_key, 3600))
+    # another process has the kernel claimed, so this one waits for its result instead of searching
+    (p:=multiprocessing.get_context("fork").Process(target=_finish_claim, args=(key, claim_key, opts))).start()
+    with patch("tinygrad.engine.search._search_lockstep", side_effect=AssertionError("searched")):
+      self.assertEqual(beam_search(lin, bufs_from_lin(lin), 2).applied_opts, opts)
+    p.join()
+
+class TestCostModel(unittest.TestCase):
+  def test_fit(self):
+    cm = CostModel(n=3)
+    for a in range(8):
+      for b in range(4): cm.update([1.0, a, b], 2**(0.5*a-b+3))
+    self.assertAlmostEqual(cm.predict([1.0, 5, 2]), 0.5*5-2+3, places=2)
+
+  def test_cost_topk(self):
+    from tinygrad.engine import search
+    pruned = []
+    def _cost_prune(*args):
+      pruned.append(ret:=orig_prune(*args))
+      return ret
+    orig_prune, a = search._cost_prune, Tensor.rand(32, 48).realize()
+    lin = Kernel((a*3).sum(1).schedule()[-1].ast)
+    getenv.cache_clear()
+    try:
+      with patch.dict(os.environ, {"BEAM_COST_TOPK": "2", "BEAM_COST_MIN_SAMPLES": "0"}), patch.object(search, "_cost_prune", _cost_prune):
+        beam_search(lin, bufs_from_lin(lin), 2, disable_cache=True)
+    finally: getenv.cache_clear()
+    self.assertGreater(len(pruned), 0)
+    self.assertTrue(all(len(x) <= 2 for x in pruned))
+
 if __name__ == '__main__':
   unittest.main()
@@ -837,6 +837,11 @@ class TestTensorMetadata(unittest.TestCase):
     self.assertEqual(len(bw), 1)
     self.assertEqual(bw[0].name, "sigmoid")
 
+  def test_reset_after_exception(self):
+    with self.assertRaises(ValueError): Tensor.ones(4).reshape(5)
+    out = Tensor.ones(4).contiguous().realize().add(1)
+    self.assertEqual(out.lazydata.metadata.name, "add")
+
 class TestIdxUpcast(unittest.TestCase):
   def _find_op(self, ast: UOp, op: Ops):
     if ast.op is op: return ast
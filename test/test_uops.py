@@ -11,7 +11,7 @@ from tinygrad.ops import Ops, UOp, UPat, KernelInfo, exec_alu # noqa F401
 from tinygrad.spec import spec
 from tinygrad.renderer import ProgramSpec
 from tinygrad.engine.grouper import fix_kernel_ops
-from tinygrad.engine.realize import CompiledRunner, get_kernel
+from tinygrad.engine.realize import CompiledRunner, get_kernel, lower_schedule_item
 from tinygrad.codegen.linearize import linearize_uop
 from tinygrad.codegen.devectorizer import full_graph_rewrite
 from tinygrad.codegen.symbolic import sym
@@ -642,5 +642,56 @@ class TestUOpChildren(unittest.TestCase):
     del c
     self.assertEqual(len(a.children), 0)
 
+class TestUOpHash(unittest.TestCase):
+  def test_shash_structural(self):
+    a = UOp.variable("weird_name_237", 0, 10)
+    b = (a+1)*2
+    shash = b.shash
+    del b
+    self.assertEqual(((a+1)*2).shash, shash)
+    self.assertNotEqual(((a+1)*3).shash, shash)
+    self.assertNotEqual((a+1).shash, (a+1).cast(dtypes.float).shash)
+
+  def test_key_deep_graph(self):
+    import hashlib, sys
+    a = UOp.variable("weird_name_238", 0, 10)
+    r = a
+    for i in range(sys.getrecursionlimit()*2): r = r + i
+    self.assertEqual(len(r.key), 32)
+    # same as the recursive definition
+    def key(u:UOp) -> bytes: return hashlib.sha256(str((u.op, u.dtype, u.arg)).encode() + b"".join([key(s) for s in u.src])).digest()
+    small = (a*3+1)//2
+    self.assertEqual(small.key, key(small))
+
+  def test_intern_stats(self):
+    from tinygrad.ops import uop_intern_stats
+    a = UOp.variable("weird_name_239", 0, 10)
+    st = uop_intern_stats()
+    b = a*239017
+    self.assertIs(a*239017, b)
+    now = uop_intern_stats()
+    self.assertEqual(now["created"]-st["created"], 2)
+    # the second a*239017 finds both the CONST and the MUL
+    self.assertEqual(now["hits"]-st["hits"], 2)
+
+class TestPythonNumpy(unittest.TestCase):
+  # PYTHON_NUMPY must match the python interpreter exactly, outside of transcendental functions
+  def _check(self, fxn, *shapes, dtype=dtypes.float):
+    ins = [Tensor((np.random.default_rng(i).random(s)*100).astype(_to_np_dtype(dtype)), device="PYTHON").realize() for i,s in enumerate(shapes)]
+    ei = lower_schedule_item(fxn(*ins).schedule()[-1])
+    outs = []
+    for numpy in [False, True]:
+      ei.prg._prg.numpy = numpy
+      ei.run()
+      outs.append(ei.bufs[0].numpy())
+    np.testing.assert_equal(*outs)
+
+  def test_matmul(self): self._check(lambda a,b: a@b, (16, 9), (9, 12))
+  def test_reduce(self): self._check(lambda a: a.max(1) + a.sum(0)[:8], (8, 33))
+  def test_pad_where(self): self._check(lambda a: (a > 50).where(a.pad(((1, 1), (2, 0)))[1:-1, :-2], -a), (7, 9))
+  def test_int_alu(self): self._check(lambda a,b: a//(b+1) + (a-50)%(b+5) - (a*b)//-7 + (a^b) + a.maximum(b), (5, 7), (5, 7), dtype=dtypes.int32)
+  def test_cast(self): self._check(lambda a: (a*-3).cast(dtypes.int8).cast(dtypes.uint16) + a.cast(dtypes.uint16), (40,))
+  def test_cumsum(self): self._check(lambda a: a.cumsum(1), (4, 70))
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
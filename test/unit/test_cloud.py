@@ -0,0 +1,52 @@
+import unittest, threading, struct
+from http.server import ThreadingHTTPServer
+from tinygrad.device import Device, BufferSpec
+from tinygrad.runtime.ops_cloud import CloudHandler, CloudTransport, BatchRequest, BufferAlloc, CopyIn, CopyOut
+
+class TestCloudTransport(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    CloudHandler.device = Device.DEFAULT
+    cls.server = ThreadingHTTPServer(('127.0.0.1', 0), CloudHandler)
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    cls.host = f"127.0.0.1:{cls.server.server_address[1]}"
+  @classmethod
+  def tearDownClass(cls): cls.server.shutdown()
+
+  def _batch(self, *cmds, data:bytes=b"") -> bytes:
+    req = BatchRequest()
+    # commands that carry data are passed as a function of its hash
+    for c in cmds: req.q(c(req.h(data)) if callable(c) else c)
+    return req.serialize()
+
+  def test_properties(self):
+    t = CloudTransport(self.host, "props")
+    self.assertIn(b"clouddev", t.send("GET", "properties"))
+
+  def test_pipelined_in_order(self):
+    t = CloudTransport(self.host, "pipeline", depth=4)
+    t.submit(self._batch(BufferAlloc(1, 4*64, BufferSpec())))
+    futs = [t.submit(self._batch(lambda h: CopyIn(1, h), CopyOut(1), data=struct.pack("<64i", *([i]*64)))) for i in range(16)]
+    for i,f in enumerate(futs): self.assertEqual(struct.unpack("<64i", f.result()), (i,)*64)
+    t.wait()
+    self.assertFalse(t.busy())
+
+  def test_compressed(self):
+    t = CloudTransport(self.host, "compress", compress=1)
+    data = bytes(range(256))*64
+    ret = t.submit(self._batch(BufferAlloc(1, len(data), BufferSpec()), lambda h: CopyIn(1, h), CopyOut(1), data=data)).result()
+    self.assertEqual(ret, data)
+
+  def test_retry_is_not_rerun(self):
+    t = CloudTransport(self.host, "retry")
+    batch = self._batch(BufferAlloc(1, 16, BufferSpec()))
+    t.send("POST", "batch", batch, {"X-Seq": "0"})
+    # resending the same seq returns the stored response instead of allocating the buffer again
+    self.assertEqual(t.send("POST", "batch", batch, {"X-Seq": "0"}), b"")
+
+  def test_error_is_raised(self):
+    t = CloudTransport(self.host, "error")
+    with self.assertRaises(RuntimeError): t.submit(self._batch(CopyOut(7))).result()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,8 +1,8 @@
 #!/usr/bin/env python
-import unittest
+import unittest, ctypes
 from tinygrad import Tensor
-from tinygrad.device import Device, Compiler
-from tinygrad.helpers import diskcache_get, diskcache_put, getenv, Context
+from tinygrad.device import Device, Compiler, LRUAllocator, BufferSpec, _MallocAllocator
+from tinygrad.helpers import diskcache_get, diskcache_put, getenv, Context, GlobalCounters
 
 class TestDevice(unittest.TestCase):
   def test_canonicalize(self):
@@ -53,5 +53,97 @@ class TestCompiler(unittest.TestCase):
       a = Tensor([0.,1.], device=Device.DEFAULT).realize()
       (a + 1).realize()
 
+class MockAllocator(LRUAllocator):
+  def __init__(self, max_cached=None, size_classes=True):
+    super().__init__(max_cached, size_classes)
+    self.allocated: list[int] = []
+  def _alloc(self, size, options):
+    self.allocated.append(size)
+    return bytearray(size)
+  def _free(self, opaque, options): self.allocated.remove(len(opaque))
+  def _offset(self, buf, size, offset): return memoryview(buf)[offset:offset+size]
+
+class TestLRUAllocator(unittest.TestCase):
+  def test_size_class(self):
+    a = MockAllocator()
+    self.assertEqual(a.size_class(1), 64)
+    self.assertEqual(a.size_class(1000), 1024)
+    self.assertEqual(a.size_class(1025), 1280)
+    self.assertEqual(a.size_class(1000, BufferSpec(nolru=True)), 1000)
+    with Context(LRU=0): self.assertEqual(a.size_class(1000), 1000)
+    # opt-in, runtimes that need their own buffer handed back don't round
+    self.assertEqual(MockAllocator(size_classes=False).size_class(1000), 1000)
+
+  def test_views_are_weak(self):
+    a = MockAllocator()
+    buf = a.alloc(1000)
+    self.assertEqual(len(a.views), 1)
+    a.free(buf, 1000)
+    self.assertEqual(len(a.views), 0)
+    del buf
+    buf = a.alloc(1000)
+    # a view that is dropped without being freed doesn't stay in views
+    del buf
+    self.assertEqual(len(a.views), 0)
+
+  def test_reuse_size_class(self):
+    a, hits = MockAllocator(), GlobalCounters.lru_hits
+    buf = a.alloc(1000)
+    self.assertEqual(len(buf), 1000)
+    a.free(buf, 1000)
+    self.assertEqual(a.cached_bytes, 1024)
+    self.assertEqual(len(a.alloc(1020)), 1020)
+    self.assertEqual(a.allocated, [1024])
+    self.assertEqual(a.cached_bytes, 0)
+    self.assertEqual(GlobalCounters.lru_hits, hits+1)
+
+  def test_max_cached_evicts_lru(self):
+    a = MockAllocator(max_cached=2048)
+    bufs = [a.alloc(1024) for _ in range(3)]
+    for b in bufs: a.free(b, 1024)
+    self.assertEqual(a.cached_bytes, 2048)
+    self.assertEqual(a.allocated, [1024, 1024])
+    # the oldest freed buffer is the one evicted
+    self.assertFalse(any(b is bufs[0] for b in a.cache[(1024, None)].values()))
+    a.free(a.alloc(4096), 4096)
+    self.assertEqual(a.cached_bytes, 2048)
+    self.assertEqual(a.allocated, [1024, 1024])
+
+  def test_max_cached_contextvar(self):
+    a = MockAllocator()
+    with Context(LRU_MAX_BYTES=1024):
+      for b in [a.alloc(1024) for _ in range(3)]: a.free(b, 1024)
+    self.assertEqual(a.cached_bytes, 1024)
+
+  def test_free_cache(self):
+    a, cached = MockAllocator(), GlobalCounters.mem_cached
+    for b in [a.alloc(sz) for sz in [100, 1000, 10000]]: a.free(b, len(b))
+    self.assertEqual(GlobalCounters.mem_cached, cached+a.cached_bytes)
+    a.free_cache()
+    self.assertEqual((a.allocated, a.cached_bytes, GlobalCounters.mem_cached), ([], 0, cached))
+
+class TestMallocArena(unittest.TestCase):
+  def test_arena_suballocation(self):
+    a = _MallocAllocator()
+    with Context(MALLOC_ARENA=1, LRU=0):
+      b1, b2 = a.alloc(1000), a.alloc(5000)
+      self.assertEqual(len(a.arenas), 1)
+      base = a.arenas[0][0]
+      self.assertTrue(base <= ctypes.addressof(b1) < ctypes.addressof(b2) < base + (1 << 20))
+      self.assertEqual(ctypes.addressof(b1) % 0x20, 0)
+      self.assertEqual(ctypes.addressof(b2) % 0x1000, 0)
+      a.free(b1, 1000)
+      self.assertEqual(ctypes.addressof(a.alloc(1000)), base)
+      # too big for the arena
+      self.assertEqual(len(a.alloc(2 << 20)), 2 << 20)
+      self.assertEqual(len(a.arenas), 1)
+
+  def test_arena_offset(self):
+    a = _MallocAllocator()
+    with Context(MALLOC_ARENA=1, LRU=0):
+      buf = a.alloc(256)
+      a._copyin(buf, memoryview(bytearray(range(256))))
+      self.assertEqual(bytes(a._offset(buf, 16, 32)), bytes(range(32, 48)))
+
 if __name__ == "__main__":
   unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 import pickle
-from tinygrad.helpers import diskcache_get, diskcache_put, diskcache, diskcache_clear
+from tinygrad.helpers import diskcache_get, diskcache_put, diskcache, diskcache_clear, diskcache_claim, diskcache_release
 
 def remote_get(table,q,k): q.put(diskcache_get(table, k))
 def remote_put(table,k,v): diskcache_put(table, k, v)
@@ -50,6 +50,17 @@ class DiskCache(unittest.TestCase):
     self.assertEqual(diskcache_get(table, 4), 5)
     self.assertEqual(diskcache_get(table, "4"), 5)
 
+  def test_claim(self):
+    table = "test_claim"
+    diskcache_release(table, "k")
+    self.assertTrue(diskcache_claim(table, "k", 3600))
+    self.assertFalse(diskcache_claim(table, "k", 3600))
+    # a stale claim is taken over
+    self.assertTrue(diskcache_claim(table, "k", -1))
+    diskcache_release(table, "k")
+    self.assertTrue(diskcache_claim(table, "k", 3600))
+    diskcache_release(table, "k")
+
   def test_decorator(self):
     calls = 0
     @diskcache
@@ -2,7 +2,7 @@ import pathlib, tempfile, unittest
 import numpy as np
 from tinygrad import Tensor, Device, dtypes
 from tinygrad.dtype import DType
-from tinygrad.nn.state import safe_load, safe_save, get_state_dict, torch_load
+from tinygrad.nn.state import safe_load, safe_save, get_state_dict, torch_load, load_state_dict
 from tinygrad.helpers import Timing, fetch, temp, CI, OSX
 from tinygrad.device import is_dtype_supported
 
@@ -351,6 +351,31 @@ class TestDiskTensor(unittest.TestCase):
       on_dev = t.to(Device.DEFAULT).realize()
       np.testing.assert_equal(on_dev.numpy(), t.numpy())
 
+  @unittest.skipUnless(hasattr(Device["DISK"], 'io_uring'), "needs io_uring")
+  def test_disk_reader(self):
+    from tinygrad.runtime.ops_disk import DiskReader
+    fn = pathlib.Path(temp("dt_disk_reader"))
+    fn.write_bytes(data:=bytes(range(251))*1024)
+    t = Tensor.empty(len(data), device=f"disk:{fn}", dtype=dtypes.uint8).realize()
+    # more reads than the depth, split in many segments, at unaligned offsets
+    reader = DiskReader(depth=3, seg_len=8192)
+    reads = [(off, dest:=memoryview(bytearray(size)), reader.submit(t[off:off+size].contiguous().realize().lazydata.buffer._buf, dest))
+             for off,size in [(0, 100000), (551, 4096), (4095, 12345), (250000, 1024), (1, 8191)]]
+    for off,dest,ticket in reversed(reads):
+      reader.wait(ticket)
+      self.assertEqual(bytes(dest), data[off:off+len(dest)])
+
+  def test_load_state_dict(self):
+    class Model:
+      def __init__(self):
+        self.w1, self.w2 = Tensor.empty(33, 17), Tensor.empty(4097, dtype=dtypes.half)
+        self.b, self.i = Tensor.empty(3), Tensor.empty(5, dtype=dtypes.int8)
+    state_dict = {"w1": Tensor.randn(33, 17), "w2": Tensor.randn(4097).half(), "b": Tensor([1., 2., 3.]),
+                  "i": Tensor([1, -2, 3, -4, 5], dtype=dtypes.int8)}
+    safe_save(state_dict, temp("dt_load_state_dict"))
+    load_state_dict(model:=Model(), safe_load(temp("dt_load_state_dict")), verbose=False)
+    for k,v in state_dict.items(): np.testing.assert_equal(getattr(model, k).numpy(), v.numpy())
+
   @unittest.skipUnless(OSX, "seems to only be an issue on macOS with file size >2 GiB")
   def test_copy_to_cpu_not_truncated(self):
     with open((fn:=temp("dt_copy_to_cpu_not_truncated")), "wb") as f: f.write(b'\x01' * (size := int(2 * 1024**3)) + (test := b"test"))
@@ -1,7 +1,7 @@
 import os, unittest, ctypes
-from tinygrad import dtypes, Tensor, fetch, Device
+from tinygrad import dtypes, Tensor, fetch, Device, GlobalCounters
 import numpy as np
-from tinygrad.nn.state import ggml_data_to_tensor, gguf_load
+from tinygrad.nn.state import ggml_data_to_tensor, gguf_load, ggml_dequantize, ggml_quantized_blocks
 from tinygrad.device import is_dtype_supported
 try:
   import ggml
@@ -59,6 +59,21 @@ class TestGGUF(unittest.TestCase):
   def test_dequantization_q8_0(self): self._test_dequantization(ggml.GGML_TYPE_Q8_0)
   def test_dequantization_q6_k(self): self._test_dequantization(ggml.GGML_TYPE_Q6_K)
 
+  def test_quantized_load_tinyllama_q4_0(self):
+    fp = fetch("https://huggingface.co/ggml-org/models/resolve/main/tinyllamas/stories15M-q4_0.gguf?download=true")
+    gguf_tensor = Tensor.empty(os.stat(fp).st_size, dtype=dtypes.uint8, device=f"disk:{fp}").to(Device.DEFAULT)
+    _, tensors = gguf_load(gguf_tensor)
+    _, qtensors = gguf_load(gguf_tensor, quantized=True)
+    self.assertEqual(tensors.keys(), qtensors.keys())
+    for name,qt in qtensors.items():
+      if qt.dtype == dtypes.uint8: qt = ggml_dequantize(qt, {nbytes: t for t,(_,nbytes) in ggml_quantized_blocks.items()}[qt.shape[-1]])
+      np.testing.assert_equal(qt.numpy(), tensors[name].numpy())
+
+  def test_dequantize_matmul_q4_0(self): self._test_dequantize_matmul(ggml.GGML_TYPE_Q4_0)
+  def test_dequantize_matmul_q4_1(self): self._test_dequantize_matmul(ggml.GGML_TYPE_Q4_1)
+  def test_dequantize_matmul_q8_0(self): self._test_dequantize_matmul(ggml.GGML_TYPE_Q8_0)
+  def test_dequantize_matmul_q6_k(self): self._test_dequantize_matmul(ggml.GGML_TYPE_Q6_K)
+
   def test_expected_failure_unknown_type(self):
     with self.assertRaises(ValueError):
       ggml_data_to_tensor(Tensor.empty(512, dtype=dtypes.uint8), 256, 1337)
@@ -78,6 +93,22 @@ class TestGGUF(unittest.TestCase):
 
     np.testing.assert_equal(dq_tensor.numpy(), np.frombuffer(c_dq_data, dtype=np.float32))
 
+  def _test_dequantize_matmul(self, ttype: int, rows=16):
+    type_traits = ggml.ggml_internal_get_type_traits(ttype)
+    n_el, n_bytes = rows * ggml_test_block_count * type_traits.blck_size, rows * ggml_test_block_count * type_traits.type_size
+    data_in = (np.random.random((n_el,)).astype(np.float32) * 2 - 1).ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+    c_q_data, c_dq_data = (ctypes.c_char * n_bytes)(0), (ctypes.c_float * n_el)(0)
+    type_traits.from_float(data_in, c_q_data, n_el)
+    type_traits.to_float(c_q_data, c_dq_data, n_el)
+
+    blocks = Tensor(np.frombuffer(c_q_data, dtype=np.uint8, count=n_bytes)).reshape(rows, ggml_test_block_count, -1).realize()
+    x = Tensor.randn(1, n_el // rows).realize()
+    GlobalCounters.reset()
+    out = x.linear(ggml_dequantize(blocks, ttype).T).realize()
+    # the weight is dequantized in the matmul kernel
+    self.assertEqual(GlobalCounters.kernel_count, 1)
+    np.testing.assert_allclose(out.numpy(), x.numpy() @ np.frombuffer(c_dq_data, dtype=np.float32).reshape(rows, -1).T, atol=1e-4, rtol=1e-4)
+
   def _test_gguf_load(self, url: str):
     fp = fetch(url)
     model_size = os.stat(fp).st_size
@@ -202,8 +202,8 @@ class TestGEPAndVectorizeRewrite(unittest.TestCase):
     self.assertEqual([sub_uop.arg for sub_uop in optimized_uop.src], [5.0, 10.0, 15.0, 20.0])
 
 
-import inspect
-from tinygrad.ops import graph_rewrite, _substitute, track_rewrites
+import inspect, sys, gc, weakref
+from tinygrad.ops import graph_rewrite, _substitute, track_rewrites, rewrite_memo, PatternMatcher, UPat
 from tinygrad.codegen.symbolic import symbolic_simple
 
 class TestBottomUpRewrite(unittest.TestCase):
@@ -275,6 +275,45 @@ class TestSubstitute(unittest.TestCase):
     ret = substitute(ret, {a.sin():a.sqrt(), n1.sin():n1.sqrt()})
     self.assertIs(ret, a.sqrt().sqrt())
 
+memo_calls: list[UOp] = []
+class TestIterativeRewrite(unittest.TestCase):
+  def test_deep_graph(self):
+    a = UOp.variable('a', 0, 10)
+    ret = a
+    for i in range(sys.getrecursionlimit()*2): ret = ret + (i%3)
+    for bottom_up in [False, True]:
+      self.assertIs(graph_rewrite(ret, symbolic_simple, bottom_up=bottom_up), graph_rewrite(ret, symbolic_simple, bottom_up=bottom_up))
+
+  def test_memo(self):
+    a = UOp.variable('a', 0, 10)
+    ret = (a*1+0)*(a+0)
+    gt = graph_rewrite(ret, symbolic_simple)
+    self.assertIs(graph_rewrite(ret, symbolic_simple, memo=True), gt)
+    self.assertIs(rewrite_memo[symbolic_simple][False][ret], gt)
+    # the second time it's all from the memo
+    pm = PatternMatcher([(UPat(Ops.ADD, name="x"), lambda x: memo_calls.append(x))])+symbolic_simple
+    graph_rewrite(ret, pm, memo=True)
+    n_calls = len(memo_calls)
+    self.assertIs(graph_rewrite(ret, pm, memo=True), gt)
+    self.assertEqual(len(memo_calls), n_calls)
+
+  def test_memo_drops_dead_graphs(self):
+    a = UOp.variable('memo_gc', 0, 10)
+    ret = (a+0)*2 + a*1
+    gt = graph_rewrite(ret, symbolic_simple, memo=True)
+    memo = rewrite_memo[symbolic_simple][False]
+    # the result references a, which is a key of the memo itself
+    self.assertIn(a, gt.toposort())
+    self.assertIn(a, memo)
+    wa, n = weakref.ref(a), len(memo)
+    del a, ret, gt
+    gc.collect()
+    self.assertIsNone(wa())
+    self.assertLess(len(memo), n)
+
+  def test_memo_needs_no_ctx(self):
+    with self.assertRaises(AssertionError): graph_rewrite(UOp.variable('a', 0, 10), _substitute, {}, memo=True)
+
 
 if __name__ == '__main__':
   unittest.main()
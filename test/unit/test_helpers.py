@@ -1,6 +1,6 @@
 import gzip, unittest
 from tinygrad import Variable
-from tinygrad.helpers import Context, ContextVar
+from tinygrad.helpers import Context, ContextVar, lru_cache, cache_stats, clear_caches
 from tinygrad.helpers import merge_dicts, strip_parens, prod, round_up, fetch, fully_flatten, from_mv, to_mv, polyN, time_to_str, cdiv, cmod
 from tinygrad.tensor import get_shape
 from tinygrad.codegen.lowerer import get_contraction, get_contraction_with_reduce
@@ -332,5 +332,27 @@ class TestCStyleDivMod(unittest.TestCase):
     self.assertEqual(cmod(4, -5), 4)
     self.assertEqual(cmod(9, -5), 4)
 
+@lru_cache(maxsize=2)
+def _square(x:int) -> int: return x*x
+
+class TestLRUCache(unittest.TestCase):
+  def setUp(self): _square.cache_clear()
+  def _stats(self): return cache_stats()[f"{__name__}._square"]
+  def test_counters(self):
+    for x in [1, 2, 1, 1]: self.assertEqual(_square(x), x*x)
+    self.assertEqual(self._stats(), {"hits":2, "misses":2, "size":2, "maxsize":2})
+  def test_evicts_least_recently_used(self):
+    for x in [1, 2, 1, 3]: _square(x)
+    self.assertEqual(self._stats()["size"], 2)
+    _square(1)
+    self.assertEqual(self._stats()["hits"], 2)
+    _square(2)
+    self.assertEqual(self._stats()["misses"], 4)
+  def test_clear_caches(self):
+    _square(1)
+    clear_caches()
+    self.assertEqual(self._stats()["size"], 0)
+    self.assertTrue(all(v["size"] == 0 for v in cache_stats().values()))
+
 if __name__ == '__main__':
   unittest.main()
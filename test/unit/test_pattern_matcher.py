@@ -210,6 +210,35 @@ class TestPatternMatcher(unittest.TestCase):
       if isinstance(u.src, itertools.repeat): return next(u.src[0])
       return u.src[0]
     for a,b in zip(simple_src(a), simple_src(b)): self._assert_eq_upat(a, b)
+class TestPatternMatcherDispatch(unittest.TestCase):
+  def _linear_rewrite(self, pm:PatternMatcher, uop:UOp):
+    ler = {u.op for u in uop.src}
+    for _,match,early_reject in pm.pdict.get(uop.op, []):
+      if not early_reject.issubset(ler): continue
+      if (ret:=match(uop, None)) is not None: return ret
+    return None
+
+  def test_same_as_linear(self):
+    from tinygrad.codegen.symbolic import symbolic, sym
+    a, b = UOp.variable("a", 0, 10), UOp.variable("b", -5, 5)
+    exprs = [(a*4+b*2)//2, (a+b)%3 < 2, (a*2+1).cast(dtypes.float)*2.0+0.0, ((a<3).where(a, b)+0)*1, UOp.sink(a.gep(0), (a+b).bitcast(dtypes.uint))]
+    for pm in [symbolic, sym]:
+      for u in UOp.sink(*exprs).toposort():
+        self.assertIs(pm.rewrite(u), self._linear_rewrite(pm, u))
+
+  def test_dispatch_filters(self):
+    matcher = PatternMatcher([
+      (UPat(Ops.ADD, src=(UPat(Ops.CONST), UPat())), lambda: 1),
+      (UPat(Ops.ADD, dtype=dtypes.float), lambda: 2),
+      (UPat(Ops.ADD, src=UPat(Ops.DEFINE_VAR)), lambda: 3),
+    ])
+    a = UOp.variable("a", 0, 10)
+    self.assertEqual(matcher.rewrite(a.const_like(1)+a), 1)
+    self.assertEqual(matcher.rewrite(a+a), 3)
+    self.assertEqual(len(matcher.dispatch[(Ops.ADD, dtypes.int, (Ops.DEFINE_VAR, Ops.DEFINE_VAR))]), 1)
+    f = UOp.const(dtypes.float, 1.0)
+    self.assertEqual(matcher.rewrite(f+f), 1)
+    self.assertEqual(matcher.rewrite((f+f)+(f+f)), 2)
 
 if __name__ == '__main__':
   unittest.main(verbosity=2)
@@ -3,8 +3,10 @@ from tinygrad.dtype import dtypes
 from tinygrad.ops import TRACK_MATCH_STATS, TrackedPatternMatcher, UOp, graph_rewrite, track_rewrites, UPat
 from tinygrad.codegen.symbolic import symbolic
 from tinygrad.ops import tracked_ctxs as contexts, tracked_keys as keys, _name_cnt, _substitute
-from tinygrad.device import ProfileDeviceEvent, ProfileRangeEvent, ProfileGraphEvent, ProfileGraphEntry
-from tinygrad.viz.serve import get_metadata, get_details, uop_to_json, to_perfetto
+from tinygrad.device import ProfileDeviceEvent, ProfileRangeEvent, ProfileGraphEvent, ProfileGraphEntry, ProfileMemoryEvent, Compiled
+from tinygrad.viz.serve import get_metadata, get_details, uop_to_json, to_perfetto, memory_peaks
+from tinygrad.helpers import Context, Metadata
+from tinygrad import Tensor
 
 # NOTE: VIZ tests always use the tracked PatternMatcher instance
 symbolic = TrackedPatternMatcher(symbolic.patterns)
@@ -266,5 +268,33 @@ class TextVizProfiler(unittest.TestCase):
     self.assertEqual(j['traceEvents'][7]['dur'], 4)
     self.assertEqual(j['traceEvents'][7]['pid'], j['traceEvents'][3]['pid'])
 
+  def test_perfetto_memory(self):
+    prof = [ProfileDeviceEvent(device='NV', comp_tdiff=decimal.Decimal(-1000), copy_tdiff=decimal.Decimal(-100)),
+            ProfileMemoryEvent(device='NV', ts=decimal.Decimal(1000), nbytes=100, mem_used=100, name='E_2', metadata=(Metadata("relu", ""),)),
+            ProfileMemoryEvent(device='NV', ts=decimal.Decimal(1001), nbytes=50, mem_used=150, name='E_3'),
+            ProfileMemoryEvent(device='NV', ts=decimal.Decimal(1002), nbytes=-100, mem_used=50, name='E_2', metadata=(Metadata("relu", ""),)),
+            ProfileMemoryEvent(device='NV', ts=decimal.Decimal(1003), nbytes=80, mem_used=130, name='E_4')]
+
+    self.assertEqual(memory_peaks(prof), {'NV': (150, decimal.Decimal(1001), {"E_2 ['relu']": 100, 'E_3': 50})})
+    j = json.loads(to_perfetto(prof))
+    counters = [x for x in j['traceEvents'] if x['ph'] == 'C']
+    self.assertEqual([x['args']['MB'] for x in counters], [1e-4, 1.5e-4, 5e-5, 1.3e-4])
+    # host timestamps, the device clock offset is not applied
+    self.assertEqual([x['ts'] for x in counters], [1000, 1001, 1002, 1003])
+    peak = [x for x in j['traceEvents'] if x['ph'] == 'i'][0]
+    self.assertEqual(peak['ts'], 1001)
+    self.assertEqual(list(peak['args']), ["E_2 ['relu']", 'E_3'])
+
+  def test_profile_buffer_memory(self):
+    a = Tensor.ones(16).contiguous().realize()
+    Compiled.profile_events = []
+    with Context(PROFILE=1):
+      b = (a + 1).realize()
+      del b
+    evs = [x for x in Compiled.profile_events if isinstance(x, ProfileMemoryEvent)]
+    self.assertEqual([x.nbytes for x in evs], [64, -64])
+    self.assertEqual(evs[0].mem_used - evs[1].mem_used, 64)
+    self.assertTrue(all(x.name.startswith("E_") and x.metadata is not None and x.metadata[0].name == "__add__" for x in evs))
+
 if __name__ == "__main__":
   unittest.main()
@@ -90,8 +90,13 @@ def hand_coded_optimizations(k:Kernel) -> list[Opt]:
     else: break
 
   # if last dim is small(ish) and it's a reduce dim, upcast the reduce (loop unrolling). no simplify needed since it's just an upcast.
+  # in a sum indexed by a fused arange (gather/Embedding), don't unroll the arange axis. it reads no buffers, and if it stays a loop
+  # symbolic can fold it into a direct load
+  is_arange_axis = len(k.reduceops) == 2 and all(r.arg[0] is Ops.ADD for r in k.reduceops) and \
+    sorted(any(u.op is Ops.LOAD for u in r.src[0].toposort()) for r in k.reduceops) == [False, True] and \
+    all(st.views[-1].strides[len(k.full_unupcasted_shape)-1] == 0 for st,b in zip(k.sts, k.bufs) if b.op in {Ops.LOAD, Ops.STORE})
   if k.first_reduce < k.first_upcast and (prod(k.full_shape[k.first_upcast:]) <= 4 or \
-    not any(r for _,_,r in k.upcasted_axis(k.full_buf_index))) and (k.upcasted == 0 or prod(k.full_shape[-k.upcasted:]) < 64):
+    not any(r for _,_,r in k.upcasted_axis(k.full_buf_index))) and (k.upcasted == 0 or prod(k.full_shape[-k.upcasted:]) < 64) and not is_arange_axis:
     if isinstance(s:=k.full_unupcasted_shape[-1], int) and s <= 32:  # NOTE: cannot loop unroll symbolic axis
       k.apply_opt(Opt(OptOps.UNROLL, len(k.full_unupcasted_shape)-1-k.first_reduce, 0))
       # if it's small, upcast a second reduce dimension too
@@ -105,7 +110,7 @@ def hand_coded_optimizations(k:Kernel) -> list[Opt]:
 
   # if nothing at all is upcasted and it's easy to, do an upcast
   for splits in [4]:
-    if k.upcasted == 0 and k.full_unupcasted_shape and k.full_unupcasted_shape[-1] % splits == 0:
+    if k.upcasted == 0 and k.full_unupcasted_shape and k.full_unupcasted_shape[-1] % splits == 0 and len(k.full_unupcasted_shape)-1 < k.first_reduce:
       k.apply_opt(Opt(OptOps.UPCAST, len(k.full_unupcasted_shape)-1, splits))
 
   # **** local groups ****
@@ -577,4 +577,5 @@ class Kernel:
       for _, group in itertools.groupby([x for x in self.ast.toposort() if x.op in GroupOp.Buffer and x.src[0].op is Ops.DEFINE_GLOBAL],
                         key=lambda x: (x.op, x.src[0].arg)))
     return ProgramSpec(self.name if not name_override else name_override, src, self.opts.device, self.ast, self.uops, self.applied_opts, mem_bytes,
-                       global_size=[1,1,1] if self.opts.has_local else None, local_size=[1,1,1] if self.opts.has_local else None)
+                       global_size=[1,1,1] if self.opts.has_local or self.opts.has_threads else None,
+                       local_size=[1,1,1] if self.opts.has_local or self.opts.has_threads else None)
@@ -109,6 +109,11 @@ def get_index(ast:UOp, opts:Renderer) -> IndexContext:
   else:
     # all loops are RANGES
     idxs = [UOp(Ops.RANGE, dtypes.int, (sint_to_uop(0), sint_to_uop(g)), i) for i,g in enumerate(full_shape[:first_reduce])]
+    # split the outermost global loop into one contiguous chunk per thread
+    if opts.has_threads and global_dims > 0 and isinstance(g0:=full_shape[0], int) and opts.global_max is not None and \
+      (threads:=max(t for t in range(1, min(g0, opts.global_max[0])+1) if g0 % t == 0)) > 1:
+      core_id = UOp(Ops.SPECIAL, dtypes.int, (), ("gidx0", threads))
+      idxs[0] = core_id if g0 == threads else core_id*(g0//threads) + UOp(Ops.RANGE, dtypes.int, (sint_to_uop(0), sint_to_uop(g0//threads)), 0)
 
   # reduce loops
   idxs += [UOp(Ops.RANGE, dtypes.int, (sint_to_uop(0), sint_to_uop(g)), i)
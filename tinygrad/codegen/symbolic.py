@@ -397,11 +397,19 @@ def loop_collapse(compval, multconst, rng:UOp, acc:UOp, extra:UOp, idx2=None,idx
   if extra is not acc: ret = ret + acc.assign(extra)
   return ret
 
-def index_collapse(idx:UOp,rng:UOp,buf:UOp,ld:UOp,acc:UOp,add=UOp.const(dtypes.int, 0),mul=UOp.const(dtypes.int, 1)):
-  if rng not in acc.src: return None
-  new_load = UOp.load(buf.index(add+mul*idx, (idx >= rng.src[0]) & (idx < rng.src[1])), dtype=ld.dtype)
+def index_collapse(idx:UOp,rng:UOp,ret:UOp,acc:UOp):
+  # sum over rng of (idx==rng)*ret is ret at rng=idx: a direct gated load instead of a one-hot reduce
+  if rng not in acc.src or rng in idx.toposort() or acc in ret.toposort(): return None
+  valid = (idx >= rng.src[0]) & (idx < rng.src[1])
+  # every load addressed by rng is gated so an out of range idx reads nothing
+  def gate(x:UOp) -> UOp:
+    v = valid.broadcast(x.src[1].dtype.count)
+    return x.replace(src=(x.src[0], x.src[1].substitute({rng:idx}), x.src[2].substitute({rng:idx})&v if len(x.src) == 3 else v))
+  subs = {x:gate(x) for x in ret.toposort() if x.op is Ops.INDEX and rng in x.src[1].toposort()}
+  new_ret = ret.substitute({**subs, rng:idx})
+  if new_ret.op is not Ops.LOAD: new_ret = valid.broadcast(new_ret.dtype.count).where(new_ret, new_ret.const_like(0))
   new_acc = acc.replace(src=acc.src[0:1]+tuple(x for x in acc.src[1:] if x is not rng))
-  return new_acc.assign(new_acc+new_load)
+  return new_acc.assign(new_acc+new_ret)
 
 def reduce_collapse(acc:UOp, ret:UOp, alu:UOp):
   reduce_parented, reduce_unparented = partition(acc.src[1:], lambda x: x in ret.toposort())
@@ -415,8 +423,6 @@ def reduce_collapse(acc:UOp, ret:UOp, alu:UOp):
 acc_pat, rng_pat = UPat(Ops.DEFINE_ACC, name="acc"), UPat(Ops.RANGE, name="rng")
 rng_aug = UPat.any(rng_pat, UPat.var("add")+rng_pat, UPat.var("mul")*rng_pat, UPat.var("add")+UPat.var("mul")*rng_pat)
 
-index_load = UPat.var("buf").index(rng_aug).load(name="ld")
-
 arange_augrng = UPat.any(rng_aug, rng_aug+UPat.var("idx2"), rng_aug+UPat.var("idx2")+UPat.var("idx3"), UPat(Ops.VECTORIZE, name="vec", src=rng_aug))
 arange_m = (arange_augrng<UPat.cvar("compval")).where(UPat.const(None, 0), UPat.cvar("multconst"))
 
@@ -462,9 +468,10 @@ sym = symbolic_flat+PatternMatcher([
    lambda x,y: y.where(x.cast(dtypes.uint32), UOp.const(dtypes.uint32, 0))),
   # arange loop folding
   (acc_pat.assign(arange_m+UPat.var("extra")), loop_collapse),
-  # indexing, with cast or where
-  (acc_pat.assign(UPat.var("idx").eq(UPat(Ops.RANGE, name="rng")).cast()*index_load+acc_pat), index_collapse),
-  (acc_pat.assign((UPat.var("idx")!=UPat(Ops.RANGE, name="rng")).where(UPat.const(None, 0.0), index_load)+acc_pat), index_collapse),
+  # indexing, with cast or where, possibly broadcast to an upcasted acc
+  (acc_pat.assign(UPat.any(eq_cast:=UPat.var("idx").eq(rng_pat).cast(), UPat(Ops.VECTORIZE, src=eq_cast))*UPat.var("ret")+acc_pat), index_collapse),
+  (acc_pat.assign(UPat.any(ne:=UPat.var("idx")!=rng_pat, UPat(Ops.VECTORIZE, src=ne)).where(UPat.const(None, 0.0), UPat.var("ret"))+acc_pat),
+   index_collapse),
   # parentless reduce  # TODO: add MUL
   (acc_pat.assign(UPat((Ops.ADD, Ops.MAX), src=[acc_pat, UPat.var("ret")], name="alu")), reduce_collapse),
   # ** self folding **
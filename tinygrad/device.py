@@ -1,12 +1,15 @@
 from __future__ import annotations
 from dataclasses import dataclass, replace
 from collections import defaultdict
-from typing import Optional, Any, Iterator, Generator
+from typing import Optional, Any, Iterator, Generator, ClassVar
 import multiprocessing, importlib, inspect, functools, pathlib, os, ctypes, ctypes.util, platform, contextlib, sys, re, atexit, pickle, decimal, time
+import concurrent.futures, mmap, threading, weakref
 from tinygrad.helpers import CI, OSX, LRU, getenv, diskcache_get, diskcache_put, DEBUG, GlobalCounters, flat_mv, from_mv, PROFILE, temp, mv_address, \
-                             cpu_time_execution, colored, Context, round_up, DISABLE_COMPILER_CACHE
+                             cpu_time_execution, colored, Context, round_up, DISABLE_COMPILER_CACHE, THREADS, LRU_MAX_BYTES, \
+                             MALLOC_ARENA, MALLOC_HUGEPAGE, Metadata
 from tinygrad.dtype import DType, ImageDType, PtrDType, dtypes, _to_np_dtype
 from tinygrad.renderer import Renderer
+from tinygrad.runtime.support.allocator import TLSFAllocator
 
 # **************** Device ****************
 
@@ -66,6 +69,10 @@ class ProfileGraphEntry: device:str; name:str; st_id:int; en_id:int; is_copy:boo
 @dataclass(frozen=True)
 class ProfileGraphEvent(ProfileEvent): ents:list[ProfileGraphEntry]; deps:list[list[int]]; sigs:list[decimal.Decimal] # noqa: E702
 
+@dataclass(frozen=True)
+class ProfileMemoryEvent(ProfileEvent):
+  device:str; ts:decimal.Decimal; nbytes:int; mem_used:int; name:str; metadata:tuple[Metadata, ...]|None=None # noqa: E702
+
 @dataclass
 class ProfileResult: st:Optional[int]=None; en:Optional[int]=None # noqa: E702
 
@@ -90,6 +97,9 @@ class BufferSpec:
   external_ptr: Optional[int] = None
 
 class Buffer:
+  # the kernel the buffers are allocated for and the live bytes per device, recorded in ProfileMemoryEvents when PROFILE is set
+  profile_owner: ClassVar[tuple[str, Optional[tuple[Metadata, ...]]]] = ("", None)
+  profile_mem_used: ClassVar[dict[str, int]] = {}
   def __init__(self, device:str, size:int, dtype:DType, opaque:Any=None, options:Optional[BufferSpec]=None, initial_value:Optional[bytes]=None,
                lb_refcount=0, base:Optional[Buffer]=None, offset:int=0, preallocate=False):
     if isinstance(dtype, ImageDType): options = BufferSpec(image=dtype) # TODO: image hack shouldn't be here. where should it be?
@@ -128,11 +138,17 @@ class Buffer:
     else:
       self._buf = opaque if opaque is not None else self.allocator.alloc(self.nbytes, self.options)
       if not self.device.startswith("DISK"): GlobalCounters.mem_used += self.nbytes
+      if PROFILE and not self.device.startswith("DISK"): self._profile_mem(self.nbytes, Buffer.profile_owner)
     return self
+  def _profile_mem(self, nbytes:int, owner:tuple[str, Optional[tuple[Metadata, ...]]]):
+    if nbytes > 0: self._profile_owner = owner
+    Buffer.profile_mem_used[self.device] = used = Buffer.profile_mem_used.get(self.device, 0) + nbytes
+    Compiled.profile_events.append(ProfileMemoryEvent(self.device, decimal.Decimal(time.perf_counter_ns()) / 1000, nbytes, used, *owner))
   def deallocate(self):
     assert self.is_allocated(), "buffer must be allocated to deallocate"
     if self._base is None and (self.options is None or self.options.external_ptr is None):
       if not self.device.startswith("DISK"): GlobalCounters.mem_used -= self.nbytes
+      if hasattr(self, "_profile_owner"): self._profile_mem(-self.nbytes, self.__dict__.pop("_profile_owner"))
       self.allocator.free(self._buf, self.nbytes, self.options)
     elif self._base is not None: self._base.allocated_views -= 1
     del self._buf
@@ -203,36 +219,89 @@ class LRUAllocator(Allocator):
   """
   The LRU Allocator is responsible for caching buffers.
   It ensures that buffers are not freed until it is absolutely necessary, optimizing performance.
+  With `size_classes`, sizes are rounded up to size classes (4 per power of two) so similar sizes share cached buffers, the caller gets a view from
+  `_offset`. It's off by default, the device runtimes (HCQ and others) expect the buffer they allocated and are handed back.
+  At most `max_cached` bytes (LRU_MAX_BYTES, 0 is unbounded) are kept per allocator, the least recently freed buffers are evicted first.
   """
-  def __init__(self): self.cache: dict[tuple[int, Optional[BufferSpec]], Any] = defaultdict(list)
+  def __init__(self, max_cached:Optional[int]=None, size_classes:bool=False):
+    self.cache: dict[tuple[int, Optional[BufferSpec]], dict[int, Any]] = defaultdict(dict)
+    self.lru: dict[int, tuple[int, Optional[BufferSpec]]] = {}  # insertion ordered, oldest first
+    # id(view) -> (weakref to view, rounded buffer, rounded size). views can be unhashable (ctypes arrays), the entry goes away with the view
+    self.views: dict[int, tuple[weakref.ref, Any, int]] = {}
+    self.max_cached, self.size_classes, self.cached_bytes, self.free_cnt = max_cached, size_classes, 0, 0
+  def size_class(self, size:int, options:Optional[BufferSpec]=None) -> int:
+    if not LRU or not self.size_classes or (options is not None and (options.image or options.external_ptr or options.nolru)): return size
+    return round_up(size, 1 << max(size.bit_length() - 3, 6))
   def alloc(self, size:int, options:Optional[BufferSpec]=None):
-    if len(c := self.cache[(size, options)]): return c.pop()
-    try: return super().alloc(size, options)
-    except (RuntimeError, MemoryError):
-      self.free_cache()
-      return super().alloc(size, options)
-  def free_cache(self):
-    for (sz,options),opaques in self.cache.items():
-      for opaque in opaques: super().free(opaque, sz, options)
-      opaques.clear()
+    if len(c := self.cache[(csz:=self.size_class(size, options), options)]):
+      GlobalCounters.lru_hits += 1
+      del self.lru[(ent:=c.popitem())[0]]
+      self.cached_bytes -= csz
+      GlobalCounters.mem_cached -= csz
+      opaque = ent[1]
+    else:
+      GlobalCounters.lru_misses += 1
+      try: opaque = super().alloc(csz, options)
+      except (RuntimeError, MemoryError):
+        self.free_cache()
+        opaque = super().alloc(csz, options)
+    if csz == size: return opaque
+    GlobalCounters.mem_padding += csz - size
+    view = self._offset(opaque, size, 0)  # type: ignore[attr-defined]
+    self.views[id(view)] = (weakref.ref(view, lambda _,k=id(view): self.views.pop(k, None)), opaque, csz)
+    return view
+  def evict(self, nbytes:int):
+    # free the least recently freed buffers until nbytes are released
+    while nbytes > 0 and len(self.lru):
+      sz, options = self.lru.pop(k:=next(iter(self.lru)))
+      super().free(self.cache[(sz, options)].pop(k), sz, options)
+      self.cached_bytes -= sz
+      GlobalCounters.mem_cached -= sz
+      nbytes -= sz
+  def free_cache(self): self.evict(self.cached_bytes)
   def free(self, opaque:Any, size:int, options:Optional[BufferSpec]=None):
-    if LRU and (options is None or not options.nolru): self.cache[(size, options)].append(opaque)
-    else: super().free(opaque, size, options)
+    if (v:=self.views.get(id(opaque))) is not None and v[0]() is opaque:
+      _, opaque, csz = self.views.pop(id(opaque))
+      GlobalCounters.mem_padding -= csz - size
+    else: csz = size
+    if LRU and (options is None or not options.nolru) and (csz <= (max_cached:=self.max_cached or LRU_MAX_BYTES.value) or not max_cached):
+      if max_cached: self.evict(self.cached_bytes + csz - max_cached)
+      self.cache[(csz, options)][self.free_cnt] = opaque
+      self.lru[self.free_cnt] = (csz, options)
+      self.free_cnt, self.cached_bytes = self.free_cnt + 1, self.cached_bytes + csz
+      GlobalCounters.mem_cached += csz
+    else: super().free(opaque, csz, options)
 
 class _MallocAllocator(LRUAllocator):
+  def __init__(self):
+    super().__init__(size_classes=True)
+    self.arenas: list[tuple[int, TLSFAllocator, mmap.mmap, ctypes.Array]] = []
   def _alloc(self, size:int, options:BufferSpec):
     # must be aligned to 0x20 for 256-bit ymm registers
     # TODO: investigate if this is the cause of nondeterminism in speed
     alignment = 0x1000 if size >= 0x1000 else 0x20
-    return (ctypes.c_uint8 * size).from_address(options.external_ptr) if options.external_ptr else self._alloc_aligned(size, alignment)
+    if options.external_ptr: return (ctypes.c_uint8 * size).from_address(options.external_ptr)
+    if MALLOC_ARENA and size <= (MALLOC_ARENA.value << 20): return (ctypes.c_uint8 * size).from_address(self._alloc_arena(size, alignment))
+    return self._alloc_aligned(size, alignment)
   def _alloc_aligned(self, size:int, alignment:int):
     buffer = (ctypes.c_uint8 * (size + alignment))()
     offset = round_up(ctypes.addressof(buffer), alignment) - ctypes.addressof(buffer)
     return (ctypes.c_uint8 * size).from_buffer(buffer, offset)
+  def _alloc_arena(self, size:int, alignment:int) -> int:
+    for _,tlsf,_,_ in self.arenas:
+      with contextlib.suppress(MemoryError): return tlsf.alloc(size, alignment)
+    # pages are untouched until first write, so they are placed on the NUMA node of the thread that fills the buffer
+    mm = mmap.mmap(-1, arena_sz:=MALLOC_ARENA.value << 20, **({} if sys.platform == "win32" else {"flags": mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS}))
+    if MALLOC_HUGEPAGE and hasattr(mmap, "MADV_HUGEPAGE"): mm.madvise(mmap.MADV_HUGEPAGE)
+    self.arenas.append((addr:=ctypes.addressof(mem:=(ctypes.c_uint8 * arena_sz).from_buffer(mm)), TLSFAllocator(arena_sz, base=addr), mm, mem))
+    return self.arenas[-1][1].alloc(size, alignment)
+  def _free(self, opaque, options:BufferSpec):
+    for base,tlsf,mm,_ in self.arenas:
+      if base <= ctypes.addressof(opaque) < base + len(mm): return tlsf.free(ctypes.addressof(opaque))
   def _as_buffer(self, src) -> memoryview: return flat_mv(memoryview(src))
   def _copyin(self, dest, src:memoryview): ctypes.memmove(dest, from_mv(src), len(src))
   def _copyout(self, dest:memoryview, src): ctypes.memmove(from_mv(dest), src, len(dest))
-  def _offset(self, buf, size:int, offset:int): return from_mv(self._as_buffer(buf)[offset:offset+size])
+  def _offset(self, buf, size:int, offset:int): return (ctypes.c_uint8 * size).from_buffer(buf, offset)
 
 MallocAllocator = _MallocAllocator()
 
@@ -274,15 +343,38 @@ class CPUProgram:
 
       self.fxn = ctypes.CFUNCTYPE(None)(mv_address(self.mem))
 
-  def __call__(self, *bufs, vals=(), wait=False):
-    args = list(bufs) + list(vals)
+  # NOTE: ctypes releases the GIL while in the foreign call, so python threads are enough to run the kernel on many cores
+  pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+  pool_size: int = 0
+  # one threaded launch at a time. two launches sharing the pool could each hold part of it while waiting for the rest on a barrier
+  launch_lock = threading.Lock()
+  @staticmethod
+  def _fix_args(args:list) -> list:
     # NOTE: replace this by --target={host's triple}-elf in clang args once we only support macos sequoia and later.
     # Apple relaxes abi requirement for stack arguments to always be at least 8 byte aligned on arm64
     # https://developer.apple.com/documentation/xcode/writing-arm64-code-for-apple-platforms
     # This hack is required because clang/llvm bug doesn't allow us to just use {host's triple}+'-elf' (relocation failures)
     # The bug was fixed in https://github.com/llvm/llvm-project/commit/454cc36630296262cdb6360b60f90a64a97f7f1a but was only backported to xcode 16+
-    if platform.machine() == "arm64" and OSX: args = args[:8] + [ctypes.c_int64(a) if isinstance(a, int) else a for a in args[8:]]
-    return cpu_time_execution(lambda: self.fxn(*args), enable=wait)
+    if platform.machine() == "arm64" and OSX: return args[:8] + [ctypes.c_int64(a) if isinstance(a, int) else a for a in args[8:]]
+    return args
+
+  def _run_threads(self, args:list, threads:int):
+    # NOTE: all the threads of a launch must run at the same time, graphs spin on a barrier between kernels
+    with CPUProgram.launch_lock:
+      if threads-1 > CPUProgram.pool_size:
+        if CPUProgram.pool is not None: CPUProgram.pool.shutdown(wait=False)
+        CPUProgram.pool_size = max(THREADS.value, threads)-1
+        CPUProgram.pool = concurrent.futures.ThreadPoolExecutor(CPUProgram.pool_size, "tinygrad_cpu")
+      # the calling thread is core 0, the other cores run on the pool
+      futures = [pool.submit(self.fxn, *self._fix_args(args+[i])) for i in range(1, threads)] if (pool:=CPUProgram.pool) is not None else []
+      self.fxn(*self._fix_args(args+[0]))
+      for f in futures: f.result()
+
+  def __call__(self, *bufs, global_size:Optional[tuple[int, ...]]=None, local_size:Optional[tuple[int, ...]]=None, vals=(), wait=False):
+    args = list(bufs) + list(vals)
+    # kernels rendered with has_threads take a trailing core_id, global_size[0] is the number of threads to run
+    if global_size is not None: return cpu_time_execution(lambda: self._run_threads(args, global_size[0]), enable=wait)
+    return cpu_time_execution(lambda: self.fxn(*self._fix_args(args)), enable=wait)
 
   def __del__(self):
     if sys.platform == 'win32': ctypes.windll.kernel32.VirtualFree(ctypes.c_void_p(self.mem), ctypes.c_size_t(0), 0x8000) #0x8000 - MEM_RELEASE
@@ -2,7 +2,7 @@ from __future__ import annotations
 from typing import Final, Optional, ClassVar, Union, Callable, Literal
 import math, struct, ctypes, functools
 from dataclasses import dataclass, fields
-from tinygrad.helpers import getenv, prod
+from tinygrad.helpers import getenv, prod, lru_cache
 
 ConstType = Union[float, int, bool]
 
@@ -33,7 +33,7 @@ class DType(metaclass=DTypeMetaClass):
   def base(self): return self
   @property
   def vcount(self): return self.count
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @lru_cache(maxsize=1024)
   def vec(self, sz:int) -> DType:
     assert self.count == 1, f"can't vectorize {self} with size {sz}"
     if sz == 1 or self == dtypes.void: return self  # void doesn't vectorize, and sz=1 is scalar
@@ -50,7 +50,7 @@ class PtrDType(DType):
   size: int = -1  # -1 is unlimited size
   @property
   def base(self): return self._base
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @lru_cache(maxsize=1024)
   def vec(self, sz:int) -> DType:
     assert self.v == 1, f"can't vectorize ptr {self} with size {sz}"
     if sz == 1: return self  # sz=1 is a scalar
@@ -73,13 +73,13 @@ class ImageDType(PtrDType):
 
 class dtypes:
   @staticmethod
-  @functools.cache
+  @lru_cache(maxsize=1024)
   def is_float(x: DType) -> bool: return x.scalar() in dtypes.floats or isinstance(x, ImageDType)
   @staticmethod # static methods on top, or bool in the type info will refer to dtypes.bool
-  @functools.cache
+  @lru_cache(maxsize=1024)
   def is_int(x: DType) -> bool: return x.scalar() in dtypes.ints
   @staticmethod
-  @functools.cache
+  @lru_cache(maxsize=1024)
   def is_unsigned(x: DType) -> bool: return x.scalar() in dtypes.uints
   @staticmethod
   def is_bool(x: DType) -> bool: return x.scalar() == dtypes.bool
@@ -99,12 +99,12 @@ class dtypes:
     # TODO: should truncate here
     return int(val) if dtypes.is_int(dtype) else float(val) if dtypes.is_float(dtype) else bool(val)
   @staticmethod
-  @functools.cache
+  @lru_cache(maxsize=1024)
   def min(dtype:DType):
     if dtypes.is_int(dtype): return 0 if dtypes.is_unsigned(dtype) else -2**(dtype.itemsize*8-1)
     return -float("inf") if dtypes.is_float(dtype) else False
   @staticmethod
-  @functools.cache
+  @lru_cache(maxsize=1024)
   def max(dtype:DType):
     if dtypes.is_int(dtype): return 2**(dtype.itemsize*8)-1+dtypes.min(dtype)
     return float("inf") if dtypes.is_float(dtype) else True
@@ -170,10 +170,10 @@ promo_lattice = { dtypes.bool: [dtypes.int8, dtypes.uint8], dtypes.int8: [dtypes
   dtypes.fp8e5m2: [dtypes.float16, dtypes.bfloat16], dtypes.fp8e4m3: [dtypes.float16, dtypes.bfloat16],
   dtypes.float16: [dtypes.float32], dtypes.bfloat16: [dtypes.float32], dtypes.float32: [dtypes.float64], }
 
-@functools.cache
+@lru_cache(maxsize=1024)
 def _get_recursive_parents(dtype:DType) -> set[DType]:
   return set.union(*[_get_recursive_parents(d) for d in promo_lattice[dtype]], {dtype}) if dtype != dtypes.float64 else {dtypes.float64}
-@functools.cache
+@lru_cache(maxsize=1024)
 def least_upper_dtype(*ds:DType) -> DType:
   return min(set.intersection(*[_get_recursive_parents(d) for d in ds])) if not (images:=[d for d in ds if isinstance(d, ImageDType)]) else images[0]
 def least_upper_float(dt:DType) -> DType: return dt if dtypes.is_float(dt) else least_upper_dtype(dt, dtypes.default_float)
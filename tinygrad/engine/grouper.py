@@ -144,6 +144,17 @@ def recursive_group(tr:UOp, st:ShapeTracker, r:UOp, children:defaultdict[UOp, di
     if len(st_childs:=dedup(unwrap(x.st) for x in tr_next.src if x.base == tr)) > 1: return group.setdefault(r)
     recursive_group(tr_next, st+st_childs[0], r, children, realizes, reduce_for_op, group, cache)
 
+def kernel_ends(srcs:list[UOp], children:defaultdict[UOp, dict[UOp, None]], realizes:dict[UOp, None]) -> set[UOp]:
+  # the reduces and realized uops closing the kernels srcs end up in
+  ret: set[UOp] = set()
+  stack, seen = list(srcs), set()
+  while stack:
+    if (u:=stack.pop()) in seen: continue
+    seen.add(u)
+    if u.op is Ops.REDUCE_AXIS or u in realizes: ret.add(u)
+    else: stack.extend(children.get(u, {}))
+  return ret
+
 def group_realizes(sink:UOp) -> dict[UOp, None]:
   # start by adding uops that always realize
   realizes: dict[UOp, None] = {}
@@ -161,6 +172,7 @@ def group_realizes(sink:UOp) -> dict[UOp, None]:
   # find all reduces, and pair them to a elementwise op. if they can't be cleanly paired, force realize the reduce (or a contig child)
   reduce_for_op: dict[UOp, UOp] = {}
   double_reduces: list[UOp] = []
+  arange_kernels: set[UOp] = set()
   for r in toposort:
     if r.op is not Ops.REDUCE_AXIS: continue
     if len(r.arg) == 3 and r.arg[2] is True: continue
@@ -201,10 +213,16 @@ def group_realizes(sink:UOp) -> dict[UOp, None]:
       group = {tr: None}
       realizes[tr] = None
     reduce_for_op.update((tr, r) for tr in group)
-    if FUSE_ARANGE and r.arg[0] is Ops.ADD and r.src[0].base.op is Ops.CONST and (getenv("FUSE_ARANGE_UINT", 1) or not dtypes.is_unsigned(r.dtype)):
+    if r.arg[0] is Ops.ADD and r.src[0].base.op is Ops.CONST and len(arange_children:=flatten(children[tr] for tr in group)) != 0:
       # maybe fuse arange with its children
       # TODO: FUSE_ARANGE_UINT is for not fusing rand. should not be here.
-      if len(flatten(children[tr] for tr in group)) != 0:
+      if FUSE_ARANGE and (getenv("FUSE_ARANGE_UINT", 1) or not dtypes.is_unsigned(r.dtype)):
+        for tr in group: del realizes[tr]
+      # an arange only compared against an index (one-hot in gather/Embedding/getitem) is always fused, the compare+reduce folds into an indexed load
+      # only one arange per kernel, the nested reduces can't have different shapes
+      elif all(c.op in {Ops.CMPNE, Ops.CMPLT} for c in arange_children) and \
+          not (ends:=kernel_ends(arange_children, children, realizes)) & arange_kernels:
+        arange_kernels.update(ends)
         for tr in group: del realizes[tr]
   # fuse double reduces with no other child
   for reduceop in double_reduces:
@@ -438,13 +456,14 @@ def get_becomes_map(big_sink:UOp) -> dict[UOp, UOp]:
                                  input_map=tensor_map, name="create_kernels")
 
   # if a kernel depends on a buffer, and that buffer is later assigned to, make the assign depend on the kernel's assign
-  kernel_assign: dict[UOp, UOp] = {}
+  # the reader can come before or after the assign in the toposort
+  toposort = tensor_map[big_sink].toposort()
+  kernel_assign: dict[UOp, UOp] = {u.buf_uop:u for u in toposort if u.op is Ops.ASSIGN}
   assign_rep: dict[UOp, UOp] = {}
-  for u in tensor_map[big_sink].toposort():
+  for u in toposort:
     if u.op is not Ops.ASSIGN: continue
-    kernel_assign[u.buf_uop] = u
     for s in u.src[1].src:
-      if s.op is not Ops.BUFFER or s is u.buf_uop or (a:=kernel_assign.get(s)) is None: continue
+      if s.op is not Ops.BUFFER or s is u.buf_uop or (a:=kernel_assign.get(s)) is None or a.src[1] is u.src[1]: continue
       if any(x.op is Ops.ASSIGN and x.buf_uop is s for x in u.toposort()):
         raise RuntimeError(f"cycle detected in graph, kernel for {u.buf_uop} must either depend on ASSIGN or BUFFER")
       assign_rep[a] = kernel_assign[s] = a.replace(src=a.src+(u,))
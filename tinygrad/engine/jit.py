@@ -1,15 +1,15 @@
 from typing import TypeVar, Generic, Callable, Union, cast, Optional, Any
-import functools, collections
+import functools, collections, pickle, mmap, struct, io, itertools
 from tinygrad.tensor import Tensor
-from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, BEAM, getenv, colored, JIT, dedup, partition, unwrap
-from tinygrad.device import Buffer, Compiled, Device
+from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, BEAM, getenv, colored, JIT, dedup, partition, unwrap, round_up, mv_address
+from tinygrad.device import Buffer, Compiled, Device, MallocAllocator
 from tinygrad.dtype import DType
 from tinygrad.ops import UOp, Variable, sym_infer, Ops
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.engine.realize import ExecItem, capturing, ViewOp, BufferCopy, BufferXfer, CompiledRunner, Runner, Estimates
 from tinygrad.engine.memory import _internal_memory_planner
 from tinygrad.nn.state import get_parameters
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from weakref import WeakKeyDictionary
 
 class GraphException(Exception): pass
@@ -139,6 +139,36 @@ def update_depends(depends:set[Buffer|None], jit_cache:list[ExecItem]):
   for ei in jit_cache:
     if any(b in depends for b in ei.bufs): depends.update(get_out_buffers_for_ei(ei))
 
+def get_preloaded_buffers(jit_cache:list[ExecItem]) -> set[Buffer]:
+  # the base buffers that are read before the jit writes them. these are the weights and state, everything else is scratch
+  written: dict[Buffer, list[tuple[int, int]]] = collections.defaultdict(list)
+  ret: set[Buffer] = set()
+  for ei in jit_cache:
+    if isinstance(ei.prg, ViewOp): continue
+    if isinstance(ei.prg, CompiledRunner): ins, outs = ei.prg.p.ins, [out for out in ei.prg.p.outs if out not in ei.prg.p.ins]
+    elif isinstance(ei.prg, (BufferCopy, BufferXfer)): ins, outs = [1], [0]
+    else: ins, outs = list(range(len(ei.bufs))), []
+    # the input buffers are None in the captured jit
+    for b in [b for i in ins if (b:=ei.bufs[i]) is not None]:
+      if not any(st <= b.offset and b.offset+b.nbytes <= en for st,en in written[b.base]): ret.add(b.base)
+    for b in [b for i in outs if (b:=ei.bufs[i]) is not None]: written[b.base].append((b.offset, b.offset+b.nbytes))
+  return ret
+
+class _ArtifactPickler(pickle.Pickler):
+  def __init__(self, file, bufs:dict[Buffer, int]):
+    super().__init__(file)
+    self.bufs = bufs
+  def persistent_id(self, obj): return self.bufs.get(obj) if isinstance(obj, Buffer) else None
+
+class _ArtifactUnpickler(pickle.Unpickler):
+  def __init__(self, file, bufs:list[Buffer]):
+    super().__init__(file)
+    self.bufs = bufs
+  def persistent_load(self, pid): return self.bufs[pid]
+
+# a saved jit is the magic, the length of the metadata pickle, the metadata pickle and then page aligned buffer sections that can be mmapped
+JIT_ARTIFACT_MAGIC, JIT_ARTIFACT_VERSION = b"TINYJIT\0", 1
+
 ReturnType = TypeVar('ReturnType')
 @dataclass
 class CapturedJit(Generic[ReturnType]):
@@ -158,6 +188,7 @@ class CapturedJit(Generic[ReturnType]):
     self._jit_cache: list[ExecItem] = self.jit_cache
     self._input_replace: dict[tuple[int, int], int] = self.input_replace
     self._first_run = True
+    self._mmap: Optional[mmap.mmap] = None  # keeps the weights of a loaded jit mapped
     self._clear_inputs()
 
   def _clear_inputs(self):
@@ -180,6 +211,48 @@ class CapturedJit(Generic[ReturnType]):
       if old.is_allocated(): new.ensure_allocated().copyin(old.as_buffer())
     self.__post_init__()
 
+  def save(self, fn:str):
+    bufs = dedup(b.base for ei in self.jit_cache for b in ei.bufs if b is not None)
+    preloaded, offsets, sz = get_preloaded_buffers(self.jit_cache), [], 0
+    for b in bufs:
+      offsets.append(sz if b in preloaded else None)
+      if b in preloaded: sz += round_up(b.nbytes, 0x1000)
+    with io.BytesIO() as jit_pk:
+      _ArtifactPickler(jit_pk, {b:i for i,b in enumerate(bufs)}).dump(self)
+      meta = pickle.dumps({"version": JIT_ARTIFACT_VERSION, "jit": jit_pk.getvalue(),
+                           "bufs": [(b.device, b.size, b.dtype, replace(b.options, external_ptr=None) if b.options is not None else None, off)
+                                    for b,off in zip(bufs, offsets)]})
+    data_st = round_up(len(JIT_ARTIFACT_MAGIC)+8+len(meta), 0x1000)
+    with open(fn, "wb") as f:
+      f.write(JIT_ARTIFACT_MAGIC + struct.pack("<Q", len(meta)) + meta)
+      for b,off in zip(bufs, offsets):
+        if off is None: continue
+        f.seek(data_st+off)
+        f.write(b.as_buffer())
+      f.truncate(data_st+sz)
+
+  @staticmethod
+  def load(fn:str) -> "CapturedJit":
+    with open(fn, "rb") as f: mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if mm[:len(JIT_ARTIFACT_MAGIC)] != JIT_ARTIFACT_MAGIC: raise RuntimeError(f"{fn} is not a saved TinyJit")
+    hdr = len(JIT_ARTIFACT_MAGIC)+8
+    meta_len = struct.unpack("<Q", mm[len(JIT_ARTIFACT_MAGIC):hdr])[0]
+    meta = pickle.loads(mm[hdr:hdr+meta_len])
+    if meta["version"] != JIT_ARTIFACT_VERSION: raise RuntimeError(f"{fn} has version {meta['version']}, expected {JIT_ARTIFACT_VERSION}")
+    data_st, bufs = round_up(hdr+meta_len, 0x1000), []
+    for device, size, dtype, options, off in meta["bufs"]:
+      bufs.append(buf:=Buffer(device, size, dtype, options=options))
+      if off is None: continue
+      # the weights are the mmapped file on host devices, the mapping is private so the jit can still write to them
+      if Device[device].allocator is MallocAllocator: buf.allocate(external_ptr=mv_address(memoryview(mm)[data_st+off:data_st+off+buf.nbytes]))
+      else: buf.allocate().copyin(memoryview(mm)[data_st+off:data_st+off+buf.nbytes])
+    ret: CapturedJit = _ArtifactUnpickler(io.BytesIO(meta["jit"]), bufs).load()
+    ret._mmap = mm
+    # new buffers in this process must not alias the loaded ones
+    if len(uniques:=[u.arg for t in get_parameters(ret.ret) for u in t.lazydata.toposort() if u.op is Ops.UNIQUE]):
+      UOp.unique_num = itertools.count(max(next(UOp.unique_num), max(uniques)+1))
+    return ret
+
   # jit exec
   def __call__(self, input_buffers:list[Buffer], var_vals:dict[Variable, int]) -> ReturnType:
     # assign inputs
@@ -218,13 +291,23 @@ def _prepare_jit_inputs(args, kwargs):
   return input_buffers, var_vals, names, st_vars_dtype_device
 
 class TinyJit(Generic[ReturnType]):
-  def __init__(self, fxn:Optional[Callable[..., ReturnType]], captured:Optional[CapturedJit]=None, prune=False, optimize=False):
+  def __init__(self, fxn:Optional[Callable[..., ReturnType]], captured:Optional[CapturedJit]=None, prune=False, optimize=False,
+               max_captures:int=1, buckets:Optional[dict[int, tuple[int, ...]]]=None):
+    """
+    `max_captures` is how many input signatures (names, shapes, dtypes and devices) get their own capture, the least recently used is dropped.
+    With `buckets` (axis -> sizes), each input tensor is zero padded along that axis up to the smallest size that fits, so the function
+    sees (and returns) padded shapes but a few captures serve all the sizes in between.
+    """
     assert fxn or captured, "need either a function or a CapturedJit"
     self.fxn = fxn
     self.captured: Optional[CapturedJit] = captured
     self.cnt: int = 2 if self.fxn is None else 0
     self.prune = prune
     self.optimize = optimize
+    self.max_captures, self.buckets = max_captures, buckets
+    # the (captured, cnt) of the signatures that aren't the current one, in LRU order
+    self.captures: collections.OrderedDict[tuple, tuple[Optional[CapturedJit], int]] = collections.OrderedDict()
+    self._signature: Optional[tuple] = None
 
   def add_buffer(self, b:Buffer) -> Buffer:
     if found:=self._buffer_replace.get(b, None): return found
@@ -242,11 +325,38 @@ class TinyJit(Generic[ReturnType]):
     assert self.fxn is not None, "can't reset without function"
     self.cnt = 0
     self.captured = None
+    self.captures.clear()
+    self._signature = None
+
+  def _bucket(self, x:Any) -> Any:
+    if self.buckets is None or x.__class__ is not Tensor: return x
+    pads: list[Optional[tuple[int, int]]] = []
+    for i,s in enumerate(x.shape):
+      sizes = self.buckets.get(i, self.buckets.get(i-x.ndim, ()))
+      pads.append((0, b-s) if isinstance(s, int) and (b:=min((b for b in sizes if b >= s), default=s)) != s else None)
+    return x.pad(pads).contiguous() if any(p is not None for p in pads) else x
+
+  def _select(self, signature:tuple):
+    if signature == self._signature: return
+    if self._signature is not None: self.captures[self._signature] = (self.captured, self.cnt)
+    self.captured, self.cnt = self.captures.pop(signature, (None, 0))
+    self._signature = signature
+    while len(self.captures) >= self.max_captures: self.captures.popitem(last=False)
 
   def __reduce__(self):
     assert self.captured is not None, "can't pickle an uncaptured JIT"
     return self.__class__, (None, self.captured)
 
+  def save(self, fn:str):
+    """Saves the captured JIT to `fn`, with the compiled programs and the weights it reads, but without the scratch buffers."""
+    assert self.captured is not None, "can't save an uncaptured JIT"
+    self.captured.save(fn)
+
+  @staticmethod
+  def load(fn:str) -> "TinyJit":
+    """Loads a JIT saved with `save`. Nothing is compiled, and the weights are mmapped from `fn` on host devices."""
+    return TinyJit(None, CapturedJit.load(fn))
+
   # keep legacy code working
   @property
   def jit_cache(self) -> list[ExecItem]: return self.captured._jit_cache if self.captured is not None else []
@@ -256,7 +366,9 @@ class TinyJit(Generic[ReturnType]):
   def __get__(self, obj, objtype): return functools.partial(self.__call__, obj) # add support for instance methods
 
   def __call__(self, *args, **kwargs) -> ReturnType:
+    if self.buckets is not None: args, kwargs = tuple(self._bucket(x) for x in args), {k:self._bucket(v) for k,v in kwargs.items()}
     input_buffers, var_vals, names, st_vars_dtype_device = _prepare_jit_inputs(args, kwargs)
+    if self.max_captures > 1 and self.fxn is not None: self._select((tuple(names), tuple(st_vars_dtype_device)))
     if not JIT or self.cnt == 0:
       # jit ignore
       assert self.fxn is not None
@@ -1,9 +1,11 @@
 from typing import Optional, cast, Generator
-import time, pprint
+import time, pprint, hashlib, os, threading, concurrent.futures
+from collections import deque
 from dataclasses import dataclass, replace
 from tinygrad.helpers import all_same, colored, getenv, DEBUG, GlobalCounters, ansilen, BEAM, NOOPT, all_int, CAPTURING, Metadata, TRACEMETA
-from tinygrad.helpers import DEVECTORIZE, time_to_str, VALIDATE_WITH_CPU
-from tinygrad.ops import Ops, PatternMatcher, UOp, UPat, Variable, sym_infer
+from tinygrad.helpers import DEVECTORIZE, time_to_str, VALIDATE_WITH_CPU, CACHELEVEL, IGNORE_BEAM_CACHE, LOWER_AHEAD, diskcache_get, diskcache_put
+from tinygrad.helpers import PROFILE, ansistrip, THREADS
+from tinygrad.ops import Ops, PatternMatcher, UOp, UPat, Variable, sym_infer, UOpMetaClass
 from tinygrad.device import Device, Buffer
 from tinygrad.renderer import Renderer, ProgramSpec, Estimates
 from tinygrad.codegen.kernel import Kernel
@@ -99,18 +101,30 @@ class BufferXfer(BufferCopy):
 
 # **************** method cache ****************
 
-method_cache: dict[tuple[str, bytes, tuple[int, ...], bool], CompiledRunner] = {}
+def renderer_key(renderer:Renderer) -> str:
+  # everything about the renderer that changes the rendered program, the class attributes are set from env vars at import (THREADS at render)
+  return hashlib.sha256(str((type(renderer).__module__, type(renderer).__qualname__, renderer.__reduce__()[1], renderer.device, renderer.suffix,
+                             renderer.has_local, renderer.has_threads, renderer.global_max, renderer.tensor_cores)).encode()).hexdigest()
+
+# UOps are interned, so in this process the ast itself is the key. the sha256 ast.key is only computed for the disk cache
+method_cache: dict[tuple[str, UOp, tuple[int, ...], bool], CompiledRunner] = {}
 def get_runner(device:str, ast:UOp) -> CompiledRunner:
   # TODO: this should be all context relevant to rendering
-  context = (BEAM.value, NOOPT.value, DEVECTORIZE.value)
-  ckey = (device, ast.key, context, False)
+  context = (BEAM.value, NOOPT.value, DEVECTORIZE.value, THREADS.value)
+  ckey = (device, ast, context, False)
   if cret:=method_cache.get(ckey): return cret
-  bkey = (device.split(":")[0], ast.key, context, True)
+  bkey = (device.split(":")[0], ast, context, True)
   if bret:=method_cache.get(bkey):
     method_cache[ckey] = ret = CompiledRunner(replace(bret.p, device=device), bret.lib)
   else:
-    prg: ProgramSpec = get_kernel(Device[device].renderer, ast).to_program()
-    method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(prg, device=device))
+    # with CACHELEVEL>=3, the rendered program and the lib are also cached on disk, so a new process skips the search/linearize/render
+    dkey = {"device": bkey[0], "ast": ast.key, "context": str(context), "renderer": renderer_key(Device[device].renderer)}
+    if CACHELEVEL >= 3 and (val:=diskcache_get("method_cache", dkey)) is not None:
+      method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(val[0], device=device, ast=ast), val[1])
+    else:
+      prg: ProgramSpec = get_kernel(Device[device].renderer, ast).to_program()
+      method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(prg, device=device))
+      if CACHELEVEL >= 3: diskcache_put("method_cache", dkey, (replace(prg, device=bkey[0]), ret.lib))
   return ret
 
 # **************** lowering functions ****************
@@ -122,7 +136,9 @@ class ExecItem:
   metadata: Optional[tuple[Metadata, ...]] = None
   def run(self, _var_vals:Optional[dict[Variable, int]]=None, wait=False, jit=False, do_update_stats=True) -> Optional[float]:
     var_vals = {} if _var_vals is None else _var_vals
+    if PROFILE: Buffer.profile_owner = (ansistrip(self.prg.display_name).strip(), self.metadata)
     bufs = [cast(Buffer, x) for x in self.bufs] if jit else [cast(Buffer, x).ensure_allocated() for x in self.bufs]
+    if PROFILE: Buffer.profile_owner = ("", None)
     et = self.prg(bufs, var_vals, wait=wait or DEBUG >= 2)
     if do_update_stats:
       GlobalCounters.kernel_count += 1
@@ -149,16 +165,40 @@ si_lowerer = PatternMatcher([
 ])
 def lower_schedule_item(si:ScheduleItem) -> ExecItem: return ExecItem(*cast(tuple[Runner,list], si_lowerer.rewrite(si.ast, si.bufs)), si.metadata)
 
+def beam_search_schedule(schedule:list[ScheduleItem]):
+  # search all the new kernels of the schedule together, get_kernel then finds them in the beam cache
+  from tinygrad.engine.search import beam_search_many, bufs_from_lin
+  context, kernels = (BEAM.value, NOOPT.value, DEVECTORIZE.value, THREADS.value), {}
+  for si in schedule:
+    if si.ast.op is not Ops.SINK or (si.bufs[0].device.split(":")[0], si.ast, context, True) in method_cache: continue
+    kernels[(si.bufs[0].device, si.ast)] = Kernel(si.ast, opts=Device[si.bufs[0].device].renderer)
+  if len(kernels) > 1:
+    beam_search_many([(k, bufs_from_lin(k, allocate=False)) for k in kernels.values()], BEAM.value, bool(getenv("BEAM_ESTIMATE", 1)))
+
 def lower_schedule(schedule:list[ScheduleItem]) -> Generator[tuple[ScheduleItem, ExecItem], None, None]:
-  while len(schedule):
-    si = schedule.pop(0)
-    try: yield (si, lower_schedule_item(si))
-    except Exception as e:
-      if DEBUG >= 2:
-        print(f"error lowering {si.ast.op}")
-        print("tensor operations:")
-        pprint.pprint(si.metadata, indent=2)
-      raise e
+  if BEAM >= 1 and not NOOPT and CACHELEVEL >= 1 and not IGNORE_BEAM_CACHE: beam_search_schedule(schedule)
+  # with LOWER_AHEAD, the next items are lowered (and compiled) on threads while the caller runs this one. BEAM times kernels, so it's serial
+  pool = concurrent.futures.ThreadPoolExecutor(min(LOWER_AHEAD.value, os.cpu_count() or 1), "tinygrad_lower") \
+    if LOWER_AHEAD > 0 and BEAM < 1 and len(schedule) > 1 else None
+  lowering: deque[tuple[ScheduleItem, concurrent.futures.Future[ExecItem]]] = deque()
+  prev_lock = UOpMetaClass.lock
+  if pool is not None: UOpMetaClass.lock = prev_lock or threading.Lock()
+  try:
+    while len(schedule) or len(lowering):
+      while pool is not None and len(schedule) and len(lowering) < LOWER_AHEAD.value:
+        lowering.append((si:=schedule.pop(0), pool.submit(lower_schedule_item, si)))
+      si, fut = lowering.popleft() if len(lowering) else (si:=schedule.pop(0), None)
+      try: yield (si, lower_schedule_item(si) if fut is None else fut.result())
+      except Exception as e:
+        if DEBUG >= 2:
+          print(f"error lowering {si.ast.op}")
+          print("tensor operations:")
+          pprint.pprint(si.metadata, indent=2)
+        raise e
+  finally:
+    if pool is not None:
+      pool.shutdown(cancel_futures=True)
+      UOpMetaClass.lock = prev_lock
 
 # **************** main run function ****************
 
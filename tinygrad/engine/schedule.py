@@ -1,8 +1,9 @@
 from dataclasses import dataclass
 from collections import deque, defaultdict
-from tinygrad.ops import UOp, Variable, Ops, UPat, PatternMatcher, graph_rewrite, buffers
+from tinygrad.ops import UOp, Variable, Ops, UPat, PatternMatcher, graph_rewrite, buffers, all_metadata
 from tinygrad.device import Buffer
-from tinygrad.helpers import Metadata, DEBUG, unwrap
+from tinygrad.dtype import DType
+from tinygrad.helpers import Metadata, DEBUG, unwrap, getenv, ContextVar, SCHEDULE_CACHE, CAPTURE_PROCESS_REPLAY
 
 # **** ScheduleItem return type
 
@@ -41,12 +42,13 @@ def create_schedule_with_vars(sched_sink:UOp) -> tuple[list[ScheduleItem], dict[
     if u.op is not Ops.ASSIGN: continue
     k = u.src[1]
     in_degree.setdefault(k, 0)
-    for s in k.src:
+    # the ASSIGN's extra srcs are the kernels that read the buffer before it's assigned
+    for s in k.src+u.src[2:]:
       if s.op is not Ops.ASSIGN: continue
       children[s.src[1]].append(k)
       in_degree[k] += 1
 
-  # linearize KERNEL UOps into ScheduleItems in BFS order
+  # linearize KERNEL UOps into ScheduleItems, kernels that become ready run next so intermediate buffers are freed early
   queue = deque(k for k,v in in_degree.items() if v == 0)
   schedule: list[ScheduleItem] = []
   var_vals: dict[Variable, int] = {}
@@ -59,7 +61,7 @@ def create_schedule_with_vars(sched_sink:UOp) -> tuple[list[ScheduleItem], dict[
     schedule.append(ScheduleItem(ast, tuple(s.buf_uop.buffer for s in k.src), k.arg.metadata))
     for x in children[k]:
       in_degree[x] -= 1
-      if in_degree[x] == 0: queue.append(x)
+      if in_degree[x] == 0: queue.appendleft(x)
 
   # confirm everything was scheduled correctly
   assert len(schedule) == len(in_degree), f"Schedule length mistmatch {len(schedule)} != {len(in_degree)}"
@@ -70,3 +72,57 @@ def create_schedule_with_vars(sched_sink:UOp) -> tuple[list[ScheduleItem], dict[
   assert all(u.op in {Ops.BUFFER, Ops.BUFFER_VIEW} for u in becomes_map.values()), f"Schedule didn't end with BUFFER {becomes_map.values()}"
 
   return schedule, var_vals, becomes_map
+
+# **** schedule cache
+
+# a tensor graph is scheduled the same way as any other graph with the same structure, only the BUFFERs differ.
+# the key of a graph is its toposort with the UNIQUE args left out, so the nth BUFFER of a hit takes the place of the nth BUFFER of the miss
+
+@dataclass(frozen=True)
+class ScheduleCacheKey:
+  key: tuple
+  nodes: list[UOp]
+  inputs: list[UOp]
+
+def schedule_cache_key(big_sink:UOp) -> ScheduleCacheKey|None:
+  if not SCHEDULE_CACHE or CAPTURE_PROCESS_REPLAY or getenv("VIZ"): return None
+  nodes, idx, key = list(big_sink.toposort()), {}, []
+  for i,u in enumerate(nodes):
+    # MULTI is rewritten before kernelize
+    if u.op is Ops.MULTI: return None
+    idx[u] = i
+    # metadata is part of the key, the cached ScheduleItems carry it
+    key.append((u.op,) if u.op is Ops.UNIQUE else (u.op, u.dtype, u.arg, tuple(idx[s] for s in u.src), all_metadata.get(u)))
+  return ScheduleCacheKey((tuple(key), tuple(v.value for v in ContextVar._cache.values())), nodes, [u for u in nodes if u.op is Ops.BUFFER])
+
+@dataclass(frozen=True)
+class CachedSchedule:
+  becomes: tuple[int, ...]                      # index of the nodes the tensors are rewritten from
+  template: UOp                                 # SINK of what they are rewritten to, the BUFFERs are replaced with NOOP placeholders
+  outs: tuple[tuple[str, int, DType], ...]      # the BUFFERs created by the scheduler, placeholder len(inputs)+i
+  items: tuple[tuple[UOp, tuple[int, ...], tuple[Metadata, ...]], ...]
+  var_vals: dict[Variable, int]
+
+  def rebind(self, ck:ScheduleCacheKey) -> tuple[list[ScheduleItem], dict[Variable, int], dict[UOp, UOp]]:
+    bufs = ck.inputs + [UOp.new_buffer(*o) for o in self.outs]
+    new_sink = self.template.substitute({UOp(Ops.NOOP, arg=i):b for i,b in enumerate(bufs)})
+    schedule = [ScheduleItem(ast, tuple(bufs[i].buffer for i in refs), metadata) for ast,refs,metadata in self.items]
+    return schedule, self.var_vals, {ck.nodes[i]:v for i,v in zip(self.becomes, new_sink.src)}
+
+schedule_cache: dict[tuple, CachedSchedule] = {}
+def cache_schedule(ck:ScheduleCacheKey, kernelize_map:dict[UOp, UOp], becomes_map:dict[UOp, UOp], schedule:list[ScheduleItem],
+                   var_vals:dict[Variable, int]):
+  idx = {u:i for i,u in enumerate(ck.nodes)}
+  # what the nodes of the graph become after kernelize and schedule. like in _apply_map_to_tensors, the kernelize map is applied as a substitute
+  # because it also maps the intermediate nodes of its rewrites
+  becomes = [k for k in kernelize_map if k in idx]
+  final = UOp(Ops.SINK, src=tuple(becomes)).substitute(kernelize_map).substitute(becomes_map)
+  outs = [u for u in final.toposort() if u.op is Ops.BUFFER and u not in idx]
+  bufs = ck.inputs+outs
+  buf_idx = {b:i for i,u in enumerate(bufs) if (b:=buffers.get(u)) is not None}
+  # BUFFER_VIEW outputs are views of other buffers
+  if any(b not in buf_idx for si in schedule for b in si.bufs) or any(buffers[u]._base is not None for u in outs if u in buffers): return
+  template = final.substitute({u:UOp(Ops.NOOP, arg=i) for i,u in enumerate(bufs)})
+  if len(schedule_cache) >= getenv("SCHEDULE_CACHE_SIZE", 1024): schedule_cache.pop(next(iter(schedule_cache)))
+  schedule_cache[ck.key] = CachedSchedule(tuple(idx[k] for k in becomes), template, tuple((u.device, u.size, u.dtype) for u in outs),
+                                          tuple((si.ast, tuple(buf_idx[b] for b in si.bufs), si.metadata) for si in schedule), var_vals)
@@ -1,10 +1,11 @@
-from typing import cast, Optional, Callable
-import itertools, functools, random, math, time, multiprocessing, traceback, signal, atexit
+from typing import cast, Optional, Callable, Iterable
+import itertools, functools, random, math, time, multiprocessing, traceback, signal, atexit, hashlib, pickle
 from collections import defaultdict
 from dataclasses import replace
 from tinygrad.ops import UOp, Ops, Variable, sym_infer
 from tinygrad.device import Device, Buffer, Compiler
-from tinygrad.helpers import prod, flatten, DEBUG, CACHELEVEL, diskcache_get, diskcache_put, getenv, Context, colored, time_to_str
+from tinygrad.helpers import prod, DEBUG, CACHELEVEL, diskcache_get, diskcache_put, diskcache_claim, diskcache_release, getenv, Context, colored
+from tinygrad.helpers import time_to_str, all_same, dedup
 from tinygrad.helpers import IGNORE_BEAM_CACHE, TC_SEARCH_OVER_SHAPE
 from tinygrad.dtype import ImageDType, PtrDType
 from tinygrad.codegen.kernel import Kernel, Opt, OptOps, KernelOptError
@@ -130,66 +131,184 @@ def get_kernel_actions(lin:Kernel, include_0=True) -> dict[int, Kernel]:
     except KernelOptError: pass
   return acted_lins
 
+# *** cost model ***
+
+class CostModel:
+  """
+  Online ridge regression of log runtime on log features of the compiled candidate (the Estimates, launch sizes, upcast and uop count).
+  It is fit from every candidate beam times and kept per device in the beam cache db.
+  """
+  def __init__(self, n:int=9, reg:float=1e-3):
+    self.xtx, self.xty, self.cnt = [[reg if i == j else 0.0 for j in range(n)] for i in range(n)], [0.0]*n, 0
+    self.w: Optional[list[float]] = None
+
+  @staticmethod
+  def features(p:ProgramSpec, lin:Kernel, var_vals:dict[Variable, int]) -> list[float]:
+    est = [sym_infer(x, var_vals) for x in (p.estimates.ops, p.estimates.lds, p.estimates.mem)]
+    lsz = [sym_infer(x, var_vals) for x in p.local_size] if p.local_size is not None else [1]
+    gsz = [sym_infer(x, var_vals) for x in p.global_size] if p.global_size is not None else [1]
+    return [1.0] + [math.log2(1+x) for x in est + [prod(gsz), prod(lsz), prod(lin.full_shape[lin.first_upcast:]), len(lin.applied_opts),
+                                                  len(cast(list, p.uops))]]
+
+  def update(self, x:list[float], tm:float):
+    if not 0 < tm < math.inf: return
+    y = math.log2(tm)
+    for i,xi in enumerate(x):
+      self.xty[i] += xi*y
+      for j,xj in enumerate(x): self.xtx[i][j] += xi*xj
+    self.cnt, self.w = self.cnt + 1, None
+
+  def predict(self, x:list[float]) -> float:
+    if self.w is None:
+      # solve xtx @ w = xty with gaussian elimination, xtx is positive definite from the regularization
+      n, a = len(self.xty), [row[:] + [b] for row,b in zip(self.xtx, self.xty)]
+      for c in range(n):
+        piv = max(range(c, n), key=lambda r: abs(a[r][c]))
+        a[c], a[piv] = a[piv], a[c]
+        for r in range(n):
+          if r != c and a[c][c] != 0: a[r] = [vr - a[r][c]/a[c][c]*vc for vr,vc in zip(a[r], a[c])]
+      self.w = [a[i][n]/a[i][i] if a[i][i] != 0 else 0.0 for i in range(n)]
+    return sum(wi*xi for wi,xi in zip(self.w, x))
+
+  @staticmethod
+  def load(device:str) -> "CostModel":
+    return ret if CACHELEVEL >= 1 and (ret:=diskcache_get("beam_cost_model", device)) is not None else CostModel()
+  def save(self, device:str): diskcache_put("beam_cost_model", device, self)
+
 beam_pool, BEAM_DEBUG = None, getenv("BEAM_DEBUG")
-def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True, disable_cache=IGNORE_BEAM_CACHE.value) -> Kernel:
-  global beam_pool
-  key = {"ast": lin.ast.key, "amt": amt, "allow_test_size": allow_test_size, "device": lin.opts.device, "suffix": lin.opts.suffix}
-  if not disable_cache and CACHELEVEL >= 1 and (val:=diskcache_get("beam_search", key)) is not None:
-    ret = lin.copy()
-    for o in val[len(lin.applied_opts):]: ret.apply_opt(o)
-    return ret
+def _cost_prune(compiled:Iterable[tuple[int, Optional[tuple[ProgramSpec, bytes, float]]]], acted_lins:list[tuple[int, Kernel]],
+                cost_model:CostModel, var_vals:list[dict[Variable, int]], k:int) -> list[tuple[int, Optional[tuple[ProgramSpec, bytes, float]]]]:
+  ranked: defaultdict[int, list[tuple[float, int, tuple[ProgramSpec, bytes, float]]]] = defaultdict(list)
+  for i,proc in compiled:
+    if proc is None: continue
+    j = acted_lins[i][0]
+    ranked[j].append((cost_model.predict(CostModel.features(proc[0], acted_lins[i][1], var_vals[j])), i, proc))
+  return [(i, proc) for r in ranked.values() for _,i,proc in sorted(r, key=lambda x: x[0])[:k]]
 
-  beam: list[tuple[Kernel, float]] = [(lin, float("inf"))]
-  seen_libs = set()
+def _search_lockstep(lins:list[tuple[Kernel, list[Buffer]]], amt:int, allow_test_size:bool) -> list[Kernel]:
+  # all the kernels advance one beam step per round, and the candidates of every kernel share the compile pool.
+  # the parent times the candidates while the pool is still compiling the rest
+  global beam_pool
+  assert all_same([lin.opts.device for lin,_ in lins]), "lockstep search is for one device"
+  beams: list[list[tuple[Kernel, float]]] = [[(lin, float("inf"))] for lin,_ in lins]
+  seen_libs: set[bytes] = set()
 
-  default_parallel = multiprocessing.cpu_count() if lin.opts.device in {"CUDA", "AMD", "NV", "METAL", "HIP"} else 0
+  default_parallel = multiprocessing.cpu_count() if lins[0][0].opts.device in {"CUDA", "AMD", "NV", "METAL", "HIP"} else 0
   if beam_pool is None and (workers := getenv("PARALLEL", default_parallel)):
     beam_pool = multiprocessing.get_context("spawn").Pool(workers, _init_worker, (), getenv("BEAM_MAX_TASKS_PER_CHILD", 16))
     @atexit.register
     def close_pool(): beam_pool.close()
 
   min_progress = getenv("BEAM_MIN_PROGRESS", 0.01)/1e6
-  if BEAM_DEBUG: print(f"BEAM_SEARCH:\n{lin.ast}")
-  if DEBUG >= 2: print(f"   0.00s:                from   1 ->   1 actions {lin.colored_shape()}")
+  # with BEAM_COST_TOPK, the cost model ranks the compiled candidates of a kernel and only the top k are timed
+  cost_model, cost_topk = CostModel.load(device:=lins[0][0].opts.device), getenv("BEAM_COST_TOPK", 0)
+  for lin,_ in lins:
+    if BEAM_DEBUG: print(f"BEAM_SEARCH:\n{lin.ast}")
+    if DEBUG >= 2: print(f"   0.00s:                from   1 ->   1 actions {lin.colored_shape()}")
 
   try:
-    rawbufs = _ensure_buffer_alloc(rawbufs)
-    var_vals: dict[Variable, int] = {k:int(k.vmax+k.vmin)//2 for k in lin.ast.variables()}
-    exiting, st = False, time.perf_counter()
-    dev = Device[lin.opts.device]
-    while not exiting:
-      acted_lins: list[Kernel] = flatten([get_kernel_actions(lin, include_0=False).values() for lin,_ in beam])
-      timed_lins: list[tuple[Kernel, float]] = []
+    rawbufs = [_ensure_buffer_alloc(bufs) for _,bufs in lins]
+    var_vals: list[dict[Variable, int]] = [{k:int(k.vmax+k.vmin)//2 for k in lin.ast.variables()} for lin,_ in lins]
+    active, st = list(range(len(lins))), time.perf_counter()
+    dev = Device[lins[0][0].opts.device]
+    while len(active):
+      acted_lins: list[tuple[int, Kernel]] = [(j,x) for j in active for lin,_ in beams[j] for x in get_kernel_actions(lin, include_0=False).values()]
+      timed_lins: dict[int, list[tuple[Kernel, float]]] = {j:[] for j in active}
       _compile_fn = functools.partial(_try_compile_linearized_w_idx, compiler=dev.compiler)
-      least_compute_ops = math.inf
-      for i,proc in (map(_compile_fn, enumerate(acted_lins)) if beam_pool is None else beam_pool.imap_unordered(_compile_fn, enumerate(acted_lins))):
+      least_compute_ops: dict[int, float] = {j:math.inf for j in active}
+      candidates = enumerate(x for _,x in acted_lins)
+      compiled: Iterable[tuple[int, Optional[tuple[ProgramSpec, bytes, float]]]] = \
+        map(_compile_fn, candidates) if beam_pool is None else beam_pool.imap_unordered(_compile_fn, candidates)
+      if cost_topk and cost_model.cnt >= getenv("BEAM_COST_MIN_SAMPLES", 64):
+        compiled = _cost_prune(compiled, acted_lins, cost_model, var_vals, max(cost_topk, amt))
+      for i,proc in compiled:
         if proc is None: continue
         p, lib, compile_et = proc
         if lib in seen_libs: continue
+        j = acted_lins[i][0]
         # filter out kernels that use 1000x more compute than the smallest
-        least_compute_ops = min(this_compute_ops:=sym_infer(p.estimates.ops, var_vals), least_compute_ops)
-        if least_compute_ops*1000 < this_compute_ops: continue
+        least_compute_ops[j] = min(this_compute_ops:=sym_infer(p.estimates.ops, var_vals[j]), least_compute_ops[j])
+        if least_compute_ops[j]*1000 < this_compute_ops: continue
         seen_libs.add(lib)
-        try: tms = _time_program(p, lib, var_vals, rawbufs, early_stop=beam[0][1]*3 if len(beam) else 1.0,
+        try: tms = _time_program(p, lib, var_vals[j], rawbufs[j], early_stop=beams[j][0][1]*3 if len(beams[j]) else 1.0,
                                  allow_test_size=allow_test_size, clear_l2=hasattr(dev, 'invalidate_caches'))
         except RuntimeError: continue # for runtime issues
-        timed_lins.append((acted_lins[i], min(tms)))
-        if BEAM_DEBUG > 1: print(f"{time.perf_counter() - st:7.2f}s: {i:5d} {len(cast(list, p.uops)):5d} uops {time_to_str(compile_et, w=12)} compile/{time_to_str(timed_lins[-1][1], w=12)} run       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}")  # noqa: E501
-        elif DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s: {time_to_str(timed_lins[-1][1], w=12)}       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}\033[K", end="")  # noqa: E501
+        # only complete timings train the cost model, early stopped ones are a lower bound
+        if len(tms) == 3: cost_model.update(CostModel.features(p, acted_lins[i][1], var_vals[j]), min(tms))
+        timed_lins[j].append((acted_lins[i][1], min(tms)))
+        if BEAM_DEBUG > 1: print(f"{time.perf_counter() - st:7.2f}s: {i:5d} {len(cast(list, p.uops)):5d} uops {time_to_str(compile_et, w=12)} compile/{time_to_str(timed_lins[j][-1][1], w=12)} run       {len(timed_lins[j]):4d}/{len(acted_lins):4d}         {timed_lins[j][-1][0].colored_shape()}")  # noqa: E501
+        elif DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s: {time_to_str(timed_lins[j][-1][1], w=12)}       {len(timed_lins[j]):4d}/{len(acted_lins):4d}         {timed_lins[j][-1][0].colored_shape()}\033[K", end="")  # noqa: E501
 
       # done
-      opts = sorted(timed_lins, key=lambda x: x[1])
-      exiting = len(opts) == 0 or (opts[0][1] < min_progress) or (len(beam) > 0 and ((beam[0][1]-opts[0][1]) < min_progress))
-      if not exiting: beam = opts[:amt]
-      elif len(opts) > 0 and opts[0][1] < beam[0][1]: beam = opts[:1]
-      if DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s:", colored(time_to_str(beam[0][1], w=12), "green" if exiting else None), f"from {len(acted_lins):3d} -> {len(opts):3d} actions\033[K", beam[0][0].colored_shape())  # noqa: E501
+      for j in active[:]:
+        opts = sorted(timed_lins[j], key=lambda x: x[1])
+        exiting = len(opts) == 0 or (opts[0][1] < min_progress) or (len(beams[j]) > 0 and ((beams[j][0][1]-opts[0][1]) < min_progress))
+        if not exiting: beams[j] = opts[:amt]
+        else:
+          if len(opts) > 0 and opts[0][1] < beams[j][0][1]: beams[j] = opts[:1]
+          active.remove(j)
+        if DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s:", colored(time_to_str(beams[j][0][1], w=12), "green" if exiting else None), f"from {len(acted_lins):3d} -> {len(opts):3d} actions\033[K", beams[j][0][0].colored_shape())  # noqa: E501
   except KeyboardInterrupt as e:
     if beam_pool is not None: beam_pool.terminate()
     raise e
 
-  if CACHELEVEL >= 1: diskcache_put("beam_search", key, beam[0][0].applied_opts)
-  if BEAM_DEBUG: print(f"BEAM_SEARCH: final tm={time_to_str(beam[0][1], w=0)}, applied_opts={beam[0][0].applied_opts}")
-  return beam[0][0]
+  if CACHELEVEL >= 1: cost_model.save(device)
+  for beam in beams:
+    if BEAM_DEBUG: print(f"BEAM_SEARCH: final tm={time_to_str(beam[0][1], w=0)}, applied_opts={beam[0][0].applied_opts}")
+  return [beam[0][0] for beam in beams]
+
+def beam_search_many(lins:list[tuple[Kernel, list[Buffer]]], amt:int, allow_test_size=True, disable_cache=IGNORE_BEAM_CACHE.value) -> list[Kernel]:
+  """
+  Searches the kernels together, see `_search_lockstep`. With the disk cache on, the kernels are claimed in the cache db first, so processes
+  sharing the db never search the same kernel at the same time. A kernel claimed by another process is waited for instead of searched.
+  """
+  def _apply(lin:Kernel, opts:list[Opt]) -> Kernel:
+    ret = lin.copy()
+    for o in opts[len(lin.applied_opts):]: ret.apply_opt(o)
+    return ret
+  keys = [{"ast": lin.ast.key, "amt": amt, "allow_test_size": allow_test_size, "device": lin.opts.device, "suffix": lin.opts.suffix}
+          for lin,_ in lins]
+  claim_keys = [hashlib.sha256(pickle.dumps(key)).hexdigest() for key in keys]
+  def _cached(i:int) -> Optional[Kernel]:
+    if not disable_cache and CACHELEVEL >= 1 and (val:=diskcache_get("beam_search", keys[i])) is not None: return _apply(lins[i][0], val)
+    return None
+
+  ret: list[Optional[Kernel]] = [_cached(i) for i in range(len(lins))]
+  # identical kernels are only searched once
+  todo: dict[str, list[int]] = defaultdict(list)
+  for i,r in enumerate(ret):
+    if r is None: todo[claim_keys[i]].append(i)
+  claim_timeout = getenv("BEAM_CLAIM_TIMEOUT", 3600)
+  waiting: list[list[int]] = []
+  for idxs in todo.values():
+    if not disable_cache and not diskcache_claim("beam_search", claim_keys[idxs[0]], claim_timeout): waiting.append(idxs)
+  search = [idxs for idxs in todo.values() if idxs not in waiting]
+  while len(search) or len(waiting):
+    if len(search):
+      try:
+        for dev in dedup(lins[idxs[0]][0].opts.device for idxs in search):
+          group = [idxs for idxs in search if lins[idxs[0]][0].opts.device == dev]
+          for idxs,k in zip(group, _search_lockstep([lins[idxs[0]] for idxs in group], amt, allow_test_size)):
+            if CACHELEVEL >= 1: diskcache_put("beam_search", keys[idxs[0]], k.applied_opts)
+            for i in idxs: ret[i] = _apply(lins[i][0], k.applied_opts)
+      finally:
+        if not disable_cache:
+          for idxs in search: diskcache_release("beam_search", claim_keys[idxs[0]])
+    # wait for the other processes, and take over the kernels whose claim is released without a result
+    search = []
+    while len(waiting) and not len(search):
+      for idxs in waiting[:]:
+        if (cached:=_cached(idxs[0])) is not None:
+          for i in idxs: ret[i] = _apply(lins[i][0], cached.applied_opts)
+          waiting.remove(idxs)
+        elif diskcache_claim("beam_search", claim_keys[idxs[0]], claim_timeout):
+          search.append(idxs)
+          waiting.remove(idxs)
+      if len(waiting) and not len(search): time.sleep(0.1)
+  return cast(list[Kernel], ret)
+
+def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True, disable_cache=IGNORE_BEAM_CACHE.value) -> Kernel:
+  return beam_search_many([(lin, rawbufs)], amt, allow_test_size, disable_cache)[0]
 
 def optimize_local_size(_prg:Callable, global_size:list[int], rawbufs:list[Buffer]) -> list[int]:
   test_rawbuffers = [Buffer(rawbufs[0].device, rawbufs[0].size, rawbufs[0].dtype).allocate(), *rawbufs[1:]] if rawbufs[0] in rawbufs[1:] else rawbufs
@@ -78,7 +78,21 @@ def pluralize(st:str, cnt:int): return f"{cnt} {st}"+('' if cnt == 1 else 's')
 # for length N coefficients `p`, returns p[0] * x**(N-1) + p[1] * x**(N-2) + ... + p[-2] * x + p[-1]
 def polyN(x:T, p:list[float]) -> T: return functools.reduce(lambda acc,c: acc*x+c, p, 0.0)  # type: ignore
 
-@functools.cache
+# *** bounded in-process caches ***
+
+# every lru_cache is registered here by its qualified name so they can be inspected and cleared together
+lru_caches: dict[str, Any] = {}
+def lru_cache(maxsize:int):
+  def _wrap(fxn:Callable[..., T]) -> Callable[..., T]:
+    lru_caches[f"{fxn.__module__}.{fxn.__qualname__}"] = ret = functools.lru_cache(maxsize=maxsize)(fxn)
+    return ret
+  return _wrap
+def cache_stats() -> dict[str, dict[str, int]]:
+  return {k:{"hits":(ci:=v.cache_info()).hits, "misses":ci.misses, "size":ci.currsize, "maxsize":ci.maxsize} for k,v in lru_caches.items()}
+def clear_caches():
+  for v in lru_caches.values(): v.cache_clear()
+
+@lru_cache(maxsize=4096)
 def to_function_name(s:str): return ''.join([c if c in (string.ascii_letters+string.digits+'_') else f'{ord(c):02X}' for c in ansistrip(s)])
 @functools.cache
 def getenv(key:str, default=0): return type(default)(os.getenv(key, default))
@@ -115,9 +129,12 @@ FUSE_ARANGE, FUSE_CONV_BW = ContextVar("FUSE_ARANGE", 0), ContextVar("FUSE_CONV_
 SPLIT_REDUCEOP, NO_MEMORY_PLANNER, RING = ContextVar("SPLIT_REDUCEOP", 1), ContextVar("NO_MEMORY_PLANNER", 0), ContextVar("RING", 1)
 PICKLE_BUFFERS, PROFILE, LRU = ContextVar("PICKLE_BUFFERS", 1), ContextVar("PROFILE", getenv("VIZ")), ContextVar("LRU", 1)
 CACHELEVEL, IGNORE_BEAM_CACHE, DEVECTORIZE = ContextVar("CACHELEVEL", 2), ContextVar("IGNORE_BEAM_CACHE", 0), ContextVar("DEVECTORIZE", 1)
-DISABLE_COMPILER_CACHE = ContextVar("DISABLE_COMPILER_CACHE", 0)
+DISABLE_COMPILER_CACHE, THREADS, SCHEDULE_CACHE = ContextVar("DISABLE_COMPILER_CACHE", 0), ContextVar("THREADS", 1), ContextVar("SCHEDULE_CACHE", 1)
+LOWER_AHEAD, LRU_MAX_BYTES = ContextVar("LOWER_AHEAD", 0), ContextVar("LRU_MAX_BYTES", 0)
+MALLOC_ARENA, MALLOC_HUGEPAGE = ContextVar("MALLOC_ARENA", 0), ContextVar("MALLOC_HUGEPAGE", 0)
 DONT_REALIZE_EXPAND, DONT_GROUP_REDUCES = ContextVar("DONT_REALIZE_EXPAND", 0), ContextVar("DONT_GROUP_REDUCES", 0)
 QUANTIZE, VALIDATE_WITH_CPU, IGNORE_OOB = ContextVar("QUANTIZE", 0), ContextVar("VALIDATE_WITH_CPU", 0), ContextVar("IGNORE_OOB", 1)
+FLASH_ATTENTION, FUSE_OPTIM = ContextVar("FLASH_ATTENTION", 512), ContextVar("FUSE_OPTIM", 0)
 
 @dataclass(frozen=True)
 class Metadata:
@@ -136,8 +153,17 @@ class GlobalCounters:
   time_sum_s: ClassVar[float] = 0.0
   kernel_count: ClassVar[int] = 0
   mem_used: ClassVar[int] = 0   # NOTE: this is not reset
+  # LRUAllocator stats, also not reset. mem_padding is the size class rounding in live buffers
+  mem_cached: ClassVar[int] = 0
+  mem_padding: ClassVar[int] = 0
+  lru_hits: ClassVar[int] = 0
+  lru_misses: ClassVar[int] = 0
   @staticmethod
   def reset(): GlobalCounters.global_ops, GlobalCounters.global_mem, GlobalCounters.time_sum_s, GlobalCounters.kernel_count = 0,0,0.0,0
+  @staticmethod
+  def lru_hit_rate() -> float: return GlobalCounters.lru_hits / max(GlobalCounters.lru_hits + GlobalCounters.lru_misses, 1)
+  @staticmethod
+  def fragmentation() -> float: return GlobalCounters.mem_padding / max(GlobalCounters.mem_used + GlobalCounters.mem_padding, 1)
 
 # **************** timer and profiler ****************
 
@@ -180,7 +206,8 @@ def db_connection():
   global _db_connection
   if _db_connection is None:
     os.makedirs(CACHEDB.rsplit(os.sep, 1)[0], exist_ok=True)
-    _db_connection = sqlite3.connect(CACHEDB, timeout=60, isolation_level="IMMEDIATE")
+    # the connection is shared with the threads lowering schedule items (LOWER_AHEAD)
+    _db_connection = sqlite3.connect(CACHEDB, timeout=60, isolation_level="IMMEDIATE", check_same_thread=sqlite3.threadsafety != 3)
     # another connection has set it already or is in the process of setting it
     # that connection will lock the database
     with contextlib.suppress(sqlite3.OperationalError): _db_connection.execute("PRAGMA journal_mode=WAL").fetchone()
@@ -219,6 +246,23 @@ def diskcache_put(table:str, key:Union[dict, str, int], val:Any, prepickled=Fals
   cur.close()
   return val
 
+def diskcache_claim(table:str, key:str, timeout:float) -> bool:
+  # claim the work for key across processes. a claim older than timeout is from a process that died and can be taken over
+  if CACHELEVEL < 1: return True
+  conn = db_connection()
+  conn.execute(f"CREATE TABLE IF NOT EXISTS '{table}_claim_{VERSION}' (key text, ts numeric, PRIMARY KEY (key))")
+  cur = conn.execute(f"INSERT INTO '{table}_claim_{VERSION}' (key, ts) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET ts=excluded.ts WHERE ts<?",
+                     (key, now:=time.time(), now-timeout))
+  conn.commit()
+  return cur.rowcount == 1
+
+def diskcache_release(table:str, key:str):
+  if CACHELEVEL < 1: return
+  conn = db_connection()
+  conn.execute(f"CREATE TABLE IF NOT EXISTS '{table}_claim_{VERSION}' (key text, ts numeric, PRIMARY KEY (key))")
+  conn.execute(f"DELETE FROM '{table}_claim_{VERSION}' WHERE key=?", (key,))
+  conn.commit()
+
 def diskcache(func):
   def wrapper(*args, **kwargs) -> bytes:
     table, key = f"cache_{func.__name__}", hashlib.sha256(pickle.dumps((args, kwargs))).hexdigest()
@@ -1,13 +1,17 @@
 # sorted in order of increasing complexity
-from tinygrad.helpers import dedup, flatten, getenv, unwrap
+import itertools
+from tinygrad.helpers import dedup, flatten, getenv, unwrap, FUSE_OPTIM
 from tinygrad.tensor import Tensor
 from tinygrad.dtype import dtypes, least_upper_dtype
 
 class Optimizer:
   """
   Base class for all optimizers.
+
+  With `fused`, the parameters of each dtype are packed into one contiguous buffer and each parameter becomes a view into it,
+  so the update (and the optimizer state, which is allocated flat as well) runs as a handful of large kernels instead of a few per parameter.
   """
-  def __init__(self, params: list[Tensor], lr: float):
+  def __init__(self, params: list[Tensor], lr: float, fused=FUSE_OPTIM):
     # if it's None, but being put into an optimizer, set it to True
     for x in params:
       if x.requires_grad is None: x.requires_grad = True
@@ -19,6 +23,23 @@ class Optimizer:
     # store lr in at least float32 precision
     self.lr = Tensor(lr if getenv("CONST_LR") else [lr], requires_grad=False, device=self.device,
                      dtype=least_upper_dtype(dtypes.default_float, dtypes.float32))
+    self.fused = bool(fused)
+    if self.fused:
+      assert all(isinstance(t.device, str) for t in self.params), "fused optimizer doesn't support multi device params"
+      # group by dtype and device, self.segments[i] are the (start, end) offsets of each param of group i in self.flat[i]
+      self.groups = [[i for i,t in enumerate(self.params) if (t.dtype, t.device) == k] for k in dedup([(t.dtype, t.device) for t in self.params])]
+      self.segments = [list(itertools.pairwise(itertools.accumulate([self.params[i].numel() for i in g], initial=0))) for g in self.groups]
+      self.flat = [self._pack(g) for g in self.groups]
+      for j in range(len(self.groups)): self._link(j)
+
+  # the tensors the update is computed on, the flat buffers if fused. not an attribute so it's not in the state_dict twice
+  @property
+  def _params(self) -> list[Tensor]: return self.flat if self.fused else self.params
+
+  def _pack(self, g:list[int]) -> Tensor:
+    return Tensor.cat(*[self.params[i].detach().flatten() for i in g]).contiguous().realize().requires_grad_(False)
+  def _link(self, j:int):
+    for i,(st,en) in zip(self.groups[j], self.segments[j]): self.params[i].replace(self.flat[j][st:en].reshape(self.params[i].shape))
 
   def zero_grad(self):
     """
@@ -41,7 +62,23 @@ class Optimizer:
                 - help: Consider setting Tensor.training=True before calling Optimizer.step().""")
     return self.schedule_step_with_grads([unwrap(t.grad) for t in self.params])+self.params+self.buffers
 
-  def schedule_step_with_grads(self, grads:list[Tensor]) -> list[Tensor]: raise NotImplementedError
+  def schedule_step_with_grads(self, grads:list[Tensor]) -> list[Tensor]:
+    if not self.fused: return self._step(self.params, grads)
+    # a param that was replaced (e.g. by load_state_dict) is no longer a view of its flat buffer, copy it back in and view it again
+    for j,(g,flat) in enumerate(zip(self.groups, self.flat)):
+      if all(self.params[i].lazydata.base is flat.lazydata.base for i in g): continue
+      flat.assign(self._pack(g)).realize()
+      self._link(j)
+    # the packed grad is contiguous so it's computed once, it's shared by all the state updates and can itself be a view of the params being assigned
+    grads = [Tensor.cat(*[grads[i].flatten() for i in g]).contiguous() for g in self.groups]
+    return self._step(self.flat, grads) + self.flat
+
+  def _step(self, params:list[Tensor], grads:list[Tensor]) -> list[Tensor]: raise NotImplementedError
+
+  def _norm(self, i:int, x:Tensor) -> Tensor:
+    # L2 norm of the i-th entry of params, per parameter (and expanded over its elements) when fused
+    if not self.fused: return x.square().sum().sqrt()
+    return Tensor.cat(*[x[st:en].square().sum().sqrt().expand(en-st) for st,en in self.segments[i]])
 
 class OptimizerGroup(Optimizer):
   """
@@ -55,7 +92,7 @@ class OptimizerGroup(Optimizer):
   def schedule_step(self) -> list[Tensor]: return [x for o in self.optimizers for x in o.schedule_step()]
 
 # LARS is essentially just trust ratio to SGD so if we just set the trust coeff 0.0 its just standard SGD.
-def SGD(params: list[Tensor], lr=0.001, momentum=0.0, weight_decay=0.0, nesterov=False, classic=False):
+def SGD(params: list[Tensor], lr=0.001, momentum=0.0, weight_decay=0.0, nesterov=False, classic=False, fused=FUSE_OPTIM):
   """
   Stochastic Gradient Descent (SGD) optimizer with optional momentum and weight decay.
 
@@ -63,7 +100,7 @@ def SGD(params: list[Tensor], lr=0.001, momentum=0.0, weight_decay=0.0, nesterov
 
   - Described: https://paperswithcode.com/method/sgd
   """
-  return LARS(params, lr, momentum, weight_decay, nesterov, classic, tcoef=0.0)
+  return LARS(params, lr, momentum, weight_decay, nesterov, classic, tcoef=0.0, fused=fused)
 
 class LARS(Optimizer):
   """
@@ -72,16 +109,16 @@ class LARS(Optimizer):
   - Described: https://paperswithcode.com/method/lars
   - Paper: https://arxiv.org/abs/1708.03888v3
   """
-  def __init__(self, params:list[Tensor], lr=0.001, momentum=0.9, weight_decay=1e-4, nesterov=False, classic=True, tcoef=0.001):
-    super().__init__(params, lr)
+  def __init__(self, params:list[Tensor], lr=0.001, momentum=0.9, weight_decay=1e-4, nesterov=False, classic=True, tcoef=0.001, fused=FUSE_OPTIM):
+    super().__init__(params, lr, fused)
     self.momentum, self.wd, self.nesterov, self.classic, self.tcoef = momentum, weight_decay, nesterov, classic, tcoef
-    self.b = [Tensor.zeros(*t.shape, dtype=t.dtype, device=t.device, requires_grad=False) for t in self.params] if self.momentum else []
+    self.b = [Tensor.zeros(*t.shape, dtype=t.dtype, device=t.device, requires_grad=False) for t in self._params] if self.momentum else []
 
-  def schedule_step_with_grads(self, grads:list[Tensor]) -> list[Tensor]:
-    for i, (t, g) in enumerate(zip(self.params, grads)):
+  def _step(self, params:list[Tensor], grads:list[Tensor]) -> list[Tensor]:
+    for i, (t, g) in enumerate(zip(params, grads)):
       if self.tcoef != 0:
-        r1 = t.detach().square().sum().sqrt()
-        r2 = g.square().sum().sqrt()
+        r1 = self._norm(i, t.detach())
+        r2 = self._norm(i, g)
         r:Tensor|float = (r1 > 0).where((r2 > 0).where(self.tcoef * r1 / (r2 + self.wd * r1), 1.0), 1.0)
       else: r = 1.0
       g = g + self.wd * t.detach()
@@ -98,22 +135,22 @@ class LARS(Optimizer):
     return self.b
 
 # LAMB is essentially just the trust ratio part of LARS applied to Adam/W so if we just set the trust ratio to 1.0 its just Adam/W.
-def AdamW(params: list[Tensor], lr=0.001, b1=0.9, b2=0.999, eps=1e-8, weight_decay=0.01):
+def AdamW(params: list[Tensor], lr=0.001, b1=0.9, b2=0.999, eps=1e-8, weight_decay=0.01, fused=FUSE_OPTIM):
   """
   AdamW optimizer with optional weight decay.
 
   - Described: https://paperswithcode.com/method/adamw
   - Paper: https://arxiv.org/abs/1711.05101v3
   """
-  return LAMB(params, lr, b1, b2, eps, weight_decay, adam=True)
-def Adam(params: list[Tensor], lr=0.001, b1=0.9, b2=0.999, eps=1e-8):
+  return LAMB(params, lr, b1, b2, eps, weight_decay, adam=True, fused=fused)
+def Adam(params: list[Tensor], lr=0.001, b1=0.9, b2=0.999, eps=1e-8, fused=FUSE_OPTIM):
   """
   Adam optimizer.
 
   - Described: https://paperswithcode.com/method/adam
   - Paper: https://arxiv.org/abs/1412.6980
   """
-  return LAMB(params, lr, b1, b2, eps, 0.0, adam=True)
+  return LAMB(params, lr, b1, b2, eps, 0.0, adam=True, fused=fused)
 
 class LAMB(Optimizer):
   """
@@ -122,25 +159,25 @@ class LAMB(Optimizer):
   - Described: https://paperswithcode.com/method/lamb
   - Paper: https://arxiv.org/abs/1904.00962
   """
-  def __init__(self, params: list[Tensor], lr=0.001, b1=0.9, b2=0.999, eps=1e-6, weight_decay=0.0, adam=False):
-    super().__init__(params, lr)
+  def __init__(self, params: list[Tensor], lr=0.001, b1=0.9, b2=0.999, eps=1e-6, weight_decay=0.0, adam=False, fused=FUSE_OPTIM):
+    super().__init__(params, lr, fused)
     self.b1, self.b2, self.eps, self.wd, self.adam = b1, b2, eps, weight_decay, adam
     self.b1_t, self.b2_t = (Tensor.ones((1,), dtype=dtypes.float32, device=self.device, requires_grad=False).contiguous() for _ in [b1, b2])
-    self.m = [Tensor.zeros(*t.shape, dtype=dtypes.float32, device=t.device, requires_grad=False).contiguous() for t in self.params]
-    self.v = [Tensor.zeros(*t.shape, dtype=dtypes.float32, device=t.device, requires_grad=False).contiguous() for t in self.params]
+    self.m = [Tensor.zeros(*t.shape, dtype=dtypes.float32, device=t.device, requires_grad=False).contiguous() for t in self._params]
+    self.v = [Tensor.zeros(*t.shape, dtype=dtypes.float32, device=t.device, requires_grad=False).contiguous() for t in self._params]
 
-  def schedule_step_with_grads(self, grads:list[Tensor]) -> list[Tensor]:
+  def _step(self, params:list[Tensor], grads:list[Tensor]) -> list[Tensor]:
     self.b1_t *= self.b1
     self.b2_t *= self.b2
-    for i, (t, g) in enumerate(zip(self.params, grads)):
+    for i, (t, g) in enumerate(zip(params, grads)):
       self.m[i].assign(self.b1 * self.m[i] + (1.0 - self.b1) * g)
       self.v[i].assign(self.b2 * self.v[i] + (1.0 - self.b2) * (g * g))
       m_hat = self.m[i] / (1.0 - self.b1_t)
       v_hat = self.v[i] / (1.0 - self.b2_t)
       up = (m_hat / (v_hat.sqrt() + self.eps)) + self.wd * t.detach()
       if not self.adam:
-        r1 = t.detach().square().sum().sqrt()
-        r2 = up.square().sum().sqrt()
+        r1 = self._norm(i, t.detach())
+        r2 = self._norm(i, up)
         r: Tensor|float = Tensor.where(r1 > 0, Tensor.where(r2 > 0, r1 / r2, 1.0), 1.0)
       else:
         r = 1.0
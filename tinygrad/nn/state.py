@@ -1,8 +1,13 @@
-import json, pathlib, zipfile, pickle, tarfile, struct, functools, io
+import json, pathlib, zipfile, pickle, tarfile, struct, functools, io, collections
 from collections import OrderedDict
-from typing import Union, Optional, Any, Callable, BinaryIO, Iterable
+from typing import Union, Optional, Any, Callable, BinaryIO, Iterable, cast
 from tinygrad.tensor import Tensor
 from tinygrad.dtype import dtypes
+from tinygrad.ops import Ops
+from tinygrad.device import Device, Buffer
+from tinygrad.engine.schedule import ScheduleItem
+from tinygrad.engine.realize import ExecItem, lower_schedule
+from tinygrad.runtime.ops_disk import DiskDevice, DiskReader
 from tinygrad.helpers import prod, argsort, DEBUG, Timing, CI, unwrap, GlobalCounters, tqdm, round_up, T
 from tinygrad.shape.view import strides_for_shape
 
@@ -35,9 +40,10 @@ safe_dtypes = {"BOOL":dtypes.bool, "I8":dtypes.int8, "U8":dtypes.uint8, "I16":dt
                "I64":dtypes.int64, "U64":dtypes.uint64, "F16":dtypes.float16, "BF16":dtypes.bfloat16, "F32":dtypes.float32, "F64":dtypes.float64}
 inverse_safe_dtypes = {v:k for k,v in safe_dtypes.items()}
 
-def accept_filename(func: Callable[[Tensor], T]) -> Callable[[Union[Tensor, str, pathlib.Path]], T]:
+def accept_filename(func: Callable[..., T]) -> Callable[..., T]:
   @functools.wraps(func)
-  def wrapper(fn: Union[Tensor, str, pathlib.Path]) -> T: return func(Tensor(pathlib.Path(fn)) if not isinstance(fn, Tensor) else fn)
+  def wrapper(fn: Union[Tensor, str, pathlib.Path], *args, **kwargs) -> T:
+    return func(Tensor(pathlib.Path(fn)) if not isinstance(fn, Tensor) else fn, *args, **kwargs)
   return wrapper
 
 @accept_filename
@@ -124,6 +130,48 @@ def get_parameters(obj) -> list[Tensor]:
   """
   return list(get_state_dict(obj).values())
 
+class _Loader:
+  # realizes tensors with their DISK reads submitted ahead through io_uring, while the kernels (dtype conversion, transfer) of earlier tensors run
+  def __init__(self, max_ahead:int=1<<30):
+    self.reader, self.max_ahead, self.ahead, self.nbytes = DiskReader() if hasattr(DiskDevice, "io_uring") else None, max_ahead, 0, 0
+    # the lowered schedule of each tensor, with its reads in flight and their size
+    self.loading: collections.deque[tuple[list[tuple[ScheduleItem, ExecItem]], dict, dict[int, tuple[int, Optional[memoryview]]], int]] = \
+      collections.deque()
+
+  def _is_read(self, si:ScheduleItem) -> bool:
+    # devices with copy_from_disk already read through io_uring into their own memory
+    if self.reader is None or si.ast.op is not Ops.COPY or not si.bufs[1].device.startswith("DISK"): return False
+    # the file is opened when the DISK buffer is allocated
+    return getattr(Device[si.bufs[1].ensure_allocated().device], "fd", None) is not None and \
+      not hasattr(Device[si.bufs[0].device].allocator, "copy_from_disk")
+
+  def _read(self, dest:Buffer, src:Buffer) -> tuple[int, Optional[memoryview]]:
+    # host memory is read into directly, the other devices copy in the bytes when the read is done
+    reader = cast(DiskReader, self.reader)
+    if hasattr(allocator:=dest.ensure_allocated().allocator, "_as_buffer"): return reader.submit(src._buf, allocator._as_buffer(dest._buf)), None
+    return reader.submit(src._buf, host:=memoryview(bytearray(src.nbytes))), host
+
+  def add(self, t:Tensor):
+    sched, var_vals = t.schedule_with_vars()
+    items = list(lower_schedule(sched))
+    reads = {i:self._read(*si.bufs[:2]) for i,(si,_) in enumerate(items) if self._is_read(si)}
+    size = sum(items[i][0].bufs[1].nbytes for i in reads)
+    self.loading.append((items, var_vals, reads, size))
+    self.ahead, self.nbytes = self.ahead + size, self.nbytes + size
+    while len(self.loading) > 1 and self.ahead > self.max_ahead: self._run()
+
+  def _run(self):
+    items, var_vals, reads, size = self.loading.popleft()
+    for i,(si,ei) in enumerate(items):
+      if i not in reads: ei.run(var_vals)
+      else:
+        cast(DiskReader, self.reader).wait(reads[i][0])
+        if (host:=reads[i][1]) is not None: si.bufs[0].copyin(host)
+    self.ahead -= size
+
+  def flush(self):
+    while self.loading: self._run()
+
 def load_state_dict(model, state_dict:dict[str, Tensor], strict=True, verbose=True, consume=False, realize=True) -> None:
   """
   Loads a `state_dict` into a model.
@@ -139,9 +187,9 @@ def load_state_dict(model, state_dict:dict[str, Tensor], strict=True, verbose=Tr
   nn.state.load_state_dict(net, state_dict)
   ```
   """
-  start_mem_used = GlobalCounters.mem_used
-  with Timing("loaded weights in ",
-              lambda et_ns: f", {(B:=(GlobalCounters.mem_used-start_mem_used))/1e9:.2f} GB loaded at {B/et_ns:.2f} GB/s", enabled=verbose):
+  start_mem_used, loader = GlobalCounters.mem_used, _Loader()
+  with Timing("loaded weights in ", lambda et_ns: f", {(B:=(GlobalCounters.mem_used-start_mem_used))/1e9:.2f} GB loaded at {B/et_ns:.2f} GB/s" +
+              (f", {loader.nbytes/1e9:.2f} GB read from disk at {loader.nbytes/et_ns:.2f} GB/s" if loader.nbytes else ""), enabled=verbose):
     model_state_dict = get_state_dict(model)
     if DEBUG >= 1 and len(state_dict) > len(model_state_dict):
       print("WARNING: unused weights in state_dict", sorted(list(state_dict.keys() - model_state_dict.keys())))
@@ -156,8 +204,9 @@ def load_state_dict(model, state_dict:dict[str, Tensor], strict=True, verbose=Tr
         if isinstance(state_dict[k].device, tuple): v.replace(state_dict[k])
         else: v.replace(state_dict[k].shard(v.device, v.lazydata.axis))
       else: v.replace(state_dict[k].to(v.device))
-      if realize: v.realize()
+      if realize: loader.add(v)
       if consume: del state_dict[k]
+    loader.flush()
 
 @accept_filename
 def tar_extract(t: Tensor) -> dict[str, Tensor]:
@@ -266,6 +315,37 @@ def torch_load(t:Tensor) -> dict[str, Tensor]:
     fobj.seek(rwd)
     return TorchPickle(fobj).load()
 
+# ggml type -> (number of elements, number of bytes) of a quantized block
+ggml_quantized_blocks: dict[int, tuple[int, int]] = { 2: (32, 18), 3: (32, 20), 14: (256, 210), 8: (32, 34) }
+
+def ggml_dequantize(blocks: Tensor, ggml_type: int) -> Tensor:
+  """
+  Dequantizes ggml blocks of shape `(..., n_blocks, block_bytes)` to float32 of shape `(..., n_blocks * block_elements)`.
+
+  Nothing is materialized, used as the weight of a matmul the dequantization happens inside the kernel that reads the blocks.
+  Supported quantized types: Q4_0 (id: 2), Q4_1 (id: 3), Q8_0 (id: 8), Q6_K (id: 14)
+  """
+  if (nelements_nbytes := ggml_quantized_blocks.get(ggml_type)) is None: raise ValueError(f"GGML type '{ggml_type}' is not supported!")
+  # everything stays elementwise on the bytes of the blocks so it fuses into the kernel that reads them:
+  # the b-bit values are masked and scaled down instead of shifted (an IDIV isn't safe to pad for the stack)
+  # and the scales are expanded while they are still bytes (an expanded bitcast would be realized)
+  def q_to_float(t: Tensor, b: int) -> Tensor:
+    return Tensor.stack(*[ t.bitwise_and((0xff >> (8 - b)) << (i*b)).cast(dtypes.float32) * 2**(-i*b) for i in range(8//b) ], dim=-1) \
+      .transpose(-1, -2).flatten(-2)
+  def scale(t: Tensor, n: int) -> Tensor: return t.unsqueeze(1).expand((-1, n, 2)).bitcast(dtypes.float16).cast(dtypes.float32).reshape((-1, n))
+
+  shape, blocks = blocks.shape[:-2], blocks.reshape((-1, nelements_nbytes[1]))
+  if ggml_type == 2: ret = (q_to_float(blocks[:,2:], 4) - 8) * scale(blocks[:,:2], 32)
+  if ggml_type == 3:
+    d, m = (scale(blocks[:,s:s+2], 32) for s in [ 0, 2 ])
+    ret = q_to_float(blocks[:,4:], 4) * d + m
+  if ggml_type == 8: ret = scale(blocks[:,:2], 32) * blocks[:,2:].bitcast(dtypes.int8)
+  if ggml_type == 14:
+    xl, xh = q_to_float(blocks[:,:128].reshape((-1, 2, 64)), 4), q_to_float(blocks[:,128:192].reshape((-1, 2, 32)), 2) * 16
+    scales = blocks[:,192:208].unsqueeze(-1).expand((-1, 16, 16)).reshape((-1, 256)).bitcast(dtypes.int8)
+    ret = scale(blocks[:,-2:], 256) * (xl + xh - 32).flatten(-2) * scales
+  return ret.reshape(*shape, -1)
+
 def ggml_data_to_tensor(t: Tensor, n: int, ggml_type: int) -> Tensor:
   """
   Converts ggml tensor data to a tinygrad tensor.
@@ -279,28 +359,12 @@ def ggml_data_to_tensor(t: Tensor, n: int, ggml_type: int) -> Tensor:
   if (dtype := { 0: dtypes.float32, 1: dtypes.float16, 16: dtypes.int8, 17: dtypes.int16, 18: dtypes.int32 }.get(ggml_type)) is not None:
     return t[:dtype.itemsize * n].bitcast(dtype)
 
-  def q_to_uint8(t: Tensor, b: int) -> Tensor:
-    # TODO: rewrite with arange?
-    shift_tensor, bitmask = Tensor.stack(*[ Tensor(2**(i*b), device=t.device, dtype=t.dtype) for i in range(8//b) ]), 0xff >> (8 - b)
-    return t.unsqueeze(-1).expand((*t.shape,8//b)).idiv(shift_tensor).bitwise_and(bitmask).transpose(-1, -2).flatten(-2)
-
-  # map to (number of elements, number of bytes)
-  if (nelements_nbytes := { 2: (32, 18), 3: (32, 20), 14: (256, 210), 8: (32, 34) }.get(ggml_type)) is not None:
-    blocks = t[:(n//nelements_nbytes[0])*nelements_nbytes[1]].reshape((-1, nelements_nbytes[1]))
-    if ggml_type == 2: return (q_to_uint8(blocks[:,2:], 4).bitcast(dtypes.int8) - 8) * blocks[:,:2].bitcast(dtypes.float16).cast(dtypes.float32)
-    if ggml_type == 3:
-      d, m = (blocks[:,s:s+2].bitcast(dtypes.float16).cast(dtypes.float32) for s in [ 0, 2 ])
-      return q_to_uint8(blocks[:,4:], 4).bitcast(dtypes.int8) * d + m
-    if ggml_type == 8: return blocks[:,:2].bitcast(dtypes.float16).cast(dtypes.float32) * blocks[:,2:].bitcast(dtypes.int8)
-    if ggml_type == 14:
-      xl, xh = q_to_uint8(blocks[:,:128].reshape((-1, 2, 64)), 4), q_to_uint8(blocks[:,128:192].reshape((-1, 2, 32)), 2).lshift(4)
-      scales = blocks[:,192:208].bitcast(dtypes.int8).unsqueeze(-1).expand((-1, 16, 16)).reshape((-1, 256))
-      d = blocks[:,-2:].bitcast(dtypes.float16).cast(dtypes.float32).expand((-1, 256))
-      return d * (xl.bitwise_or(xh).bitcast(dtypes.int8) - 32).flatten(-2) * scales
+  if (nelements_nbytes := ggml_quantized_blocks.get(ggml_type)) is not None:
+    return ggml_dequantize(t[:(n//nelements_nbytes[0])*nelements_nbytes[1]].reshape((1, -1, nelements_nbytes[1])), ggml_type).flatten()
   raise ValueError(f"GGML type '{ggml_type}' is not supported!")
 
 @accept_filename
-def gguf_load(tensor: Tensor) -> tuple[dict, dict[str, Tensor]]:
+def gguf_load(tensor: Tensor, quantized: bool=False) -> tuple[dict, dict[str, Tensor]]:
   """
   Loads a .gguf file, returning the `kv_data` and `state_dict`.
 
@@ -309,6 +373,9 @@ def gguf_load(tensor: Tensor) -> tuple[dict, dict[str, Tensor]]:
   kv_data, state_dict = nn.state.gguf_load(gguf_tensor)
   ```
 
+  With `quantized=True`, quantized tensors are kept as their uint8 blocks of shape `(..., n_blocks, block_bytes)` for `ggml_dequantize`.
+  The block size in bytes differs for each type in `ggml_quantized_blocks`.
+
   NOTE: The provided tensor must be on a device that supports execution.
   """
   reader, kv_data, state_dict = io.BufferedReader(TensorIO(tensor), 1_000_000), {}, {}
@@ -332,6 +399,10 @@ def gguf_load(tensor: Tensor) -> tuple[dict, dict[str, Tensor]]:
   alignment, pos = kv_data.get("general.alignment", 32), reader.tell()
   data_start = round_up(pos, alignment)
 
-  for name, dims, typ, off in t_infos: state_dict[name] = ggml_data_to_tensor(tensor[data_start + off:], prod(dims), typ).reshape(*reversed(dims))
+  for name, dims, typ, off in t_infos:
+    if quantized and (nelements_nbytes := ggml_quantized_blocks.get(typ)) is not None:
+      shape = (*reversed(dims[1:]), dims[0]//nelements_nbytes[0], nelements_nbytes[1])
+      state_dict[name] = tensor[data_start + off:data_start + off + prod(shape)].reshape(shape)
+    else: state_dict[name] = ggml_data_to_tensor(tensor[data_start + off:], prod(dims), typ).reshape(*reversed(dims))
 
   return kv_data, state_dict
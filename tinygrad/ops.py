@@ -1,11 +1,11 @@
 from __future__ import annotations
 from typing import Any, Optional, Union, Callable, cast, TYPE_CHECKING, Type, get_args, Sequence
-import sys, time, functools, itertools, math, operator, hashlib, os, types, pickle, pathlib, inspect, weakref
+import sys, time, functools, itertools, math, operator, hashlib, os, types, pickle, pathlib, inspect, weakref, threading
 from enum import auto, IntEnum, Enum
 from dataclasses import dataclass, field
 from tinygrad.dtype import ConstType, ImageDType, dtypes, DType, truncate
 from tinygrad.helpers import ContextVar, all_int, prod, getenv, all_same, Context, partition, temp, unwrap, T, argfix, Metadata, flatten
-from tinygrad.helpers import PICKLE_BUFFERS, dedup, cdiv, cmod
+from tinygrad.helpers import PICKLE_BUFFERS, dedup, cdiv, cmod, lru_cache
 if TYPE_CHECKING:
   from tinygrad.shape.shapetracker import ShapeTracker
   from tinygrad.device import Buffer
@@ -224,9 +224,25 @@ def pretty_print(x:Any, rep:Callable, srcfn=lambda x: x.src, cache=None, d=0)->s
 
 class UOpMetaClass(type):
   ucache:dict[tuple, weakref.ReferenceType[UOp]] = {}
+  # interning stats, a hit is a UOp(...) that returned an existing UOp
+  hits: int = 0
+  created: int = 0
+  # set while schedule items are lowered on threads (LOWER_AHEAD), so two threads don't both create the same UOp
+  lock: threading.Lock|None = None
   def __call__(cls, op:Ops, dtype:DType=dtypes.void, src:tuple[UOp,...]=tuple(), arg:Any=None, _buffer:Buffer|None=None):
-    if (wret:=UOpMetaClass.ucache.get(key:=(op, dtype, src, arg), None)) is not None and (ret:=wret()) is not None: return ret
+    if (wret:=UOpMetaClass.ucache.get(key:=(op, dtype, src, arg), None)) is not None and (ret:=wret()) is not None:
+      UOpMetaClass.hits += 1
+      return ret
+    if (lock:=UOpMetaClass.lock) is None: return cls._create(key, _buffer)
+    with lock:
+      if (wret:=UOpMetaClass.ucache.get(key, None)) is not None and (ret:=wret()) is not None: return ret
+      return cls._create(key, _buffer)
+  def _create(cls, key:tuple, _buffer:Buffer|None):
+    op, dtype, src, arg = key
     UOpMetaClass.ucache[key] = ref = weakref.ref(created:=super().__call__(*key))
+    UOpMetaClass.created += 1
+    # the structural hash is built from the children's, so it's computed once per node and never walks the graph
+    created.shash = hash((op, dtype, arg, tuple([s.shash for s in src])))
     for s in src: s.children.add(ref)
     # NOTE: this value is set by pickle when pickling a realized tensor
     if _buffer is not None:
@@ -234,6 +250,10 @@ class UOpMetaClass(type):
       buffers[created] = _buffer
     return created
 
+def uop_intern_stats() -> dict[str, int|float]:
+  calls = UOpMetaClass.hits + UOpMetaClass.created
+  return {"live": len(UOpMetaClass.ucache), "created": UOpMetaClass.created, "hits": UOpMetaClass.hits, "hit_rate": UOpMetaClass.hits/max(calls, 1)}
+
 # some uops map to other stuff
 buffers:weakref.WeakKeyDictionary[UOp, Buffer] = weakref.WeakKeyDictionary() # this maps BUFFER uops to their device Buffers
 all_metadata:weakref.WeakKeyDictionary[UOp, Metadata] = weakref.WeakKeyDictionary() # TODO: should this be here?
@@ -246,11 +266,12 @@ class UOp(MathTrait, metaclass=UOpMetaClass):
   src:tuple[UOp, ...] = tuple()
   arg:Any = None
   children:set[weakref.ref[UOp]] = field(default_factory=set)
+  # process local hash of the structure (op, dtype, arg and the srcs' shash), set by UOpMetaClass. the persistent hash is key
+  shash:int = field(default=0, init=False, repr=False)
   def __del__(self):
     if self.op is Ops.BUFFER and (buffer:=buffers.get(self)) is not None: buffer.ref(-1)
-    if (ref:=UOpMetaClass.ucache.get(k:=(self.op, self.dtype, self.src, self.arg))) is not None:
+    if (ref:=UOpMetaClass.ucache.pop((self.op, self.dtype, self.src, self.arg), None)) is not None:
       for s in self.src: s.children.discard(ref)
-      del UOpMetaClass.ucache[k]
   def __reduce__(self):
     args = [self.op, self.dtype, self.src, self.arg]
     if self.op is Ops.BUFFER and self.realized is not None and PICKLE_BUFFERS: args.append(self.realized)
@@ -262,6 +283,10 @@ class UOp(MathTrait, metaclass=UOpMetaClass):
     return UOp(*new_args)
   @functools.cached_property
   def key(self) -> bytes:
+    # sha256 of the structure, stable across processes. the srcs' keys are filled in first, in toposort order, so deep graphs don't recurse
+    if len(self.src) and any("key" not in s.__dict__ for s in self.src):
+      for u in self.toposort(gate=lambda u: "key" not in u.__dict__):
+        if u is not self: u.__dict__["key"] = hashlib.sha256(str((u.op, u.dtype, u.arg)).encode() + b"".join([s.key for s in u.src])).digest()
     return hashlib.sha256(str((self.op, self.dtype, self.arg)).encode() + b"".join([s.key for s in self.src])).digest()
   def __repr__(self): return pretty_print(self, lambda x: f"{type(self).__name__}({x.op}, {x.dtype}, arg={x.argstr()}, src=(%s))")
   def argstr(self): return f'({", ".join(map(str, self.arg))})' if self.op is Ops.REDUCE_AXIS else repr(self.arg)
@@ -841,16 +866,33 @@ class PatternMatcher:
       if compiled and (match:=upat_compile(p, fxn)) is not None: pass # pylint: disable=E0606
       else: match = upat_interpret(p, fxn)
       for uop in p.op: self.pdict.setdefault(uop, []).append((p, match, p.early_reject))
+    # (op, dtype, src ops) -> the matches that can apply, in pattern order. the op, dtype, length and src op checks that the patterns share
+    # are done once per key when it's first seen, after that a rewrite only runs the matches that are left
+    self.dispatch: dict[tuple, list[Callable]] = {}
+
+  def _candidates(self, op:Ops, dtype:DType, src_ops:tuple[Ops, ...]) -> list[Callable]:
+    def src_ok(vp, sop:tuple[Ops, ...]) -> bool: return all(x.op is None or o in x.op for x,o in zip(vp, sop))
+    ret, ler = [], set(src_ops)
+    for p,match,early_reject in self.pdict.get(op, []):
+      if not early_reject.issubset(ler): continue
+      if p.dtype is not None and dtype not in p.dtype and dtype.scalar() not in p.dtype: continue
+      if len(src_ops) < p.required_len or (p.strict_length and len(src_ops) != p.required_len): continue
+      if p.src is not None:
+        if isinstance(p.src[0], itertools.repeat):
+          if not src_ok(itertools.repeat(p._in_src), src_ops): continue
+        elif not any(src_ok(vp, src_ops) for vp in p.src): continue
+      ret.append(match)
+    return ret
 
   def __reduce__(self): return PatternMatcher, ([(x,deconstruct_function(fxn) if fxn.__name__ == "<lambda>" else fxn) for x,fxn in self.patterns],)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @lru_cache(maxsize=256)
   def __add__(self, more:PatternMatcher): return PatternMatcher(self.patterns+more.patterns)
 
   def rewrite(self, uop:UOp, ctx=None) -> UOp|None:
-    ler = {u.op for u in uop.src}
-    for _,match,early_reject in self.pdict.get(uop.op, []):
-      if not early_reject.issubset(ler): continue
+    if (matches:=self.dispatch.get(key:=(uop.op, uop.dtype, tuple([u.op for u in uop.src])))) is None:
+      matches = self.dispatch[key] = self._candidates(*key)
+    for match in matches:
       if (ret:=match(uop, ctx)) is not None: return ret
     return None
 
@@ -941,28 +983,72 @@ def launch_viz(env_str:str, data:str):
 
 # *** simple graph rewrite engine ***
 
+# (PatternMatcher, bottom_up) -> UOp -> what graph_rewrite turned it into (None if unchanged), for pure matchers rewritten with memo=True
+rewrite_memo: weakref.WeakKeyDictionary[PatternMatcher, tuple[weakref.WeakKeyDictionary[UOp, UOp|None], ...]] = weakref.WeakKeyDictionary()
+
 class RewriteContext:
-  def __init__(self, pm, ctx=None):
+  def __init__(self, pm, ctx=None, memo=False, bottom_up=False):
     self.pm: PatternMatcher = pm
     self.ctx = ctx
     self.replace: dict[UOp, UOp] = {}
-  def top_down_rewrite(self, n:UOp) -> UOp:
-    if (rn := self.replace.get(n)) is not None: return rn
-    new_src = tuple([self.top_down_rewrite(x) for x in n.src])
-    new_n = self.pm.rewrite(n, self.ctx) if new_src == n.src else UOp(n.op, n.dtype, new_src, n.arg)
-    self.replace[n] = ret = n if new_n is None else self.top_down_rewrite(new_n)
-    return ret
-  def bottom_up_rewrite(self, n:UOp) -> UOp:
-    if (rn := self.replace.get(n)) is not None: return rn
-    new_n: UOp|None = n
-    while new_n is not None: last_n, new_n = new_n, self.pm.rewrite(new_n, self.ctx)
-    new_src = tuple([self.bottom_up_rewrite(x) for x in last_n.src])
-    self.replace[n] = ret = last_n if new_src == last_n.src else self.bottom_up_rewrite(UOp(last_n.op, last_n.dtype, new_src, last_n.arg))
-    return ret
+    # the uops being rewritten, reaching one again is a rewrite that never terminates
+    self.active: set[UOp] = set()
+    # the keys are weak and an unchanged uop isn't stored as its own value, so the memo only lives as long as the graphs it was built from
+    if memo:
+      assert ctx is None, "only ctx-free rewrites can be memoized across calls"
+      self.memo: Optional[weakref.WeakKeyDictionary[UOp, UOp|None]] = \
+        rewrite_memo.setdefault(pm, (weakref.WeakKeyDictionary(), weakref.WeakKeyDictionary()))[bottom_up]
+    else: self.memo = None
+  def _cached(self, n:UOp) -> bool:
+    if n in self.active: raise RecursionError(f"graph_rewrite doesn't terminate, reached {n.op} again while rewriting it")
+    if self.memo is not None and n in self.memo:
+      self.replace[n] = n if (rn:=self.memo[n]) is None else rn
+      return True
+    return False
+  def _done(self, n:UOp, ret:UOp):
+    self.replace[n] = ret
+    self.active.discard(n)
+    if self.memo is not None: self.memo[n] = None if ret is n else ret
+  # the rewrites walk the graph with an explicit stack of (uop, stage, node to rewrite next), in the order a recursive walk would visit it
+  def top_down_rewrite(self, root:UOp) -> UOp:
+    replace, stack = self.replace, cast(list[tuple[UOp, int, Any]], [(root, 0, None)])
+    while stack:
+      n, stage, nxt = stack.pop()
+      if stage == 0:
+        if n in replace or self._cached(n): continue
+        self.active.add(n)
+        stack.append((n, 1, None))
+        stack.extend([(x, 0, None) for x in n.src[::-1] if x not in replace])
+      elif stage == 1:
+        new_src = tuple([replace[x] for x in n.src])
+        new_n = self.pm.rewrite(n, self.ctx) if new_src == n.src else UOp(n.op, n.dtype, new_src, n.arg)
+        if new_n is None: self._done(n, n)
+        elif new_n in replace: self._done(n, replace[new_n])
+        else: stack.extend([(n, 2, new_n), (new_n, 0, None)])
+      else: self._done(n, replace[nxt])
+    return replace[root]
+  def bottom_up_rewrite(self, root:UOp) -> UOp:
+    replace, stack = self.replace, cast(list[tuple[UOp, int, Any]], [(root, 0, None)])
+    while stack:
+      n, stage, nxt = stack.pop()
+      if stage == 0:
+        if n in replace or self._cached(n): continue
+        self.active.add(n)
+        new_n: UOp|None = n
+        while new_n is not None: last_n, new_n = new_n, self.pm.rewrite(new_n, self.ctx)
+        stack.append((n, 1, last_n))
+        stack.extend([(x, 0, None) for x in last_n.src[::-1] if x not in replace])
+      elif stage == 1:
+        new_src = tuple([replace[x] for x in nxt.src])
+        if new_src == nxt.src: self._done(n, nxt)
+        elif (new_n:=UOp(nxt.op, nxt.dtype, new_src, nxt.arg)) in replace: self._done(n, replace[new_n])
+        else: stack.extend([(n, 2, new_n), (new_n, 0, None)])
+      else: self._done(n, replace[nxt])
+    return replace[root]
 
 @track_matches
-def graph_rewrite(sink:UOp, pm:PatternMatcher, ctx=None, bottom_up=False, name=None) -> UOp:
-  rewrite_ctx = RewriteContext(pm, ctx)
+def graph_rewrite(sink:UOp, pm:PatternMatcher, ctx=None, bottom_up=False, name=None, memo=False) -> UOp:
+  rewrite_ctx = RewriteContext(pm, ctx, memo, bottom_up)
   return rewrite_ctx.bottom_up_rewrite(sink) if bottom_up else rewrite_ctx.top_down_rewrite(sink)
 
 @track_matches
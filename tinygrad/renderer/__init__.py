@@ -136,6 +136,8 @@ class Renderer:
   supports_float4: bool = True
   has_local: bool = True
   has_shared: bool = True
+  # when has_threads is set, the outermost global loop is split across global_max[0] cpu threads and the kernel takes a core_id
+  has_threads: bool = False
   # NOTE: these two should be in (x,y,z) order to match the max_sizes argument in get_grouped_dims
   global_max: Optional[tuple[int, ...]] = (0x8FFFFFFF,) * (3) # TODO: Ops.SPECIAL int32 indexes right now
   local_max: Optional[tuple[int, ...]] = (0x8FFFFFFF,) * (3) # TODO: Ops.SPECIAL int32 indexes right now
@@ -2,7 +2,7 @@ from typing import Optional, Union, Literal, Callable, cast
 import os, math, sys
 from collections import defaultdict, Counter
 from tinygrad.ops import GroupOp, Ops, UOp, PatternMatcher, UPat
-from tinygrad.helpers import strip_parens, getenv, prod, dedup, AMX
+from tinygrad.helpers import strip_parens, getenv, prod, dedup, AMX, THREADS
 from tinygrad.dtype import ImageDType, dtypes, DType, PtrDType
 from tinygrad.renderer import Renderer, TensorCore
 from tinygrad.codegen.devectorizer import no_vectorized_alu
@@ -180,7 +180,14 @@ class ClangRenderer(CStyleLanguage):
   device = "CPU"
   float4 = "(float4)"
   has_local = False
-  global_max = None
+  # THREADS is read when rendering, not at import, so it can be changed with Context
+  @property
+  def has_threads(self) -> bool: return THREADS > 1  # type: ignore[override]
+  @property
+  def global_max(self) -> Optional[tuple[int, ...]]: return (THREADS.value, 0, 0) if self.has_threads else None  # type: ignore[override]
+  @property
+  def extra_args(self) -> list[str]: return ["const int core_id"] if self.has_threads else []  # type: ignore[override]
+  code_for_workitem = {"g": lambda _: "core_id"}
   infinity = "__builtin_inff()"
   nan = '__builtin_nanf("")'
   amx_tc = [TensorCore(dims=(sz,sz,1), threads=1, elements_per_thread=(sz,sz,sz*sz), dtype_in=dt, dtype_out=dt, swizzle=(None,((),(4,5,6,7,0,1,2,3))),
@@ -4,7 +4,7 @@ from tinygrad.renderer import Renderer
 from tinygrad.renderer.cstyle import ClangRenderer, AMDRenderer
 from tinygrad.ops import UOp, PatternMatcher, UPat, Ops, GroupOp
 from tinygrad.dtype import dtypes, DType, PtrDType, truncate
-from tinygrad.helpers import prod, AMX
+from tinygrad.helpers import prod, AMX, THREADS
 
 def ldt(dt:DType):
   if dt.vcount > 1: return f"<{dt.vcount} x {ldt(dt.scalar())}>"
@@ -119,7 +119,11 @@ class LLVMRenderer(Renderer):
   supports_float4 = True
   has_local = False
   has_shared = False
-  global_max: tuple[int, ...] | None = None
+  # THREADS is read when rendering, not at import, so it can be changed with Context
+  @property
+  def has_threads(self) -> bool: return THREADS > 1  # type: ignore[override]
+  @property
+  def global_max(self) -> tuple[int, ...] | None: return (THREADS.value, 0, 0) if self.has_threads else None  # type: ignore[override]
   string_rewrite = base_rewrite + PatternMatcher([(UPat(Ops.WMMA, name="wmma"), render_wmma_amx)])
   if AMX: tensor_cores = ClangRenderer.amx_tc
 
@@ -171,6 +175,7 @@ class LLVMRenderer(Renderer):
         r[u] = f"%data{u.arg}" if u.op is Ops.DEFINE_GLOBAL else f"%{u.arg[0]}"
         # NOTE: MallocAllocator promises 0x20 alignment
         args.append(f"{ldt(u.dtype)}{' noalias align 32' if isinstance(u.dtype, PtrDType) else ''} {r[u]}")
+      elif u.op is Ops.SPECIAL and self.has_threads: r[u] = "%core_id"
       elif u.op == Ops.DEFINE_LOCAL:
         r[u] = f"@local_{u.arg}"
         assert isinstance(u.dtype, PtrDType)
@@ -198,6 +203,8 @@ class LLVMRenderer(Renderer):
               kernel.append(f"  %acc{vc} = phi {ldt(x.dtype)}" f"[{r[x]}, %loop_entry_{u.arg}], [{r[acc_to_assign[x]]}, %loop_latch_{u.arg}]")
               r[x] = f"%acc{vc}"
 
+    if self.has_threads: args.append("i32 %core_id")
+
     # output the function. chr(10) is '\n' (python < 3.12 doesn't support backslashes in f-strings)
     prg = f'''\
 define{(' '+self.abi) if self.abi is not None else ''} void @{name}({','.join(args)}) #0 {{
@@ -216,6 +223,7 @@ class AMDLLVMRenderer(LLVMRenderer):
   device = "AMD"
   has_local = True
   has_shared = True
+  has_threads = False
   shared_max = AMDRenderer.shared_max
   global_max = AMDRenderer.global_max
   tensor_cores = AMDRenderer.tensor_cores
@@ -1,5 +1,5 @@
 from typing import cast
-import itertools
+import itertools, ctypes
 from tinygrad.helpers import dedup, DEBUG, to_function_name
 from tinygrad.engine.jit import GraphRunner, GraphException
 from tinygrad.device import Buffer
@@ -20,14 +20,25 @@ class CPUGraph(GraphRunner):
             [(f"cbuf{i}", (dtypes.char.ptr(), False)) for i in range(len(self.base_bufs))] + \
             sorted([(f"{v.expr}", (dtypes.int, False)) for v in var_vals])
 
+    # with threads, every core runs batched and each kernel is split across the cores, with a spin barrier between kernels
+    self.threads = max([cast(CompiledRunner, ji.prg).p.launch_dims(var_vals)[0][0] for ji in jit_cache]) if device.renderer.has_threads else 1
+    self.barrier = (ctypes.c_int * 2)() if device.renderer.has_threads else None
+    if device.renderer.has_threads: targs += [("bar", (dtypes.int.ptr(), False)), ("core_id", (dtypes.int, False))]
+
     def render_arg(buf):
       if buf in input_rawbuffers: return f"arg{input_rawbuffers.index(buf)}"
       return f"({device.renderer.render_dtype(buf.dtype)}*)(cbuf{self.base_bufs.index(buf.base)} + {buf.offset})"
 
-    batched = ["void batched("+','.join([f"{device.renderer.render_dtype(x[1][0])} {x[0]}" for x in targs])+") {"]
+    batched, prev_threads = ["void batched("+','.join([f"{device.renderer.render_dtype(x[1][0])} {x[0]}" for x in targs])+") {"], 1
     for i, ji in enumerate(jit_cache):
       args = [render_arg(buf) for buf in ji.bufs] + [x.expr for x in cast(CompiledRunner, ji.prg).p.vars]
-      batched.append(f"  {to_function_name(cast(CompiledRunner, ji.prg).p.name)}({','.join(args)});")
+      call = f"{to_function_name(cast(CompiledRunner, ji.prg).p.name)}({','.join(args + (['core_id'] if device.renderer.has_threads else []))});"
+      if device.renderer.has_threads:
+        threads = cast(CompiledRunner, ji.prg).p.launch_dims(var_vals)[0][0]
+        # kernels that both only run on core 0 don't need to wait for each other
+        if i > 0 and max(threads, prev_threads) > 1: batched.append(f"  tg_barrier(bar, {self.threads});")
+        call, prev_threads = f"if (core_id < {threads}) {call}", threads
+      batched.append(f"  {call}")
     batched.append("}")
 
     prep = [device.renderer._render(cast(CompiledRunner, ji.prg).p.uops) for i,ji in enumerate(jit_cache)]
@@ -35,6 +46,13 @@ class CPUGraph(GraphRunner):
                   for i,ji in enumerate(jit_cache))
 
     defines = dedup(itertools.chain.from_iterable(device.renderer._render_defines(cast(CompiledRunner, ji.prg).p.uops) for ji in jit_cache))
+    if device.renderer.has_threads: defines.append("""static void tg_barrier(int *bar, int threads) {
+  int gen = __atomic_load_n(bar+1, __ATOMIC_ACQUIRE);
+  if (__atomic_add_fetch(bar, 1, __ATOMIC_ACQ_REL) == threads) {
+    __atomic_store_n(bar, 0, __ATOMIC_RELAXED);
+    __atomic_store_n(bar+1, gen+1, __ATOMIC_RELEASE);
+  } else while (__atomic_load_n(bar+1, __ATOMIC_ACQUIRE) == gen);
+}""")
     entry = device.renderer._render_entry("batched", targs)
     code = '\n'.join(defines) + '\n' + '\n'.join([''.join(f) for f in funcs]) + '\n'.join(batched) + '\n' + entry
 
@@ -42,4 +60,6 @@ class CPUGraph(GraphRunner):
     self.clprg = device.runtime("batched", device.compiler.compile_cached(code))
 
   def __call__(self, rawbufs: list[Buffer], var_vals: dict[Variable, int], wait=False):
-    return self.clprg(*[x._buf for x in rawbufs], *self.base_rawbufs, *[x[1] for x in sorted(var_vals.items(), key=lambda x: x[0].expr)], wait=wait)
+    args = [x._buf for x in rawbufs] + self.base_rawbufs + [x[1] for x in sorted(var_vals.items(), key=lambda x: x[0].expr)]
+    if self.barrier is None: return self.clprg(*args, wait=wait)
+    return self.clprg(*args, self.barrier, global_size=(self.threads, 1, 1), wait=wait)
@@ -8,8 +8,9 @@ from __future__ import annotations
 from typing import Optional, Any
 from collections import defaultdict
 from dataclasses import dataclass, field
-import multiprocessing, functools, http.client, hashlib, json, time, os, binascii, struct, ast, contextlib
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import multiprocessing, functools, http.client, hashlib, json, time, os, binascii, struct, ast, contextlib, threading, traceback, zlib, collections
+import concurrent.futures
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from tinygrad.renderer import Renderer
 from tinygrad.dtype import dtypes
 from tinygrad.helpers import getenv, DEBUG, fromimport, unwrap, Timing
@@ -76,46 +77,72 @@ class BatchRequest:
 class CloudSession:
   programs: dict[tuple[str, str], Any] = field(default_factory=dict)
   buffers: dict[int, Buffer] = field(default_factory=dict)
+  # batches run in the order the client numbered them, the last responses are kept so a retried batch isn't run twice
+  seq: int = 0
+  responses: dict[int, tuple[int, bytes]] = field(default_factory=dict)
+  cv: threading.Condition = field(default_factory=threading.Condition)
 
 class CloudHandler(BaseHTTPRequestHandler):
   protocol_version = 'HTTP/1.1'
   device: str
   sessions: defaultdict[str, CloudSession] = defaultdict(CloudSession)
+  # every connection is served on its own thread, the device is used by one batch at a time
+  device_lock = threading.Lock()
 
   def setup(self):
     super().setup()
     print(f"connection established with {self.client_address}, socket: {self.connection.fileno()}")
 
+  def _batch(self, session:CloudSession, req:BatchRequest) -> bytes:
+    ret: bytes|bytearray = b""
+    # the cmds are always last (currently in datahash)
+    for c in req._q:
+      if DEBUG >= 1: print(c)
+      match c:
+        case BufferAlloc():
+          assert c.buffer_num not in session.buffers, f"buffer {c.buffer_num} already allocated"
+          session.buffers[c.buffer_num] = Buffer(CloudHandler.device, c.size, dtypes.uint8, options=c.options, preallocate=True)
+        case BufferFree(): del session.buffers[c.buffer_num]
+        case CopyIn(): session.buffers[c.buffer_num].copyin(memoryview(bytearray(req._h[c.datahash])))
+        case CopyOut(): session.buffers[c.buffer_num].copyout(memoryview(ret:=bytearray(session.buffers[c.buffer_num].nbytes)))
+        case ProgramAlloc():
+          lib = Device[CloudHandler.device].compiler.compile_cached(req._h[c.datahash].decode())
+          session.programs[(c.name, c.datahash)] = Device[CloudHandler.device].runtime(c.name, lib)
+        case ProgramFree(): del session.programs[(c.name, c.datahash)]
+        case ProgramExec():
+          bufs = [session.buffers[x]._buf for x in c.bufs]
+          extra_args = {k:v for k,v in [("global_size", c.global_size), ("local_size", c.local_size)] if v is not None}
+          r = session.programs[(c.name, c.datahash)](*bufs, vals=c.vals, wait=c.wait, **extra_args)
+          if r is not None: ret = str(r).encode()
+    return bytes(ret)
+
   def _do(self, method):
     session = CloudHandler.sessions[unwrap(self.headers.get("Cookie")).split("session=")[1]]
     ret, status_code = b"", 200
     if self.path == "/batch" and method == "POST":
       # TODO: streaming deserialize?
-      req = BatchRequest().deserialize(self.rfile.read(int(unwrap(self.headers.get('Content-Length')))))
-      # the cmds are always last (currently in datahash)
-      for c in req._q:
-        if DEBUG >= 1: print(c)
-        match c:
-          case BufferAlloc():
-            assert c.buffer_num not in session.buffers, f"buffer {c.buffer_num} already allocated"
-            session.buffers[c.buffer_num] = Buffer(CloudHandler.device, c.size, dtypes.uint8, options=c.options, preallocate=True)
-          case BufferFree(): del session.buffers[c.buffer_num]
-          case CopyIn(): session.buffers[c.buffer_num].copyin(memoryview(bytearray(req._h[c.datahash])))
-          case CopyOut(): session.buffers[c.buffer_num].copyout(memoryview(ret:=bytearray(session.buffers[c.buffer_num].nbytes)))
-          case ProgramAlloc():
-            lib = Device[CloudHandler.device].compiler.compile_cached(req._h[c.datahash].decode())
-            session.programs[(c.name, c.datahash)] = Device[CloudHandler.device].runtime(c.name, lib)
-          case ProgramFree(): del session.programs[(c.name, c.datahash)]
-          case ProgramExec():
-            bufs = [session.buffers[x]._buf for x in c.bufs]
-            extra_args = {k:v for k,v in [("global_size", c.global_size), ("local_size", c.local_size)] if v is not None}
-            r = session.programs[(c.name, c.datahash)](*bufs, vals=c.vals, wait=c.wait, **extra_args)
-            if r is not None: ret = str(r).encode()
+      body = self.rfile.read(int(unwrap(self.headers.get('Content-Length'))))
+      if self.headers.get("Content-Encoding") == "zlib": body = zlib.decompress(body)
+      req, seq = BatchRequest().deserialize(body), int(self.headers.get("X-Seq", session.seq))
+      with session.cv:
+        session.cv.wait_for(lambda: session.seq >= seq)
+        if seq < session.seq: status_code, ret = session.responses.get(seq, (410, b"batch is too old to be retried"))
+        else:
+          with CloudHandler.device_lock:
+            try: ret = self._batch(session, req)
+            except Exception: status_code, ret = 500, traceback.format_exc().encode()
+          session.responses[seq] = (status_code, ret)
+          session.responses.pop(seq-64, None)
+          session.seq += 1
+          session.cv.notify_all()
     elif self.path == "/properties" and method == "GET":
       cls, args = Device[CloudHandler.device].renderer.__reduce__()
       ret = json.dumps({'clouddev': CloudHandler.device, 'renderer': (cls.__module__, cls.__name__, args)}).encode()
     else: status_code = 404
     self.send_response(status_code)
+    if self.headers.get("Accept-Encoding") == "zlib" and len(ret) >= 4096:
+      ret = zlib.compress(ret, 1)
+      self.send_header('Content-Encoding', 'zlib')
     self.send_header('Content-Length', str(len(ret)))
     self.end_headers()
     return self.wfile.write(ret)
@@ -126,7 +153,7 @@ class CloudHandler(BaseHTTPRequestHandler):
 def cloud_server(port:int):
   CloudHandler.device = getenv("CLOUDDEV", next(Device.get_available_devices()) if Device.DEFAULT == "CLOUD" else Device.DEFAULT)
   print(f"start cloud server on {port} with device {CloudHandler.device}")
-  server = HTTPServer(('', port), CloudHandler)
+  server = ThreadingHTTPServer(('', port), CloudHandler)
   server.serve_forever()
 
 # ***** frontend *****
@@ -145,7 +172,7 @@ class CloudAllocator(Allocator):
   def _copyin(self, dest:int, src:memoryview): self.device.req.q(CopyIn(dest, self.device.req.h(bytes(src))))
   def _copyout(self, dest:memoryview, src:int):
     self.device.req.q(CopyOut(src))
-    resp = self.device.batch_submit()
+    resp = self.device.batch_submit(wait=False).result()
     assert len(resp) == len(dest), f"buffer length mismatch {len(resp)} != {len(dest)}"
     dest[:] = resp
 
@@ -160,6 +187,56 @@ class CloudProgram:
   def __call__(self, *bufs, global_size=None, local_size=None, vals:tuple[int, ...]=(), wait=False):
     self.dev.req.q(ProgramExec(self.name, self.datahash, bufs, vals, global_size, local_size, wait))
     if wait: return float(self.dev.batch_submit())
+    # send while the link is idle instead of holding everything for the next copyout
+    if not self.dev.conn.busy(): self.dev.batch_submit(wait=False)
+
+class CloudTransport:
+  """
+  Sends the batches of a cloud session over a pool of keep-alive connections to the host.
+
+  Up to `depth` batches are in flight at once on their own connections and the server runs them in the order they were numbered.
+  Failed connections are retried with backoff, and payloads of 4 kB or more are zlib compressed at level `compress` (0 is off).
+  """
+  # idle connections per host, shared by every session
+  pools: defaultdict[str, list[http.client.HTTPConnection]] = defaultdict(list)
+
+  def __init__(self, host:str, session:str, depth:int=4, compress:int=0, retries:int=3):
+    self.host, self.compress, self.retries, self.seq = host, compress, retries, 0
+    self.headers = {"Cookie": f"session={session}"} | ({"Accept-Encoding": "zlib"} if compress else {})
+    self.executor = concurrent.futures.ThreadPoolExecutor(depth, thread_name_prefix="cloud")
+    self.inflight: collections.deque[concurrent.futures.Future[bytes]] = collections.deque()
+
+  def send(self, method:str, path:str, data:Optional[bytes]=None, headers:Optional[dict[str, str]]=None) -> bytes:
+    headers = self.headers | (headers or {})
+    if data is not None and self.compress and len(data) >= 4096:
+      data, headers = zlib.compress(data, self.compress), headers | {"Content-Encoding": "zlib"}
+    for i in range(self.retries+1):
+      try: conn = CloudTransport.pools[self.host].pop()
+      except IndexError: conn = http.client.HTTPConnection(self.host, timeout=60.0)
+      try:
+        conn.request(method, "/"+path, data, headers=headers)
+        response = conn.getresponse()
+        ret = response.read()
+        break
+      except (ConnectionError, http.client.HTTPException):
+        conn.close()
+        if i == self.retries: raise
+        time.sleep(0.01 * 2**i)
+    CloudTransport.pools[self.host].append(conn)
+    if response.getheader("Content-Encoding") == "zlib": ret = zlib.decompress(ret)
+    if response.status != 200: raise RuntimeError(f"failed on {method} {path} with {response.status}\n{ret.decode(errors='replace')}")
+    return ret
+
+  def submit(self, data:bytes) -> concurrent.futures.Future[bytes]:
+    # a failed batch nobody waited on fails the next submit
+    while self.inflight and self.inflight[0].done(): self.inflight.popleft().result()
+    self.inflight.append(fut:=self.executor.submit(self.send, "POST", "batch", data, {"X-Seq": str(self.seq)}))
+    self.seq += 1
+    return fut
+
+  def busy(self) -> bool: return any(not x.done() for x in self.inflight)
+  def wait(self):
+    while self.inflight: self.inflight.popleft().result()
 
 class CloudDevice(Compiled):
   def __init__(self, device:str):
@@ -174,10 +251,10 @@ class CloudDevice(Compiled):
     self.req: BatchRequest = BatchRequest()
 
     if DEBUG >= 1: print(f"cloud with host {self.host}")
+    self.conn = CloudTransport(self.host, self.session, getenv("CLOUD_PIPELINE", 4), getenv("CLOUD_COMPRESS", 0))
     while 1:
       try:
-        self.conn = http.client.HTTPConnection(self.host, timeout=60.0)
-        self.properties = json.loads(self.send("GET", "properties").decode())
+        self.properties = json.loads(self.conn.send("GET", "properties").decode())
         break
       except Exception as e:
         print(e)
@@ -193,20 +270,17 @@ class CloudDevice(Compiled):
   def __del__(self):
     # TODO: this is never being called
     # TODO: should close the whole session
-    with contextlib.suppress(ConnectionRefusedError, http.client.CannotSendRequest, http.client.RemoteDisconnected): self.batch_submit()
+    with contextlib.suppress(ConnectionError, http.client.HTTPException, RuntimeError): self.batch_submit(wait=False)
 
-  def batch_submit(self):
+  def batch_submit(self, wait=True):
     data = self.req.serialize()
     with Timing(f"*** send {len(self.req._q):-3d} requests {len(self.req._h):-3d} hashes with len {len(data)/1024:.2f} kB in ", enabled=DEBUG>=1):
-      ret = self.send("POST", "batch", data)
-    self.req = BatchRequest()
-    return ret
+      ret = self.conn.submit(data)
+      self.req = BatchRequest()
+      return ret.result() if wait else ret
 
-  def send(self, method, path, data:Optional[bytes]=None) -> bytes:
-    # TODO: retry logic
-    self.conn.request(method, "/"+path, data, headers={"Cookie": f"session={self.session}"})
-    response = self.conn.getresponse()
-    assert response.status == 200, f"failed on {method} {path}"
-    return response.read()
+  def synchronize(self):
+    if self.req._q: self.batch_submit(wait=False)
+    self.conn.wait()
 
 if __name__ == "__main__": cloud_server(getenv("PORT", 6667))
@@ -1,4 +1,4 @@
-import os, sys, mmap, io, ctypes, ctypes.util, contextlib
+import os, sys, mmap, io, ctypes, ctypes.util, contextlib, collections
 from typing import Optional, Generator, Callable
 from tinygrad.helpers import OSX, round_up
 from tinygrad.device import Compiled, Allocator
@@ -122,3 +122,60 @@ class DiskAllocator(Allocator):
         processed_reqs_cnt += 1
 
   def _offset(self, buf:DiskBuffer, size:int, offset:int): return DiskBuffer(buf.device, size, offset)
+
+class DiskReader:
+  """
+  Reads DiskBuffers into host memory with io_uring. All the reads can be submitted at once, they go through `depth` page aligned
+  staging buffers of `seg_len` bytes (O_DIRECT needs the alignment) so up to `depth` segments are in flight.
+  """
+  def __init__(self, depth:int=16, seg_len:int=1<<20):
+    assert hasattr(DiskDevice, 'io_uring'), "DiskReader requires io uring support"
+    self.ring, self.seg_len, self.staging = DiskDevice.io_uring, seg_len, mmap.mmap(-1, depth*seg_len)
+    self.staging_addr, self.free_slots = ctypes.addressof(ctypes.c_char.from_buffer(self.staging)), list(range(depth))
+    # (ticket, fd, file offset, dest, offset in dest, the bytes of the segment to skip, the bytes to copy)
+    self.pending: collections.deque[tuple[int, int, int, memoryview, int, int, int]] = collections.deque()
+    self.inflight: dict[int, tuple[int, memoryview, int, int, int]] = {}
+    self.remaining: dict[int, int] = {}
+    self.tickets = 0
+
+  def submit(self, src:DiskBuffer, dest:memoryview) -> int:
+    assert src.device.fd is not None, f"DiskReader reads files, not {src.device.device}"
+    assert dest.nbytes == src.size, f"can't read {src.size} bytes into {dest.nbytes}"
+    fd_offset = src.offset - (minor_offset := src.offset % mmap.PAGESIZE)
+    segs = [(off, minor_offset if off == 0 else 0) for off in range(0, round_up(src.size + minor_offset, mmap.PAGESIZE), self.seg_len)]
+    self.pending.extend((self.tickets, src.device.fd, fd_offset+off, dest.cast('B'), off+skip-minor_offset, skip,
+                         min(self.seg_len-skip, src.size-(off+skip-minor_offset))) for off,skip in segs)
+    self.remaining[self.tickets] = len(segs)
+    self._submit()
+    self.tickets += 1
+    return self.tickets - 1
+
+  def _submit(self):
+    submitted = 0
+    while self.pending and self.free_slots:
+      ticket, fd, off, dest, dest_off, skip, size = self.pending.popleft()
+      self.inflight[slot:=self.free_slots.pop()] = (ticket, dest, dest_off, skip, size)
+      sqe_index = (tail:=self.ring.sq.ktail[0]) & self.ring.sq.kring_mask[0]
+      ctypes.memset(ctypes.byref(sqe:=self.ring.sq.sqes[sqe_index]), 0, ctypes.sizeof(sqe))
+      sqe.opcode, sqe.fd, sqe.off, sqe.addr, sqe.user_data = io_uring.IORING_OP_READ, fd, off, self.staging_addr+slot*self.seg_len, slot
+      sqe.len = round_up(skip+size, mmap.PAGESIZE)
+      self.ring.sq.array[sqe_index] = sqe_index
+      self.ring.sq.ktail[0] = tail + 1
+      submitted += 1
+    if submitted: libc.syscall(io_uring.NR_io_uring_enter, self.ring.ring_fd, submitted, 0, 0)
+
+  def wait(self, ticket:int):
+    while self.remaining[ticket]:
+      if (head:=self.ring.cq.khead[0]) == self.ring.cq.ktail[0]:
+        libc.syscall(io_uring.NR_io_uring_enter, self.ring.ring_fd, 0, 1, io_uring.IORING_ENTER_GETEVENTS)
+        continue
+      cqe = self.ring.cq.cqes[head & self.ring.cq.kring_mask[0]]
+      slot, res = cqe.user_data, cqe.res
+      self.ring.cq.khead[0] = head + 1 # advance
+      t, dest, dest_off, skip, size = self.inflight.pop(slot)
+      assert res >= skip+size, f"read from disk failed, err: {res}"
+      dest[dest_off:dest_off+size] = memoryview(self.staging)[slot*self.seg_len+skip:slot*self.seg_len+skip+size]
+      self.remaining[t] -= 1
+      self.free_slots.append(slot)
+      self._submit()
+    del self.remaining[ticket]
@@ -2,10 +2,11 @@
 # a python uops emulator
 # works to test the tensor cores, and all the uops in general
 # this is the (living) definition of uops
-from typing import Optional, Any, TYPE_CHECKING
+from typing import Optional, Any, Callable, TYPE_CHECKING, cast
 import pickle, base64, itertools, time, struct, sys
-from tinygrad.dtype import DType, dtypes, ImageDType, PtrDType, truncate
-from tinygrad.helpers import all_same, getenv, flatten, get_single_element
+from dataclasses import dataclass, replace
+from tinygrad.dtype import DType, dtypes, ImageDType, PtrDType, truncate, _to_np_dtype
+from tinygrad.helpers import all_same, getenv, flatten, get_single_element, prod
 from tinygrad.device import Compiled, Compiler, Allocator
 from tinygrad.ops import exec_alu, Ops, UOp, GroupOp
 from tinygrad.renderer import Renderer
@@ -24,11 +25,73 @@ def _store(m, i, v):
   if i < 0 or i >= len(m): raise IndexError(f"store out of bounds, size is {len(m)}, access is {i}, value is {v}")
   m[i] = v
 
+def _same(a, b) -> bool: return bool((a == b).all()) if hasattr(a, "all") else a == b
+
+def wmma_layout(arg):
+  # here are the models for the WMMA instruction on the different hardware
+  # returns (WARP_THREADS, K, NUM_A, NUM_B, NUM_C, a_elem, b_elem, c_map)
+  # TODO: refactor these to a shared TensorCoreLayout in kernel.py
+  if arg[4] == "METAL":
+    # A (2 elements on 32 threads): row major
+    def a_b_elem(x, i, j, goff): return x[(i%2)][goff+(i//2)%2+(j%4)*2+(i//4)*8+(j//4)*16]
+    # (i, j), C, D (2 elements on 32 threads): row major same as A/B
+    def c_map(lane, elem): return (elem + ((lane%2)*2) + ((lane//8)%2)*4, ((lane//2)%4) + (lane//16)*4)
+    return 32, 8, 2, 2, 2, a_b_elem, a_b_elem, c_map
+  if arg[4] == "AMD" and arg[5] == 64:
+    def a_elem(x, k, row, goff): return x[k%4][goff + (k//4)*16 + row]
+    def b_elem(x, col, k, goff): return a_elem(x, k, col, goff) # pylint: disable=arguments-out-of-order
+    def c_map(lane, elem): return (lane%16, (lane//16)*4 + elem)
+    return 64, 16, 4, 4, 4, a_elem, b_elem, c_map
+  if arg[4] == "AMD":
+    # A (16 elements on 32 threads): col major, lane 16-32 == lane 0-15
+    def a_elem(x, k, row, goff):
+      assert _same(x[k][goff+row], x[k][goff+row+16]), "warp elements not duplicated properly across lanes"
+      return x[k][goff+row]
+    # B (16 elements on 32 threads): row major, lane 16-32 == lane 0-15
+    def b_elem(x, col, k, goff): return a_elem(x, k, col, goff)  # pylint: disable=arguments-out-of-order
+    def c_map(lane, elem): return (lane%16, lane//16+elem*2) # (i, j), C, D (8 elements on 32 threads): row major
+    return 32, 16, 16, 16, 8, a_elem, b_elem, c_map
+  if arg[4] == "CUDA":
+    # (col, row) given (lane, elem) for C & D (4 elements on 32 threads); shared by all tc shapes with M=16 N=8
+    def c_map(lane, elem): return (elem%2 + (lane%4)*2, lane//4 + (elem//2)*8)
+    if arg[1] == (8,16,16):
+      def a_elem(x, k, row, goff): return x[k%2 + (row//8)*2 + (k//8)*4][goff + (k//2)%4 + (row%8)*4]
+      def b_elem(x, col, k, goff): return x[k%2 + (k//8)*2][goff + (k//2)%4 + col*4]
+      return 32, 16, 8, 4, 4, a_elem, b_elem, c_map
+    if arg[1] == (8,16,8) and arg[2] == dtypes.half:
+      def a_elem(x, k, row, goff): return x[k%2 + (row//8)*2][goff + k//2 + (row%8)*4]
+      def b_elem(x, col, k, goff): return x[k%2][goff + k//2 + col*4]
+      return 32, 8, 4, 2, 4, a_elem, b_elem, c_map
+    if arg[1] == (8,16,8) and arg[2] == dtypes.float:
+      def a_elem(x, k, row, goff): return x[(k//4)*2 + row//8][goff + k%4 + (row%8)*4]
+      def b_elem(x, col, k, goff): return x[k//4][goff + k%4 + col*4]
+      return 32, 8, 4, 2, 4, a_elem, b_elem, c_map
+    raise NotImplementedError(f"unimplemented tensor core {arg}")
+  if arg[4] == "INTEL":
+    # A (16 elements on 8 threads)
+    def a_elem(x, k, row, goff): return x[k%2+row*2][goff+k//2]
+    # B (16 elements on 8 threads)
+    def b_elem(x, col, k, goff): return x[k][goff+col]
+    # C, D (8 elements on 8 threads)
+    def c_map(lane, elem): return (lane, elem)
+    return 8, 16, 16, 16, 8, a_elem, b_elem, c_map
+  if arg[4] == "CPU":
+    def elem(x, col, row, _): return x[col+row][0] # k is always 0
+    def c_map(_, elem): return (elem%16, elem//16)
+    return 1, 1, 16, 16, 256, elem, elem, c_map
+  raise NotImplementedError(f"unimplemented tensor core {arg}")
+
 class PythonProgram:
   def __init__(self, name:str, lib:bytes):
     self.uops: list[tuple[Ops, Optional[DType], list[int], Any]] = pickle.loads(lib)
+    # bfloat16 and fp8 don't have numpy types
+    self.numpy = getenv("PYTHON_NUMPY") and all(dt is None or dt == dtypes.void or (dt.base if isinstance(dt, PtrDType) else dt).scalar().fmt
+                                                is not None for _,dt,_,_ in self.uops)
   def __call__(self, *bufs, global_size:tuple[int,int,int]=(1,1,1), local_size:tuple[int,int,int]=(1,1,1), vals:tuple[int, ...]=(), wait=False):
     st = time.perf_counter()
+    if self.numpy:
+      run_numpy(self.uops, bufs, global_size, local_size, vals)
+      return time.perf_counter() - st
     warp = list(itertools.product(*[range(x) for x in local_size[::-1]]))
     warp_size = len(warp)
     for idxs in itertools.product(*[range(x) for x in global_size[::-1]]):
@@ -115,74 +178,18 @@ class PythonProgram:
           ul[i] = inp[0]
         elif uop is Ops.GEP: ul[i] = inp[0][get_single_element(arg)]
         elif uop is Ops.WMMA:
-          # here are the models for the WMMA instruction on the different hardware
-          def wmma_helper(WARP_THREADS, K, NUM_A, NUM_B, NUM_C, a_elem, b_elem, c_map):
-            for cc, tinp, num in zip(("A", "B", "C"), inp, (NUM_A, NUM_B, NUM_C)):
-              assert len(tinp) == num, f"{cc} must have {num} elements per thread, it has {len(tinp)}"
-              assert len(flatten(tinp)) == num * warp_size, f"WMMA must have {num * warp_size} total elements for {cc} in WMMA"
-            assert warp_size > 0 and warp_size % WARP_THREADS == 0, f"must have multiples of {WARP_THREADS} warp threads"
-            out = [inp[2][elem_idx][:] for elem_idx in range(NUM_C)]
-            for goff in range(0, warp_size, WARP_THREADS):
-              for lane_id in range(WARP_THREADS):
-                for elem_idx in range(NUM_C): # calculate new muls and add to acc
-                  (c_i, c_j) = c_map(lane_id, elem_idx)
-                  out[elem_idx][goff+lane_id] += sum(a_elem(inp[0], _k, c_j, goff) * b_elem(inp[1], c_i, _k, goff) for _k in range(K))
-            return out
-
-          # TODO: refactor these to a shared TensorCoreLayout in kernel.py
-          if arg[4] == "METAL":
-            # A (2 elements on 32 threads): row major
-            def a_b_elem(x, i, j, goff): return x[(i%2)][goff+(i//2)%2+(j%4)*2+(i//4)*8+(j//4)*16]
-            # (i, j), C, D (2 elements on 32 threads): row major same as A/B
-            def c_map(lane, elem): return (elem + ((lane%2)*2) + ((lane//8)%2)*4, ((lane//2)%4) + (lane//16)*4)
-            ul[i] = wmma_helper(32, 8, 2, 2, 2, a_b_elem, a_b_elem, c_map)
-          elif arg[4] == "AMD" and arg[5] == 64:
-            def a_elem(x, k, row, goff): return x[k%4][goff + (k//4)*16 + row]
-            def b_elem(x, col, k, goff): return a_elem(x, k, col, goff) # pylint: disable=arguments-out-of-order
-            def c_map(lane, elem): return (lane%16, (lane//16)*4 + elem)
-            ul[i] = wmma_helper(64, 16, 4, 4, 4, a_elem, b_elem, c_map)
-          elif arg[4] == "AMD":
-            # A (16 elements on 32 threads): col major, lane 16-32 == lane 0-15
-            def a_elem(x, k, row, goff):
-              assert x[k][goff+row] == x[k][goff+row+16], "warp elements not duplicated properly across lanes"
-              return x[k][goff+row]
-            # B (16 elements on 32 threads): row major, lane 16-32 == lane 0-15
-            def b_elem(x, col, k, goff): return a_elem(x, k, col, goff)  # pylint: disable=arguments-out-of-order
-            def c_map(lane, elem): return (lane%16, lane//16+elem*2) # (i, j), C, D (8 elements on 32 threads): row major
-            ul[i] = wmma_helper(32, 16, 16, 16, 8, a_elem, b_elem, c_map)
-          elif arg[4] == "CUDA":
-            # (col, row) given (lane, elem) for C & D (4 elements on 32 threads); shared by all tc shapes with M=16 N=8
-            def c_map(lane, elem): return (elem%2 + (lane%4)*2, lane//4 + (elem//2)*8)
-
-            if arg[1] == (8,16,16):
-              def a_elem(x, k, row, goff): return x[k%2 + (row//8)*2 + (k//8)*4][goff + (k//2)%4 + (row%8)*4]
-              def b_elem(x, col, k, goff): return x[k%2 + (k//8)*2][goff + (k//2)%4 + col*4]
-              ul[i] = wmma_helper(32, 16, 8, 4, 4, a_elem, b_elem, c_map)
-
-            elif arg[1] == (8,16,8) and arg[2] == dtypes.half:
-              def a_elem(x, k, row, goff): return x[k%2 + (row//8)*2][goff + k//2 + (row%8)*4]
-              def b_elem(x, col, k, goff): return x[k%2][goff + k//2 + col*4]
-              ul[i] = wmma_helper(32, 8, 4, 2, 4, a_elem, b_elem, c_map)
-
-            elif arg[1] == (8,16,8) and arg[2] == dtypes.float:
-              def a_elem(x, k, row, goff): return x[(k//4)*2 + row//8][goff + k%4 + (row%8)*4]
-              def b_elem(x, col, k, goff): return x[k//4][goff + k%4 + col*4]
-              ul[i] = wmma_helper(32, 8, 4, 2, 4, a_elem, b_elem, c_map)
-
-            else: raise NotImplementedError(f"unimplemented tensor core {arg}")
-          elif arg[4] == "INTEL":
-            # A (16 elements on 8 threads)
-            def a_elem(x, k, row, goff): return x[k%2+row*2][goff+k//2]
-            # B (16 elements on 8 threads)
-            def b_elem(x, col, k, goff): return x[k][goff+col]
-            # C, D (8 elements on 8 threads)
-            def c_map(lane, elem): return (lane, elem)
-            ul[i] = wmma_helper(8, 16, 16, 16, 8, a_elem, b_elem, c_map)
-          elif arg[4] == "CPU":
-            def elem(x, col, row, _): return x[col+row][0] # k is always 0
-            def c_map(_, elem): return (elem%16, elem//16)
-            ul[i] = wmma_helper(1, 1, 16, 16, 256, elem, elem, c_map)
-          else: raise NotImplementedError(f"unimplemented tensor core {arg}")
+          WARP_THREADS, K, NUM_A, NUM_B, NUM_C, a_elem, b_elem, c_map = wmma_layout(arg)
+          for cc, tinp, num in zip(("A", "B", "C"), inp, (NUM_A, NUM_B, NUM_C)):
+            assert len(tinp) == num, f"{cc} must have {num} elements per thread, it has {len(tinp)}"
+            assert len(flatten(tinp)) == num * warp_size, f"WMMA must have {num * warp_size} total elements for {cc} in WMMA"
+          assert warp_size > 0 and warp_size % WARP_THREADS == 0, f"must have multiples of {WARP_THREADS} warp threads"
+          out = [inp[2][elem_idx][:] for elem_idx in range(NUM_C)]
+          for goff in range(0, warp_size, WARP_THREADS):
+            for lane_id in range(WARP_THREADS):
+              for elem_idx in range(NUM_C): # calculate new muls and add to acc
+                (c_i, c_j) = c_map(lane_id, elem_idx)
+                out[elem_idx][goff+lane_id] += sum(a_elem(inp[0], _k, c_j, goff) * b_elem(inp[1], c_i, _k, goff) for _k in range(K))
+          ul[i] = out
         elif uop in GroupOp.ALU:
           assert all_same([len(x) for x in inp]), f"{[len(x) for x in inp]} doesn't match on {uop}"
           assert all_same([dtype] + dtp) or uop in {Ops.CMPNE, Ops.CMPLT, Ops.WHERE}, f"dtype mismatch on {uop}"
@@ -191,6 +198,153 @@ class PythonProgram:
         i += 1
     return time.perf_counter() - st
 
+# ***** PYTHON_NUMPY=1: every uop runs on all lanes of the launch grid at once as numpy arrays *****
+# lane n is thread n%W of workgroup n//W, the order the interpreter above runs them in
+# a value is an array over the lanes, a vector is a list of those and a pointer is a _NpPtr
+# control flow is uniform across lanes like in the interpreter: RANGE bounds come from lane 0 and IF is handled by the gates
+
+@dataclass
+class _NpPtr:
+  buf: Any                # the whole numpy buffer, DEFINE_LOCALs hold one copy per workgroup
+  base: Any               # per lane offset of the lane's copy
+  size: int               # elements in one copy
+  idx: Any = None
+  gate: Any = None
+  valid: Any = None       # False for image reads out of the image
+
+def _np_check(p:_NpPtr, idx, mask, op:str):
+  if len(bad:=idx[(idx < 0) | (idx >= p.size)] if mask is None else idx[mask & ((idx < 0) | (idx >= p.size))]):
+    raise IndexError(f"{op} out of bounds, size is {p.size} and access is {bad[0]}")
+
+def _np_load(p:_NpPtr, j:int, alt=None):
+  import numpy as np
+  mask = p.valid if alt is None else p.gate if p.valid is None else p.gate & p.valid
+  _np_check(p, idx:=p.idx+j, mask, "load")
+  ret = p.buf[p.base + (idx if mask is None else np.where(mask, idx, 0))]
+  if p.valid is not None: ret = np.where(p.valid, ret, 0)
+  return ret if alt is None else np.where(p.gate, ret, alt)
+
+def _np_store(p:_NpPtr, j:int, val):
+  _np_check(p, idx:=p.idx+j, p.gate, "store")
+  if p.gate is None: p.buf[p.base + idx] = val
+  else: p.buf[(p.base + idx)[p.gate]] = val[p.gate]
+
+def _np_wide(x):
+  import numpy as np
+  return x if x.dtype.kind == "b" else x.astype({"f": np.float64, "i": np.int64, "u": np.uint64}[x.dtype.kind])
+
+def _np_alu(op:Ops, dtype:DType, inp:list):
+  import numpy as np
+  if dtype.count > 1: return [_np_alu(op, dtype.scalar(), [x[k] if isinstance(x, list) else x for x in inp]) for k in range(dtype.count)]
+  if op is Ops.WHERE: return np.where(inp[0], inp[1], inp[2])
+  # like exec_alu, compute in 64 bits and truncate to the dtype after
+  x = [_np_wide(v) for v in inp]
+  with np.errstate(all="ignore"):
+    if op is Ops.CMPLT: return x[0] < x[1]
+    if op is Ops.CMPNE: return x[0] != x[1]
+    if op in {Ops.IDIV, Ops.MOD}:
+      y = np.where(x[1] == 0, 1, x[1])
+      q = np.where(x[1] == 0, 0, (np.abs(x[0]) // np.abs(y)) * np.where((x[0] < 0) != (x[1] < 0), -1, 1).astype(x[0].dtype))
+      ret = q if op is Ops.IDIV else x[0] - q * x[1]
+    elif op is Ops.NEG: ret = x[0] if x[0].dtype.kind == "b" else -x[0]
+    elif op is Ops.MAX: ret = np.maximum(x[0], x[1])
+    elif op is Ops.MULACC: ret = x[0] * x[1] + x[2]
+    elif op is Ops.RECIP: ret = 1 / x[0]
+    else:
+      fxns: dict[Ops, Callable] = {Ops.LOG2: np.log2, Ops.EXP2: lambda x: np.power(2.0, x), Ops.SQRT: np.sqrt, Ops.SIN: np.sin, Ops.POW: np.power,
+        Ops.ADD: np.add, Ops.SUB: np.subtract, Ops.MUL: np.multiply, Ops.XOR: np.bitwise_xor, Ops.OR: np.bitwise_or, Ops.AND: np.bitwise_and,
+        Ops.SHR: np.right_shift, Ops.SHL: np.left_shift}
+      ret = fxns[op](*x)
+    return ret.astype(_to_np_dtype(dtype))
+
+def _np_cast(x, dtype:DType):
+  import numpy as np
+  if isinstance(x, list): return [_np_cast(v, dtype.scalar()) for v in x]
+  with np.errstate(all="ignore"):
+    if dtypes.is_int(dtype) and x.dtype.kind == "f": x = np.trunc(x).astype(np.int64)
+    return (x != 0) if dtype == dtypes.bool else x.astype(_to_np_dtype(dtype))
+
+def _np_wmma(arg, inp:list):
+  import numpy as np
+  WARP_THREADS, K, _, _, NUM_C, a_elem, b_elem, c_map = wmma_layout(arg)
+  # put the warp lanes first, so each lane of the layout indexes all the warps at once
+  a, b = [[x.astype(np.float64).reshape(-1, WARP_THREADS).T for x in v] for v in inp[:2]]
+  out = [x.reshape(-1, WARP_THREADS).T.copy() for x in inp[2]]
+  for lane_id in range(WARP_THREADS):
+    for elem_idx in range(NUM_C):
+      (c_i, c_j) = c_map(lane_id, elem_idx)
+      out[elem_idx][lane_id] += sum(a_elem(a, _k, c_j, 0) * b_elem(b, c_i, _k, 0) for _k in range(K))
+  return [x.T.reshape(-1) for x in out]
+
+def run_numpy(uops:list[tuple[Ops, Optional[DType], list[int], Any]], bufs, global_size, local_size, vals):
+  import numpy as np
+  G, W = prod(global_size), prod(local_size)
+  gidx, lidx = np.indices(global_size[::-1]).reshape(3, -1), np.indices(local_size[::-1]).reshape(3, -1)
+  ul: dict[int, Any] = {}
+  pbufs, pvals = list(bufs), list(vals)
+  i = 0
+  loop_ends: dict[int, int] = {}
+  void_ops = {Ops.STORE, Ops.ENDRANGE, Ops.BARRIER, Ops.IF, Ops.ENDIF, Ops.SINK}
+  while i < len(uops):
+    uop, _dtype, idp, arg = uops[i]
+    dtype = cast(DType, _dtype)
+    if uop is Ops.DEFINE_ACC: idp = [idp[0]]
+    inp = [ul[v] for v in idp if uops[v][0] not in void_ops]
+    dtp = [cast(DType, uops[v][1]) for v in idp if uops[v][0] not in void_ops]
+    if uop is Ops.STORE:
+      if dtp[1].count > 1:
+        for j,val in enumerate(inp[1]): _np_store(inp[0], j, val)
+      else: _np_store(inp[0], 0, inp[1])
+    elif uop is Ops.ENDRANGE:
+      loop_ends[idp[0]] = i
+      i = idp[0]
+      continue
+    elif uop in {Ops.BARRIER, Ops.IF, Ops.ENDIF, Ops.SINK}: pass
+    elif uop is Ops.DEFINE_GLOBAL:
+      ul[i] = _NpPtr(buf:=np.frombuffer(pbufs.pop(0), _to_np_dtype(dtype.base)), 0, len(buf))
+    elif uop is Ops.DEFINE_LOCAL:
+      sz = cast(PtrDType, dtype).size
+      ul[i] = _NpPtr(np.zeros(G*sz, _to_np_dtype(dtype.base)), np.repeat(np.arange(G)*sz, W), sz)
+    elif uop is Ops.DEFINE_VAR: ul[i] = np.full(G*W, pvals.pop(0), _to_np_dtype(dtype))
+    elif uop is Ops.SPECIAL:
+      ul[i] = np.repeat(gidx[2-int(arg[0][-1])], W) if arg[0][0] == 'g' else np.tile(lidx[2-int(arg[0][-1])], G)
+    elif uop is Ops.CONST:
+      tr, np_dt = truncate.get(dtype.scalar(), lambda x: x), _to_np_dtype(dtype.scalar())
+      cs = [np.full(G*W, tr(a), np_dt) for a in (arg if isinstance(arg, tuple) else (arg,))]
+      ul[i] = cs[0] if dtype.count == 1 else cs if len(cs) > 1 else cs * dtype.count
+    elif uop is Ops.DEFINE_ACC: ul[i] = [x.copy() for x in inp[0]] if dtype.count > 1 else inp[0].copy()
+    elif uop is Ops.INDEX:
+      if isinstance(dtp[0], ImageDType):
+        ox, oy = inp[1]
+        valid = (ox >= 0) & (ox < dtp[0].shape[1]) & (oy >= 0) & (oy < dtp[0].shape[0])
+        ul[i] = replace(inp[0], idx=(ox*4 + oy*dtp[0].shape[1]*4).astype(np.int64), valid=valid)
+      else: ul[i] = replace(inp[0], idx=inp[1].astype(np.int64))
+      if len(inp) == 3: ul[i].gate = inp[2]
+    elif uop is Ops.CAST and isinstance(dtype, PtrDType): ul[i] = inp[0]
+    elif uop is Ops.RANGE:
+      if i not in ul: ul[i] = inp[0].copy()
+      else:
+        ul[i] += 1
+        if ul[i][0] == inp[1][0]:
+          del ul[i]
+          i = loop_ends[i] + 1
+          continue
+    elif uop is Ops.VECTORIZE: ul[i] = inp
+    elif uop is Ops.BITCAST: ul[i] = inp[0].view(_to_np_dtype(dtype))
+    elif uop is Ops.CAST: ul[i] = _np_cast(inp[0], dtype)
+    elif uop is Ops.LOAD:
+      alt = inp[1] if len(inp) == 2 else None
+      if dtype.count > 1: ul[i] = [_np_load(inp[0], j, alt[j] if isinstance(alt, list) else alt) for j in range(dtype.count)]
+      else: ul[i] = _np_load(inp[0], 0, alt)
+    elif uop is Ops.ASSIGN:
+      for dst,src in zip(inp[0], inp[1]) if isinstance(inp[0], list) else [(inp[0], inp[1])]: dst[:] = src
+      ul[i] = inp[0]
+    elif uop is Ops.GEP: ul[i] = inp[0][get_single_element(arg)]
+    elif uop is Ops.WMMA: ul[i] = _np_wmma(arg, inp)
+    elif uop in GroupOp.ALU: ul[i] = _np_alu(uop, dtype, inp)
+    else: raise NotImplementedError(f"{uop} is not supported with PYTHON_NUMPY")
+    i += 1
+
 class PythonRenderer(Renderer):
   device = "PYTHON"
   def __init__(self):
@@ -6,7 +6,7 @@ from typing import Callable, ClassVar, Sequence, cast, get_args, Literal, Suppor
 from tinygrad.dtype import DType, DTypeLike, dtypes, ImageDType, ConstType, least_upper_float, least_upper_dtype, sum_acc_dtype, to_dtype, truncate
 from tinygrad.dtype import _from_np_dtype, _to_np_dtype
 from tinygrad.helpers import argfix, make_tuple, flatten, prod, all_int, round_up, merge_dicts, argsort, getenv, all_same, fully_flatten, dedup
-from tinygrad.helpers import IMAGE, WINO, Metadata, TRACEMETA, ceildiv, fetch, polyN, unwrap
+from tinygrad.helpers import IMAGE, WINO, FLASH_ATTENTION, Metadata, TRACEMETA, ceildiv, fetch, polyN, unwrap
 from tinygrad.engine.multi import get_multi_map
 from tinygrad.gradient import compute_gradient
 from tinygrad.ops import smax, smin, resolve, UOp, Ops, sint, Variable, SimpleMathTrait, identity_element, all_metadata
@@ -14,7 +14,7 @@ from tinygrad.spec import tensor_uop_spec, type_verify
 from tinygrad.device import Device, Buffer
 from tinygrad.engine.realize import run_schedule
 from tinygrad.engine.memory import memory_planner
-from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars
+from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars, schedule_cache_key, schedule_cache, cache_schedule
 from tinygrad.engine.grouper import get_becomes_map
 
 # *** all in scope Tensors are here. this gets relevant UOps ***
@@ -254,9 +254,19 @@ class Tensor(SimpleMathTrait):
 
     NOTE: A Tensor can only be scheduled once.
     """
-    self.kernelize(*lst)
+    big_sink = UOp.sink(*[x.lazydata for x in (self,)+lst])
+    if (ck:=schedule_cache_key(big_sink)) is not None and (cached:=schedule_cache.get(ck.key)) is not None:
+      # same graph structure as one scheduled before, only rebind the buffers
+      schedule, var_vals, becomes_map = cached.rebind(ck)
+      _apply_map_to_tensors(becomes_map, name="Apply Schedule Cache Map")
+      return memory_planner(schedule), var_vals
+    if ck is None: self.kernelize(*lst)
+    else:
+      if __debug__: type_verify(list(big_sink.toposort()), tensor_uop_spec)
+      _apply_map_to_tensors(kernelize_map:=get_becomes_map(big_sink), name="Apply Kernelize Map")
     schedule, var_vals, becomes_map = create_schedule_with_vars(UOp.sink(*[x.lazydata for x in (self,)+lst]))
     _apply_map_to_tensors(becomes_map, name="Apply Schedule Map")
+    if ck is not None: cache_schedule(ck, kernelize_map, becomes_map, schedule, var_vals)
     return memory_planner(schedule), var_vals
 
   def schedule(self, *lst:Tensor) -> list[ScheduleItem]:
@@ -2411,11 +2421,12 @@ class Tensor(SimpleMathTrait):
     axis = self._resolve_dim(axis)
     if self.ndim == 0 or 0 in self.shape: return self
     # TODO: someday the optimizer will find this on it's own
-    # for now this is a two stage cumsum
-    SPLIT = 256
-    if not isinstance(s:=self.shape[axis], int) or s <= SPLIT*2: return self._cumalu(axis, op)
+    # for now this is a blocked scan: scan inside blocks of SPLIT, scan the block totals the same way and combine them
+    # that's O(n*SPLIT) work in log_SPLIT(n) levels, short axes stay a single O(n^2) kernel
+    SPLIT = 32
+    if not isinstance(s:=self.shape[axis], int) or s <= 512: return self._cumalu(axis, op)
     ret = self.transpose(axis,-1).pad((round_up(s, SPLIT)-s, 0), value=identity_element(op, self.dtype)).unflatten(-1, (-1, SPLIT))._cumalu(-1, op)
-    base = ret[..., -1]._cumalu(-1, op, _include_initial=True)
+    base = ret[..., -1]._split_cumalu(-1, op).pad((1, -1), value=identity_element(op, self.dtype))
     base = base.unsqueeze(-1).expand(*base.shape, ret.shape[-1])
     def fix(x: Tensor) -> Tensor: return x.flatten(start_dim=-2)[..., -s:].transpose(axis,-1)
     return {Ops.ADD: Tensor.__add__, Ops.MAX: Tensor.maximum, Ops.MUL: Tensor.__mul__}[op](fix(ret), fix(base))
@@ -2659,38 +2670,37 @@ class Tensor(SimpleMathTrait):
     print(indices.numpy())
     ```
     """
-    x, dim = self, self._resolve_dim(dim)
-    # pad to power of 2
-    orig_len = x.shape[dim]
-    n_stages = math.ceil(math.log2(orig_len))
-    fill_value = dtypes.min(x.dtype) if descending else dtypes.max(x.dtype)
-    pads = tuple((0, 2**n_stages - orig_len) if i == dim else None for i in range(x.ndim))
-    x = x.pad(pads, value=fill_value).unflatten(dim, (2,)*n_stages)
+    x = self.transpose(dim:=self._resolve_dim(dim), -1)
+    # pad to power of 2, indices of the padding are past the end so they lose every tie
+    orig_len = x.shape[-1]
+    n_stages = math.ceil(math.log2(orig_len)) if orig_len > 1 else 0
+    x = x.pad((0, 2**n_stages - orig_len), value=dtypes.min(x.dtype) if descending else dtypes.max(x.dtype))
+    x, idx = Tensor._bitonic(x, Tensor.arange(2**n_stages, requires_grad=False, device=self.device).expand(x.shape), n_stages, descending, 1)
+    return x[..., :orig_len].transpose(dim, -1), idx[..., :orig_len].transpose(dim, -1)
+
+  @staticmethod
+  def _bitonic_first(x_a:Tensor, idx_a:Tensor, x_b:Tensor, idx_b:Tensor, descending:bool) -> Tensor:
+    # (value, index) is a total order, ties go to the lower index so the sort is stable
+    return ((x_a > x_b) if descending else (x_a < x_b)) | ((x_a == x_b) & (idx_a < idx_b))
+
+  @staticmethod
+  def _bitonic(x:Tensor, idx:Tensor, n_stages:int, descending:bool, first_stage:int) -> tuple[Tensor, Tensor]:
+    # sorts every block of 2**n_stages along the last axis, the indices are swapped along with the values
     # https://en.wikipedia.org/wiki/Bitonic_sorter#/media/File:BitonicSort1.svg
-    for stage in range(1, n_stages+1):
-      if stage != n_stages:
-        # flip so arrows of green boxes point the same way as blue boxes
-        crossover_dim = dim + n_stages - stage - 1
-        blue_box, green_box = x.split(1, crossover_dim)
-        flip_dims = tuple(-i for i in range(1, stage+1+(self.ndim-dim)))
-        x = (blue_box.cat(green_box.flip(flip_dims), dim=crossover_dim)).contiguous()
+    # wire pairs are viewed as (..., -1, 2, d) and the partner is a flip, so there are no splits and concatenations
+    is_first = Tensor.arange(2, device=x.device).reshape(2, 1) == 0
+    def pairs(t:Tensor, d:int) -> Tensor: return t.reshape(t.shape[:-1]+(-1, 2, d))
+    def crossover(t:Tensor, stage:int) -> Tensor: return is_first.where(p:=pairs(t, 2**stage), p.flip(-1)).reshape(t.shape)
+    for stage in range(first_stage, n_stages+1):
+      # flip so arrows of green boxes point the same way as blue boxes
+      if stage != n_stages: x, idx = crossover(x, stage), crossover(idx, stage)
       for substage in range(stage-1, -1, -1):
-        partner_dim = dim + n_stages - substage - 1
-        x_top, x_bottom = x.split(1, partner_dim)
-        x_larger, x_smaller = x_top.maximum(x_bottom), x_top.minimum(x_bottom)
-        x = (x_larger.cat(x_smaller, dim=partner_dim) if descending else x_smaller.cat(x_larger, dim=partner_dim)).contiguous()
-      if stage != n_stages:
-        # flip wires back to undo the crossover
-        blue_box, flipped_green_box = x.split(1, crossover_dim)
-        x = blue_box.cat(flipped_green_box.flip(flip_dims), dim=crossover_dim)
-    x = x.flatten(dim, dim+n_stages-1).shrink(tuple((0, orig_len) if i == dim else None for i in range(x.ndim)))
-    # compute indices for sorted values
-    idx = Tensor.arange(orig_len, requires_grad=False, device=self.device).reshape(tuple(orig_len if i == dim else 1 for i in range(x.ndim)))
-    idx = idx.expand(x.shape)
-    def compute_counts(t:Tensor): return ((idx.unsqueeze(dim) <= idx.unsqueeze(dim+1)) & (t.unsqueeze(dim) == t.unsqueeze(dim+1))).sum(dim+1)
-    count_orig, count_sorted = compute_counts(self), compute_counts(x)
-    cond = (self.unsqueeze(dim+1) == x.unsqueeze(dim)) & (count_orig.unsqueeze(dim+1) == count_sorted.unsqueeze(dim))
-    idx = (cond * idx.unsqueeze(dim+1)).sum(dim)
+        x_self, idx_self = pairs(x, 2**substage), pairs(idx, 2**substage)
+        x_partner, idx_partner = x_self.flip(-2), idx_self.flip(-2)
+        keep = Tensor._bitonic_first(x_self, idx_self, x_partner, idx_partner, descending) == is_first
+        x, idx = keep.where(x_self, x_partner).reshape(x.shape).contiguous(), keep.where(idx_self, idx_partner).reshape(idx.shape).contiguous()
+      # flip wires back to undo the crossover
+      if stage != n_stages: x, idx = crossover(x, stage), crossover(idx, stage)
     return x, idx
 
   def topk(self, k:int, dim:int=-1, largest:bool=True, sorted_:bool=True) -> tuple[Tensor, Tensor]:
@@ -2711,9 +2721,23 @@ class Tensor(SimpleMathTrait):
     """
     if not sorted_: raise NotImplementedError("topk with sorted_=False is not supported")
     if k > self.shape[dim:=self._resolve_dim(dim)]: raise ValueError(f"selected index {k=} is out of range")
-    x, idx = self.sort(dim, descending=largest)
-    shrink_to_k = tuple((0, k) if i == dim else None for i in range(self.ndim))
-    return x.shrink(shrink_to_k), idx.shrink(shrink_to_k)
+    # selection: sort blocks of K >= k, then merge pairs of blocks keeping only the best K until one block is left
+    # that's O(n*log(K)^2) work instead of O(n*log(n)^2) for a full sort
+    if (K:=2**math.ceil(math.log2(max(k, 1)))) * 2 >= (n:=self.shape[dim]):
+      x, idx = self.sort(dim, descending=largest)
+      return x[(slice(None),)*dim + (slice(k),)], idx[(slice(None),)*dim + (slice(k),)]
+    x = self.transpose(dim, -1)
+    fill, stages = dtypes.min(x.dtype) if largest else dtypes.max(x.dtype), int(math.log2(K))
+    x = x.pad((0, round_up(n, K) - n), value=fill)
+    x, idx = Tensor._bitonic(x, Tensor.arange(x.shape[-1], requires_grad=False, device=self.device).expand(x.shape), stages, largest, 1)
+    while x.shape[-1] > K:
+      if x.shape[-1] % (2*K): x, idx = x.pad((0, K), value=fill), idx.pad((0, K), value=n)
+      # the best K of two sorted blocks are the better of each element and its mirror in the other block, and they form a bitonic sequence
+      (x_a, x_b), (idx_a, idx_b) = x.reshape(x.shape[:-1]+(-1, 2, K)).split(1, -2), idx.reshape(idx.shape[:-1]+(-1, 2, K)).split(1, -2)
+      first = Tensor._bitonic_first(x_a, idx_a, x_b.flip(-1), idx_b.flip(-1), largest)
+      x, idx = [first.where(a, b.flip(-1)).reshape(t.shape[:-1]+(-1,)) for a, b, t in ((x_a, x_b, x), (idx_a, idx_b, idx))]
+      x, idx = Tensor._bitonic(x, idx, stages, largest, stages)
+    return x[..., :k].transpose(dim, -1), idx[..., :k].transpose(dim, -1)
 
   # ***** unary ops *****
 
@@ -3813,16 +3837,41 @@ class Tensor(SimpleMathTrait):
     """
     # NOTE: it also works when `key` and `value` have symbolic shape.
     assert all_int(self.shape), f"does not support symbolic shape {self.shape}"
+    if is_causal and attn_mask is not None: raise RuntimeError("cannot set attn_mask when is_causal=True")
+    if FLASH_ATTENTION and isinstance(key.shape[-2], int) and key.shape[-2] > FLASH_ATTENTION.value:
+      return self._flash_attention(key, value, attn_mask, dropout_p, is_causal, FLASH_ATTENTION.value)
     qk = self.matmul(key.transpose(-2,-1), dtype=least_upper_dtype(self.dtype, key.dtype, dtypes.float32)) / math.sqrt(self.shape[-1])
     # handle attention mask
-    if is_causal:
-      if attn_mask is not None: raise RuntimeError("cannot set attn_mask when is_causal=True")
-      attn_mask = qk.ones_like(requires_grad=False, device=self.device, dtype=dtypes.bool).tril()
+    if is_causal: attn_mask = qk.ones_like(requires_grad=False, device=self.device, dtype=dtypes.bool).tril()
     if attn_mask is not None:
       if attn_mask.dtype == dtypes.bool: attn_mask = attn_mask.where(0, -float("inf"))
       qk = qk + attn_mask
     return qk.cast(self.dtype).softmax(-1).dropout(dropout_p) @ value
 
+  def _flash_attention(self, key:Tensor, value:Tensor, attn_mask:Tensor|None, dropout_p:float, is_causal:bool, block:int) -> Tensor:
+    # online softmax over blocks of keys, only a (..., query, block) slice of the scores is alive at once
+    # https://arxiv.org/abs/2205.14135
+    acc_dtype = least_upper_dtype(self.dtype, key.dtype, dtypes.float32)
+    shape = _broadcast_shape(self.shape[:-2], key.shape[:-2]) + (self.shape[-2], key.shape[-2])
+    if attn_mask is not None:
+      if attn_mask.dtype == dtypes.bool: attn_mask = attn_mask.where(0, -float("inf"))
+      attn_mask = attn_mask._broadcast_to(_broadcast_shape(shape, attn_mask.shape))
+    m: Tensor|None = None
+    for i in range(0, key.shape[-2], block):
+      qk = self.matmul(key[..., i:i+block, :].transpose(-2,-1), dtype=acc_dtype) / math.sqrt(self.shape[-1])
+      # the causal mask of each block is its own view of a const, sharing one would realize it and run the blocks out of order
+      if is_causal: qk = Tensor.ones(qk.shape[-2:], requires_grad=False, device=self.device, dtype=dtypes.bool).tril(-i).where(qk, -float("inf"))
+      if attn_mask is not None: qk = qk + attn_mask[..., i:i+block]
+      m_new = qk.max(-1, keepdim=True) if m is None else m.maximum(qk.max(-1, keepdim=True))
+      # rows that are fully masked so far have a max of -inf, shift them by 0 so they stay 0 instead of nan
+      m_shift = (m_new == -float("inf")).where(0, m_new)
+      p = (qk - m_shift).exp()
+      l_blk, o_blk = p.sum(-1, keepdim=True), p.dropout(dropout_p).matmul(value[..., i:i+block, :], dtype=acc_dtype)
+      if m is None: l, o = l_blk, o_blk
+      else: l, o = (l * (m - m_shift).exp() + l_blk).contiguous(), (o * (m - m_shift).exp() + o_blk).contiguous()
+      m = m_new
+    return (o / l).cast(least_upper_dtype(self.dtype, value.dtype))
+
   def _do_reduction(self, reduction:ReductionStr="mean") -> Tensor:
     if reduction not in get_args(ReductionStr): raise ValueError(f"{reduction=} must be one of {get_args(ReductionStr)}")
     reductions: dict[str, Callable[[Tensor], Tensor]] = {"mean": Tensor.mean, "sum": Tensor.sum, "none": lambda x: x}
@@ -4224,9 +4273,9 @@ def _metadata_wrapper(fn: Callable[P, T]) -> Callable[P, T]:
     else: caller = ""
 
     token = _METADATA.set(Metadata(name=fn.__name__, caller=caller))
-    ret = fn(*args, **kwargs)
-    _METADATA.reset(token)
-    return ret
+    # reset even if fn raises, or every later op would get this metadata
+    try: return fn(*args, **kwargs)
+    finally: _METADATA.reset(token)
   return _wrapper
 
 if TRACEMETA >= 1:
@@ -6,7 +6,7 @@ from typing import Any, Callable, TypedDict, Generator
 from tinygrad.helpers import colored, getenv, tqdm, unwrap, word_wrap
 from tinygrad.ops import TrackedGraphRewrite, UOp, Ops, lines, GroupOp
 from tinygrad.codegen.kernel import Kernel
-from tinygrad.device import ProfileEvent, ProfileDeviceEvent, ProfileRangeEvent, ProfileGraphEvent
+from tinygrad.device import ProfileEvent, ProfileDeviceEvent, ProfileRangeEvent, ProfileGraphEvent, ProfileMemoryEvent
 from tinygrad.dtype import dtypes
 
 uops_colors = {Ops.LOAD: "#ffc0c0", Ops.STORE: "#87CEEB", Ops.CONST: "#e0e0e0", Ops.VCONST: "#e0e0e0", Ops.REDUCE: "#FF5B5B",
@@ -113,12 +113,34 @@ def graph_ev_to_perfetto_json(ev:ProfileGraphEvent, reccnt):
       ret += [{"ph": "s", **dev_to_pid(d.device, d.is_copy), "id": reccnt+len(ret), "ts": prep_ts(d.device, ev.sigs[d.en_id], d.is_copy), "bp": "e"}]
       ret += [{"ph": "f", **dev_to_pid(e.device, e.is_copy), "id": reccnt+len(ret)-1, "ts": prep_ts(e.device, st, e.is_copy), "bp": "e"}]
   return ret
+# memory events are timestamped on the host, they don't get the device's clock offset
+def mem_ev_to_perfetto_json(ev:ProfileMemoryEvent):
+  return [{"name": "memory", "ph": "C", "ts": int(ev.ts), "pid": dev_to_pid(ev.device)["pid"], "args": {"MB": ev.mem_used/1e6}}]
+def memory_peaks(profile:list[ProfileEvent]) -> dict[str, tuple[int, decimal.Decimal, dict[str, int]]]:
+  # per device: peak bytes, when it was reached and the live bytes by the kernel that allocated them at that point
+  peaks: dict[str, tuple[int, decimal.Decimal, dict[str, int]]] = {}
+  live: dict[str, dict[str, int]] = {}
+  for ev in profile:
+    if not isinstance(ev, ProfileMemoryEvent): continue
+    owners = live.setdefault(ev.device, {})
+    name = (ev.name + (f" {[str(m) for m in ev.metadata]}" if ev.metadata else "")) or "(no kernel)"
+    owners[name] = owners.get(name, 0) + ev.nbytes
+    if ev.device not in peaks or ev.mem_used > peaks[ev.device][0]: peaks[ev.device] = (ev.mem_used, ev.ts, {k:v for k,v in owners.items() if v})
+  return peaks
 def to_perfetto(profile:list[ProfileEvent]):
   # Start json with devices.
   prof_json = [x for ev in profile if isinstance(ev, ProfileDeviceEvent) for x in dev_ev_to_perfetto_json(ev)]
+  # memory events are recorded on the host clock, also for devices that never registered
+  registered = {ev.device for ev in profile if isinstance(ev, ProfileDeviceEvent)}
+  for d in dict.fromkeys(ev.device for ev in profile if isinstance(ev, ProfileMemoryEvent) and ev.device not in registered):
+    prof_json += dev_ev_to_perfetto_json(ProfileDeviceEvent(d))
   for ev in tqdm(profile, desc="preparing profile"):
     if isinstance(ev, ProfileRangeEvent): prof_json += range_ev_to_perfetto_json(ev)
     elif isinstance(ev, ProfileGraphEvent): prof_json += graph_ev_to_perfetto_json(ev, reccnt=len(prof_json))
+    elif isinstance(ev, ProfileMemoryEvent): prof_json += mem_ev_to_perfetto_json(ev)
+  for d,(peak,ts,owners) in memory_peaks(profile).items():
+    prof_json += [{"name": f"peak memory {peak/1e6:.2f} MB", "ph": "i", "s": "p", "ts": int(ts), "pid": dev_to_pid(d)["pid"],
+                   "args": {k:f"{v/1e6:.2f} MB" for k,v in sorted(owners.items(), key=lambda x: -x[1])}}]
   return json.dumps({"traceEvents": prof_json}).encode() if len(prof_json) > 0 else None
 
 # ** HTTP server